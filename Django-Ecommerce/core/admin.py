@@ -1,16 +1,84 @@
-from django.contrib import admin
+import time
+from datetime import timedelta
 
-from .models import Item, OrderItem, Order, Payment, Coupon, Refund, BillingAddress, Category, Slide
+from django.conf import settings
+from django.contrib import admin, messages
+from django.core.exceptions import PermissionDenied
+from django.db import models
+from django.db.models import Q, Sum
+from django.http import StreamingHttpResponse
+from django.template.response import TemplateResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .catalog import clone_items, csv_lines, export_rows, ndjson_lines
+from .forms import HeaderImageField
+from .inventory import reshard
+from .models import Item, OrderItem, Order, Payment, PaymentAttempt, Coupon, Refund, BillingAddress, Category, Slide, StockReservation, StripeEvent, DailySales
+from .pagination import EstimatedCountPaginator
+from .refunds import enqueue_refunds, execute_refunds
+from .reports import dashboard
 
 
 # Register your models here.
 
 
 def make_refund_accepted(modeladmin, request, queryset):
-    queryset.update(refund_requested=False, refund_granted=True)
+    queued = enqueue_refunds(queryset)
+    if settings.REFUND_ASYNC:
+        modeladmin.message_user(
+            request, '{} refunds queued for processing'.format(queued))
+        return
+    # REFUND_ASYNC is off: the refunds go out from this request, up to
+    # REFUND_WORKERS at a time
+    results = execute_refunds(orders=queryset)
+    modeladmin.message_user(request, (
+        '{} refunds issued while this page waited, {} at a time; set '
+        'REFUND_ASYNC=1 to leave them to process_refunds').format(
+            results.get('S', 0), settings.REFUND_WORKERS))
+    failed = results.get('F', 0)
+    if failed:
+        modeladmin.message_user(
+            request, '{} refunds could not be issued, see Refunds'.format(failed),
+            messages.WARNING)
+    retrying = results.get('Q', 0)
+    if retrying:
+        modeladmin.message_user(
+            request, '{} refunds hit a gateway error and were queued again'.format(retrying),
+            messages.WARNING)
+
+
+make_refund_accepted.short_description = 'Refund selected orders'
+
 
+class UserFilter(admin.SimpleListFilter):
+    '''
+    A username box instead of one link per user.
+    '''
+    title = 'user'
+    parameter_name = 'username'
+    template = 'admin/input_filter.html'
 
-make_refund_accepted.short_description = 'Update orders to refund granted'
+    def lookups(self, request, model_admin):
+        # never shown; a filter without lookups is not rendered at all
+        return (('', ''),)
+
+    def choices(self, changelist):
+        yield {
+            'selected': self.value() is None,
+            'query_string': changelist.get_query_string(remove=[self.parameter_name]),
+            # the other active filters, carried along by the form
+            'query_parts': [
+                (k, v) for k, v in changelist.get_filters_params().items()
+                if k != self.parameter_name
+            ],
+            'display': 'All',
+        }
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(user__username=self.value().strip())
+        return queryset
 
 
 class OrderAdmin(admin.ModelAdmin):
@@ -32,7 +100,15 @@ class OrderAdmin(admin.ModelAdmin):
         'payment',
         'coupon'
     ]
-    list_filter = ['user',
+    # the addresses and the payment print their user's name
+    list_select_related = [
+        'user',
+        'shipping_address__user',
+        'billing_address__user',
+        'payment__user',
+        'coupon'
+    ]
+    list_filter = [UserFilter,
                    'ordered',
                    'being_delivered',
                    'received',
@@ -42,8 +118,22 @@ class OrderAdmin(admin.ModelAdmin):
         'user__username',
         'ref_code'
     ]
+    raw_id_fields = ['user', 'items', 'shipping_address', 'billing_address',
+                     'payment', 'coupon']
+    paginator = EstimatedCountPaginator
+    # skips the second COUNT(*) over the whole table
+    show_full_result_count = False
     actions = [make_refund_accepted]
 
+    def get_search_results(self, request, queryset, search_term):
+        # exact matches on the unique ref_code and username indexes
+        # rather than LIKE '%term%' scans
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        return queryset.filter(
+            Q(ref_code=term.lower()) | Q(user__username=term)), False
+
 
 class AddressAdmin(admin.ModelAdmin):
     list_display = [
@@ -56,27 +146,172 @@ class AddressAdmin(admin.ModelAdmin):
         'default'
     ]
     list_filter = ['default', 'address_type', 'country']
-    search_fields = ['user', 'street_address', 'apartment_address', 'zip']
+    list_select_related = ['user']
+    search_fields = ['user__username', 'street_address', 'apartment_address', 'zip']
+
+
+class PaymentAttemptAdmin(admin.ModelAdmin):
+    list_display = [
+        'idempotency_key',
+        'order',
+        'amount',
+        'status',
+        'stripe_charge_id',
+        'updated'
+    ]
+    list_filter = ['status']
+    search_fields = ['idempotency_key', 'stripe_charge_id']
+    raw_id_fields = ['order', 'user', 'payment']
+
+
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = [
+        'item',
+        'order',
+        'quantity',
+        'expires_at',
+        'committed'
+    ]
+    list_filter = ['committed']
+    raw_id_fields = ['item', 'order']
+
+
+class CouponAdmin(admin.ModelAdmin):
+    list_display = [
+        'code',
+        'amount',
+        'percent_off',
+        'min_spend',
+        'uses',
+        'max_uses',
+        'valid_until',
+        'active'
+    ]
+    list_filter = ['active']
+    search_fields = ['code']
+    readonly_fields = ['uses']
+
+
+class RefundAdmin(admin.ModelAdmin):
+    list_display = [
+        'order',
+        'email',
+        'status',
+        'attempts',
+        'stripe_refund_id',
+        'updated'
+    ]
+    list_filter = ['status', 'accepted']
+    search_fields = ['=stripe_refund_id', 'email']
+    raw_id_fields = ['order']
+
+
+class DailySalesAdmin(admin.ModelAdmin):
+    '''
+    A dashboard over the rollups in place of the changelist.
+    '''
+    change_list_template = 'admin/sales_dashboard.html'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def changelist_view(self, request, extra_context=None):
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        end = parse_date(request.GET.get('end', '')) or timezone.localdate()
+        start = parse_date(request.GET.get('start', '')) or end - timedelta(days=29)
+        context = dict(
+            self.admin_site.each_context(request),
+            title='Sales',
+            opts=self.model._meta,
+            start=start,
+            end=end,
+            **dashboard(start, end),
+            **(extra_context or {})
+        )
+        request.current_app = self.admin_site.name
+        return TemplateResponse(request, self.change_list_template, context)
+
+
+class StripeEventAdmin(admin.ModelAdmin):
+    list_display = [
+        'event_id',
+        'type',
+        'received',
+        'processed'
+    ]
+    list_filter = ['type']
+    search_fields = ['=event_id']
 
 
 def copy_items(modeladmin, request, queryset):
-    for object in queryset:
-        object.id = None
-        object.save()
+    started = time.monotonic()
+    copied = clone_items(queryset)
+    modeladmin.message_user(request, 'Copied {} items in {:.2f}s'.format(
+        copied, time.monotonic() - started))
 
 
 copy_items.short_description = 'Copy Items'
 
 
+def export_items_csv(modeladmin, request, queryset):
+    response = StreamingHttpResponse(
+        csv_lines(export_rows(queryset)), content_type='text/csv')
+    response['Content-Disposition'] = 'attachment; filename="items.csv"'
+    return response
+
+
+export_items_csv.short_description = 'Export selected items as CSV'
+
+
+def export_items_ndjson(modeladmin, request, queryset):
+    response = StreamingHttpResponse(
+        ndjson_lines(export_rows(queryset)), content_type='application/x-ndjson')
+    response['Content-Disposition'] = 'attachment; filename="items.ndjson"'
+    return response
+
+
+export_items_ndjson.short_description = 'Export selected items as NDJSON'
+
+
 class ItemAdmin(admin.ModelAdmin):
     list_display = [
         'title',
         'category',
+        'available_stock',
+        'stock_shards',
     ]
     list_filter = ['title', 'category']
     search_fields = ['title', 'category']
     prepopulated_fields = {"slug": ("title",)}
-    actions = [copy_items]
+    actions = [copy_items, export_items_csv, export_items_ndjson]
+
+    def get_queryset(self, request):
+        # slot totals for the whole page in the changelist query
+        return super().get_queryset(request).annotate(slot_stock=Sum('stockslot__stock'))
+
+    def available_stock(self, obj):
+        if obj.is_sharded:
+            return obj.slot_stock or 0
+        return obj.stock
+
+    def get_object(self, request, object_id, from_field=None):
+        obj = super().get_object(request, object_id, from_field)
+        if obj is not None and obj.is_sharded:
+            # edit the summed total, not the placeholder on the item row
+            obj.stock = obj.get_stock()
+        return obj
+
+    def save_model(self, request, obj, form, change):
+        total = obj.stock
+        if obj.is_sharded:
+            obj.stock = 0
+        super().save_model(request, obj, form, change)
+        if 'stock_shards' in form.changed_data or (obj.is_sharded and 'stock' in form.changed_data):
+            reshard(obj, obj.stock_shards, total)
 
 class CategoryAdmin(admin.ModelAdmin):
     list_display = [
@@ -86,14 +321,27 @@ class CategoryAdmin(admin.ModelAdmin):
     list_filter = ['title', 'is_active']
     search_fields = ['title', 'is_active']
     prepopulated_fields = {"slug": ("title",)}
+    formfield_overrides = {
+        models.ImageField: {'form_class': HeaderImageField},
+    }
+
+
+class SlideAdmin(admin.ModelAdmin):
+    formfield_overrides = {
+        models.ImageField: {'form_class': HeaderImageField},
+    }
 
 
 admin.site.register(Item, ItemAdmin)
 admin.site.register(Category, CategoryAdmin)
-admin.site.register(Slide)
+admin.site.register(Slide, SlideAdmin)
 admin.site.register(OrderItem)
 admin.site.register(Order, OrderAdmin)
 admin.site.register(Payment)
-admin.site.register(Coupon)
-admin.site.register(Refund)
+admin.site.register(PaymentAttempt, PaymentAttemptAdmin)
+admin.site.register(Coupon, CouponAdmin)
+admin.site.register(Refund, RefundAdmin)
+admin.site.register(StockReservation, StockReservationAdmin)
+admin.site.register(StripeEvent, StripeEventAdmin)
+admin.site.register(DailySales, DailySalesAdmin)
 admin.site.register(BillingAddress, AddressAdmin)
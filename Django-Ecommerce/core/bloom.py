@@ -0,0 +1,52 @@
+"""
+A plain Bloom filter: answers "definitely not present" or "maybe present"
+for a set of strings in a fixed number of bits.
+"""
+import hashlib
+import math
+import os
+import struct
+
+HEADER = struct.Struct('>QQQ')
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate=0.001):
+        capacity = max(capacity, 1)
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def positions(self, value):
+        digest = hashlib.blake2b(value.encode('utf-8'), digest_size=16).digest()
+        # double hashing: k positions out of two 64-bit halves
+        h1, h2 = struct.unpack('>QQ', digest)
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, value):
+        for position in self.positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value):
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self.positions(value))
+
+    def save(self, path):
+        # write aside and swap, so readers never load half a file
+        tmp = '{}.tmp'.format(path)
+        with open(tmp, 'wb') as f:
+            f.write(HEADER.pack(self.size, self.hashes, self.count))
+            f.write(self.bits)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            size, hashes, count = HEADER.unpack(f.read(HEADER.size))
+            bits = bytearray(f.read())
+        bloom = cls.__new__(cls)
+        bloom.size, bloom.hashes, bloom.count, bloom.bits = size, hashes, count, bits
+        return bloom
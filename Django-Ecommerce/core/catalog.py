@@ -0,0 +1,269 @@
+"""
+Bulk operations on the item catalogue: cloning, and CSV / NDJSON export
+and import that stream in chunks so a feed of any size runs in constant
+memory.
+"""
+import csv
+import json
+
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.db.models import Sum
+
+from .models import Category, Item, StockSlot
+
+
+def insert_batch_size(objs, limit=1000):
+    # never above what the backend takes in one statement (about 70 items
+    # on SQLite)
+    fields = [f for f in Item._meta.concrete_fields if not f.primary_key]
+    return min(limit, connection.ops.bulk_batch_size(fields, objs))
+
+
+def unique_slug(slug, taken, max_length):
+    """
+    `slug`-copy, `slug`-copy-2, ... whichever is free first; the result
+    is added to `taken`.
+    """
+    n = 1
+    while True:
+        suffix = '-copy' if n == 1 else '-copy-{}'.format(n)
+        candidate = slug[:max_length - len(suffix)] + suffix
+        if candidate not in taken:
+            taken.add(candidate)
+            return candidate
+        n += 1
+
+
+def slot_totals(item_ids):
+    return dict(StockSlot.objects.filter(item_id__in=item_ids).values(
+        'item_id').annotate(total=Sum('stock')).values_list('item_id', 'total'))
+
+
+def clone_items(queryset, batch_size=1000):
+    """
+    Copies the selected items with fresh slugs in a handful of queries:
+    one read of the selection, one of the existing slugs and one INSERT
+    per `batch_size` copies. Returns the number of copies.
+    """
+    items = list(queryset.order_by('pk'))
+    if not items:
+        return 0
+    totals = slot_totals([item.pk for item in items if item.is_sharded])
+    taken = set(Item.objects.values_list('slug', flat=True))
+    max_length = Item._meta.get_field('slug').max_length
+
+    copies = []
+    for item in items:
+        if item.is_sharded:
+            # copies start on a single stock row; reshard them separately
+            item.stock = totals.get(item.pk, 0)
+            item.stock_shards = 0
+        item.pk = None
+        item.slug = unique_slug(item.slug, taken, max_length)
+        copies.append(item)
+    with transaction.atomic():
+        Item.objects.bulk_create(copies, batch_size=insert_batch_size(copies, batch_size))
+    return len(copies)
+
+
+# columns of an exported item, in file order; category is the slug
+ITEM_FIELDS = [
+    'slug', 'stock_no', 'title', 'category', 'category_title', 'price',
+    'discount_price', 'label', 'stock', 'description_short',
+    'description_long', 'image', 'is_active',
+]
+# what an import may change on an existing item
+UPDATE_FIELDS = [
+    'stock_no', 'title', 'category', 'price', 'discount_price', 'label',
+    'stock', 'description_short', 'description_long', 'image', 'is_active',
+]
+
+
+class Echo:
+    # csv.writer wants a file; this one hands each line straight back
+    def write(self, value):
+        return value
+
+
+def export_chunk(chunk):
+    # the real count of a sharded item lives in its slots; one query
+    # per chunk sums them all
+    totals = slot_totals([pk for pk, row in chunk if row['stock_shards'] > 1])
+    for pk, row in chunk:
+        if row.pop('stock_shards') > 1:
+            row['stock'] = totals.get(pk, 0)
+        yield row
+
+
+def export_rows(queryset, chunk_size=2000):
+    """
+    Yields one dict per item, reading `chunk_size` rows at a time.
+    """
+    rows = queryset.order_by('pk').values_list(
+        'pk', 'slug', 'stock_no', 'title', 'category__slug', 'category__title',
+        'price', 'discount_price', 'label', 'stock', 'stock_shards',
+        'description_short', 'description_long', 'image', 'is_active')
+    columns = ITEM_FIELDS[:9] + ['stock_shards'] + ITEM_FIELDS[9:]
+    chunk = []
+    for row in rows.iterator(chunk_size=chunk_size):
+        chunk.append((row[0], dict(zip(columns, row[1:]))))
+        if len(chunk) >= chunk_size:
+            yield from export_chunk(chunk)
+            chunk = []
+    yield from export_chunk(chunk)
+
+
+def csv_lines(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(ITEM_FIELDS)
+    for row in rows:
+        yield writer.writerow(['' if row[f] is None else row[f] for f in ITEM_FIELDS])
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(row) + '\n'
+
+
+def read_rows(f, fmt):
+    # NDJSON lines are decoded by import_rows, so a malformed line is
+    # rejected under its line number instead of ending the import
+    if fmt == 'csv':
+        return csv.DictReader(f)
+    return iter(f)
+
+
+def load_line(line):
+    try:
+        row = json.loads(line)
+    except ValueError as e:
+        raise ValidationError('invalid JSON: {}'.format(e))
+    if not isinstance(row, dict):
+        raise ValidationError('expected a JSON object')
+    return row
+
+
+REQUIRED_FIELDS = ['slug', 'title', 'price', 'label']
+MAX_ERRORS = 100
+
+
+def parse_row(row, categories):
+    """
+    Turns a CSV or NDJSON row into field values for Item. Raises
+    ValidationError.
+    """
+    values = {}
+    for name in ['slug'] + UPDATE_FIELDS:
+        if name == 'category':
+            continue
+        field = Item._meta.get_field(name)
+        value = row.get(name)
+        if value in ('', None):
+            if name in REQUIRED_FIELDS:
+                raise ValidationError('{} is required'.format(name))
+            value = None if field.null else field.get_default()
+        else:
+            value = field.to_python(value)
+        if field.choices and value not in dict(field.choices):
+            raise ValidationError('{} must be one of {}'.format(
+                name, ', '.join(dict(field.choices))))
+        values[name] = value
+    values['category_id'] = categories.id_for(row.get('category'), row.get('category_title'))
+    return values
+
+
+class CategoryCache(dict):
+    '''
+    slug -> id, creating categories the feed mentions for the first time.
+    '''
+    def __init__(self, dry_run=False):
+        super().__init__()
+        self.dry_run = dry_run
+
+    def id_for(self, slug, title=None):
+        if not slug:
+            raise ValidationError('category is required')
+        if slug not in self:
+            category = Category.objects.filter(slug=slug).first()
+            if category is None and not self.dry_run:
+                category = Category(slug=slug, title=title or slug, description='', image='')
+                category.full_clean(exclude=['description', 'image'])
+                category.save()
+            self[slug] = category.pk if category else None
+        return self[slug]
+
+
+def import_rows(rows, batch_size=1000, dry_run=False):
+    """
+    Creates or updates items from `rows`, matched on slug, then on SKU
+    (stock_no) when exactly one item has it. Only `batch_size` rows are
+    held at a time. NDJSON rows arrive as undecoded lines. Returns a dict
+    of counts plus (row number, error) for the first MAX_ERRORS rejected
+    rows; for NDJSON the row number is the line number.
+    """
+    stats = {'created': 0, 'updated': 0, 'unchanged': 0, 'failed': 0, 'errors': []}
+    categories = CategoryCache(dry_run)
+    batch = []
+    for number, row in enumerate(rows, start=1):
+        try:
+            if isinstance(row, str):
+                if not row.strip():
+                    continue
+                row = load_line(row)
+            batch.append(parse_row(row, categories))
+        except ValidationError as e:
+            stats['failed'] += 1
+            if len(stats['errors']) < MAX_ERRORS:
+                stats['errors'].append((number, '; '.join(e.messages)))
+        if len(batch) >= batch_size:
+            apply_batch(batch, stats, dry_run)
+            batch = []
+    if batch:
+        apply_batch(batch, stats, dry_run)
+    return stats
+
+
+def apply_batch(batch, stats, dry_run):
+    by_slug = {}
+    for item in Item.objects.filter(slug__in=[v['slug'] for v in batch]).order_by('-pk'):
+        # duplicated slugs from older copies: the oldest item wins
+        by_slug[item.slug] = item
+    skus = [v['stock_no'] for v in batch if v['slug'] not in by_slug and v['stock_no']]
+    by_sku = {}
+    for item in Item.objects.filter(stock_no__in=skus):
+        # an ambiguous SKU matches nothing
+        by_sku[item.stock_no] = None if item.stock_no in by_sku else item
+
+    new, changed, fields = [], [], set()
+    for values in batch:
+        item = by_slug.get(values['slug']) or by_sku.get(values['stock_no'])
+        if item is None:
+            new.append(Item(**values))
+            # a later row with the same slug updates this one
+            by_slug[values['slug']] = new[-1]
+            continue
+        dirty = []
+        for name, value in values.items():
+            if name == 'stock' and item.is_sharded:
+                # use reshard to set a sharded count
+                continue
+            if getattr(item, name) != value:
+                setattr(item, name, value)
+                dirty.append(name)
+        if not dirty:
+            stats['unchanged'] += 1
+        elif item.pk is not None:
+            changed.append(item)
+            fields.update(dirty)
+
+    stats['created'] += len(new)
+    stats['updated'] += len({item.pk for item in changed})
+    if dry_run:
+        return
+    with transaction.atomic():
+        Item.objects.bulk_create(new, batch_size=insert_batch_size(new))
+        if changed:
+            Item.objects.bulk_update(
+                list({item.pk: item for item in changed}.values()), sorted(fields),
+                batch_size=insert_batch_size(changed))
@@ -0,0 +1,173 @@
+"""
+Coupon lookup and redemption.
+
+Active coupons are loaded into a per-process dict keyed by code and kept
+for COUPON_CACHE_TTL seconds, or until a coupon is saved or deleted in
+this process. Applying a coupon is checked against that snapshot only;
+the one database write is ``redeem``, which counts the use with a
+conditional UPDATE so ``max_uses`` holds however many checkouts race for
+the last one.
+
+Codes minted in bulk for a campaign stay out of that snapshot. They are
+looked up one by one, behind a Bloom filter of every campaign code that
+generate_coupons rebuilds (COUPON_FILTER_PATH), so a guessed code is
+turned away without a query.
+"""
+import os
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .bloom import BloomFilter
+from .models import Coupon, Order
+
+_rules = None
+_loaded_at = 0
+_filter = None
+_filter_mtime = None
+_filter_checked_at = 0
+_lock = threading.Lock()
+
+
+def normalize(code):
+    return (code or '').strip().upper()
+
+
+def get_rules():
+    global _rules, _loaded_at
+    with _lock:
+        if _rules is None or time.monotonic() - _loaded_at >= settings.COUPON_CACHE_TTL:
+            _rules = {
+                normalize(coupon.code): coupon
+                for coupon in Coupon.objects.filter(active=True, campaign='')
+            }
+            _loaded_at = time.monotonic()
+        return _rules
+
+
+def get_filter():
+    """
+    The campaign code filter, re-read when generate_coupons has replaced
+    the file. None if there is no filter yet.
+    """
+    global _filter, _filter_mtime, _filter_checked_at
+    with _lock:
+        if time.monotonic() - _filter_checked_at < settings.COUPON_CACHE_TTL:
+            return _filter
+        _filter_checked_at = time.monotonic()
+        try:
+            mtime = os.stat(settings.COUPON_FILTER_PATH).st_mtime
+        except FileNotFoundError:
+            _filter = _filter_mtime = None
+            return None
+        if mtime != _filter_mtime:
+            _filter = BloomFilter.load(settings.COUPON_FILTER_PATH)
+            _filter_mtime = mtime
+        return _filter
+
+
+def might_exist(code):
+    bloom = get_filter()
+    # without a filter every code has to be looked up
+    return bloom is None or code in bloom
+
+
+def rebuild_filter(error_rate=0.001, chunk_size=10000):
+    """
+    Rebuilds the campaign code filter from the database and returns it.
+    """
+    codes = Coupon.objects.exclude(campaign='').values_list('code', flat=True)
+    bloom = BloomFilter(int(codes.count() * 1.1) + 1000, error_rate)
+    for code in codes.iterator(chunk_size=chunk_size):
+        bloom.add(normalize(code))
+    bloom.save(settings.COUPON_FILTER_PATH)
+    invalidate()
+    return bloom
+
+
+@receiver(post_save, sender=Coupon)
+@receiver(post_delete, sender=Coupon)
+def invalidate(instance=None, **kwargs):
+    global _rules, _filter_checked_at
+    with _lock:
+        _rules = None
+        _filter_checked_at = 0
+        if instance is not None and instance.campaign and _filter is not None:
+            # a campaign code edited in the admin; only this process learns
+            # of it until the filter is rebuilt
+            _filter.add(normalize(instance.code))
+
+
+def find(code, subtotal, now=None):
+    """
+    Returns (coupon, error). A shared coupon is a cached instance; treat
+    it as read-only. Its `uses` may lag behind, which only matters to
+    `redeem`.
+    """
+    code = normalize(code)
+    coupon = get_rules().get(code)
+    if coupon is None and might_exist(code):
+        coupon = Coupon.objects.filter(code=code, active=True).first()
+    if coupon is None:
+        return None, "This coupon does not exist"
+    error = coupon.get_error(subtotal, now)
+    if error:
+        return None, error
+    return coupon, None
+
+
+def redeem(order, now=None):
+    """
+    Counts the order's use of its coupon, once. Returns False, and counts
+    nothing, if the coupon no longer applies: run out, switched off,
+    outside its validity window or above the order's subtotal.
+    """
+    if not order.coupon_id:
+        return True
+    now = now or timezone.now()
+    if not order.coupon_redeemed and order.coupon.get_error(order.get_subtotal(), now):
+        return False
+    # two single-row UPDATEs rather than a transaction, so concurrent
+    # checkouts never hold a lock across both rows; the order flag goes
+    # first so a retried payment cannot count twice
+    if not Order.objects.filter(
+            pk=order.pk, coupon_redeemed=False).update(coupon_redeemed=True):
+        return True
+    if Coupon.objects.filter(
+            Q(max_uses__isnull=True) | Q(uses__lt=F('max_uses')),
+            Q(valid_from__isnull=True) | Q(valid_from__lte=now),
+            Q(valid_until__isnull=True) | Q(valid_until__gt=now),
+            pk=order.coupon_id, active=True,
+    ).update(uses=F('uses') + 1):
+        order.coupon_redeemed = True
+        return True
+    Order.objects.filter(pk=order.pk).update(coupon_redeemed=False)
+    return False
+
+
+def release(order):
+    """
+    Gives back a use counted by `redeem`, e.g. after a declined card.
+    """
+    if Order.objects.filter(
+            pk=order.pk, coupon_redeemed=True).update(coupon_redeemed=False):
+        Coupon.objects.filter(pk=order.coupon_id, uses__gt=0).update(
+            uses=F('uses') - 1)
+    order.coupon_redeemed = False
+
+
+def release_orders(orders):
+    """
+    Bulk `release` for carts that are about to be deleted.
+    """
+    counts = Counter(orders.filter(coupon_redeemed=True).values_list(
+        'coupon_id', flat=True))
+    for coupon_id, count in counts.items():
+        Coupon.objects.filter(pk=coupon_id, uses__gte=count).update(
+            uses=F('uses') - count)
@@ -0,0 +1,162 @@
+"""
+A small in-process stand-in for the parts of the Stripe API the shop uses
+(charges and refunds).
+
+Point ``STRIPE_API_BASE`` at it to load-test checkout offline. It honours
+the ``Idempotency-Key`` header the same way Stripe does: a repeated key
+replays the first response instead of creating a second charge, and a
+key whose first request is still running gets a 409.
+"""
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+DECLINED_TOKEN = 'tok_chargeDeclined'
+
+
+class FakeStripeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        params = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode()).items()}
+        key = self.headers.get('Idempotency-Key')
+        with self.server.lock:
+            busy = key in self.server.in_flight
+            if key and not busy:
+                self.server.in_flight.add(key)
+        if busy:
+            return self.respond(409, {'error': {
+                'type': 'idempotency_error',
+                'message': 'There is currently another in-progress request '
+                           'using this Idempotent Key.'}})
+        try:
+            self.handle_post(params, key)
+        finally:
+            with self.server.lock:
+                self.server.in_flight.discard(key)
+
+    def handle_post(self, params, key):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        with self.server.lock:
+            failing = self.server.fail_next > 0
+            self.server.fail_next -= failing
+        if failing or (self.server.error_rate and random.random() < self.server.error_rate):
+            return self.respond(500, {'error': {
+                'type': 'api_error', 'message': 'Simulated outage'}})
+
+        with self.server.lock:
+            if key and key in self.server.responses:
+                status, body = self.server.responses[key]
+                return self.respond(status, body, replayed=True)
+            status, body = self.route(params)
+            if key:
+                self.server.responses[key] = (status, body)
+        self.respond(status, body)
+
+    def do_GET(self):
+        obj = self.server.objects.get(self.path.rstrip('/').split('/')[-1])
+        if obj is None:
+            return self.respond(404, {'error': {
+                'type': 'invalid_request_error', 'message': 'No such object'}})
+        self.respond(200, obj)
+
+    def route(self, params):
+        if self.path == '/v1/charges':
+            return self.create_charge(params)
+        if self.path == '/v1/refunds':
+            return self.create_refund(params)
+        return 404, {'error': {
+            'type': 'invalid_request_error',
+            'message': 'Unrecognized request URL (POST: {})'.format(self.path)}}
+
+    def create_charge(self, params):
+        if params.get('source') == DECLINED_TOKEN:
+            return 402, {'error': {
+                'type': 'card_error', 'code': 'card_declined',
+                'message': 'Your card was declined.'}}
+        charge = {
+            'id': 'ch_' + uuid.uuid4().hex[:24],
+            'object': 'charge',
+            'amount': int(params.get('amount', 0)),
+            'currency': params.get('currency', 'usd'),
+            'paid': True,
+            'refunded': False,
+            'status': 'succeeded',
+            'created': int(time.time()),
+        }
+        self.server.objects[charge['id']] = charge
+        self.server.charge_count += 1
+        return 200, charge
+
+    def create_refund(self, params):
+        charge = self.server.objects.get(params.get('charge'))
+        if charge is None or charge.get('object') != 'charge':
+            return 404, {'error': {
+                'type': 'invalid_request_error', 'code': 'resource_missing',
+                'message': 'No such charge: {}'.format(params.get('charge'))}}
+        if charge['refunded']:
+            return 400, {'error': {
+                'type': 'invalid_request_error', 'code': 'charge_already_refunded',
+                'message': 'Charge {} has already been refunded.'.format(charge['id'])}}
+        charge['refunded'] = True
+        refund = {
+            'id': 're_' + uuid.uuid4().hex[:24],
+            'object': 'refund',
+            'amount': int(params.get('amount', charge['amount'])),
+            'charge': charge['id'],
+            'status': 'succeeded',
+            'created': int(time.time()),
+        }
+        self.server.objects[refund['id']] = refund
+        self.server.refund_count += 1
+        return 200, refund
+
+    def respond(self, status, body, replayed=False):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Request-Id', 'req_' + uuid.uuid4().hex[:14])
+        if replayed:
+            self.send_header('Idempotent-Replayed', 'true')
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class FakeStripeServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0, error_rate=0, verbose=False):
+        super().__init__(address, FakeStripeHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.responses = {}
+        # keys whose first request is still being answered
+        self.in_flight = set()
+        self.objects = {}
+        self.charge_count = 0
+        self.refund_count = 0
+        # answer this many upcoming requests with a 500
+        self.fail_next = 0
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
@@ -1,6 +1,70 @@
 from django import forms
+from django.utils.functional import Promise
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+from django.utils.translation import get_language
 from django_countries.fields import CountryField
 from django_countries.widgets import CountrySelectWidget
+from PIL import Image
+
+from .validators import read_header
+
+
+def choices_key(choices):
+    # hashable snapshot of the choices, option groups included
+    return tuple(
+        (str(value), choices_key(label) if isinstance(label, (list, tuple)) else str(label))
+        for value, label in choices)
+
+
+class CachedSelect(forms.Select):
+    """
+    Renders the <select> once per widget class, language, name, attrs and
+    choices with nothing chosen, then marks the selected option in the
+    cached markup. Placed under CountrySelectWidget so its flag layout is
+    left untouched.
+    """
+    _rendered = {}
+
+    def render(self, name, value, attrs=None, renderer=None):
+        final_attrs = self.build_attrs(self.attrs, attrs)
+        key = (type(self), get_language(), name, tuple(sorted(final_attrs.items())),
+               choices_key(self.choices))
+        markup = self._rendered.get(key)
+        if markup is None:
+            markup = super().render(name, None, attrs, renderer)
+            self._rendered[key] = markup
+        selected = [v for v in self.format_value(value) if v]
+        if not selected:
+            return markup
+        markup = markup.replace('<option value="" selected>', '<option value="">', 1)
+        for code in selected:
+            option = '<option value="{}"'.format(escape(code))
+            markup = markup.replace(option + '>', option + ' selected>', 1)
+        return mark_safe(markup)
+
+
+class CachedCountrySelectWidget(CountrySelectWidget, CachedSelect):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # shared by the shallow copies each form instance makes
+        self._choices_by_language = {}
+
+    @property
+    def choices(self):
+        # the sorted, translated list is built once per language rather
+        # than once per form (use_required_attribute walks it)
+        if isinstance(self._choices, Promise):
+            language = get_language()
+            if language not in self._choices_by_language:
+                self._choices_by_language[language] = list(self._choices)
+            return self._choices_by_language[language]
+        return self._choices
+
+    @choices.setter
+    def choices(self, value):
+        self._choices = value
+
 
 PAYMENT_CHOICES = (
     ('S', 'Stripe'),
@@ -17,7 +81,7 @@ class CheckoutForm(forms.Form):
         'placeholder': 'Apartment or suite',
         'class': 'form-control'
     }))
-    country = CountryField(blank_label='(select country)').formfield(widget=CountrySelectWidget(attrs={
+    country = CountryField(blank_label='(select country)').formfield(widget=CachedCountrySelectWidget(attrs={
         'class': 'custom-select d-block w-100'
 
     }))
@@ -43,3 +107,20 @@ class RefundForm(forms.Form):
         'rows': 4
     }))
     email = forms.EmailField()
+
+
+class HeaderImageField(forms.ImageField):
+    """
+    ImageField that only parses the upload's header. The stock field
+    copies in-memory uploads into a second buffer and runs verify() over
+    the whole file; the model's ImageHeaderValidator then checks size,
+    format and dimensions from the same header.
+    """
+
+    def to_python(self, data):
+        f = forms.FileField.to_python(self, data)
+        if f is None:
+            return None
+        fmt = read_header(f)[0]
+        f.content_type = Image.MIME.get(fmt)
+        return f
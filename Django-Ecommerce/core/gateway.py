@@ -0,0 +1,216 @@
+"""
+Client for the payment processor.
+
+Every call to Stripe goes through one ``StripeGateway`` per process. It
+keeps a pooled keep-alive HTTP session, bounds each request with connect
+and read timeouts, retries transient failures with jittered backoff and
+stops calling Stripe altogether while the circuit breaker is open.
+"""
+import random
+import threading
+import time
+from collections import Counter
+
+import requests
+import stripe
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from stripe import api_requestor, http_client, util
+
+# errors after which the charge may or may not exist on Stripe's side;
+# they are safe to retry with the same idempotency key
+RETRYABLE_ERRORS = (
+    stripe.error.APIConnectionError,
+    stripe.error.RateLimitError,
+    stripe.error.APIError,
+)
+
+
+class GatewayUnavailable(stripe.error.APIConnectionError):
+    """
+    Raised without contacting Stripe while the circuit breaker is open.
+    """
+
+
+class RequestInProgress(stripe.error.APIError):
+    """
+    Stripe's 409 for a key whose first request is still being processed:
+    the outcome is not known yet, so it is retried like any transient error.
+    """
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failures and lets a single trial
+    request through once `reset_timeout` seconds have passed.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, threshold=5, reset_timeout=30, clock=time.monotonic):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return self.CLOSED
+        if self.clock() - self.opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow(self):
+        with self.lock:
+            state = self.state
+            if state == self.HALF_OPEN:
+                # one trial at a time; push the window forward for the rest
+                self.opened_at = self.clock()
+                return True
+            return state == self.CLOSED
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = self.clock()
+
+
+class GatewayMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = Counter()
+        self.errors = Counter()
+        self.latency_total = Counter()
+        self.latency_max = Counter()
+
+    def observe(self, operation, seconds, error=None):
+        with self.lock:
+            self.requests[operation] += 1
+            self.latency_total[operation] += seconds
+            self.latency_max[operation] = max(self.latency_max[operation], seconds)
+            if error is not None:
+                self.errors['{}.{}'.format(operation, type(error).__name__)] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'requests': dict(self.requests),
+                'errors': dict(self.errors),
+                'latency_avg_ms': {
+                    op: round(self.latency_total[op] / count * 1000, 2)
+                    for op, count in self.requests.items()
+                },
+                'latency_max_ms': {
+                    op: round(seconds * 1000, 2)
+                    for op, seconds in self.latency_max.items()
+                },
+            }
+
+
+class StripeGateway:
+    def __init__(self, api_key, api_base, connect_timeout=3, read_timeout=10,
+                 max_retries=2, backoff=0.25, backoff_cap=2, pool_size=10,
+                 breaker=None):
+        self.api_key = api_key
+        self.api_base = api_base
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.backoff_cap = backoff_cap
+        self.breaker = breaker or CircuitBreaker()
+        self.metrics = GatewayMetrics()
+
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        self.http_client = http_client.RequestsClient(
+            timeout=(connect_timeout, read_timeout), session=session)
+
+    def create_charge(self, amount, currency, source, idempotency_key):
+        return self.request('charge', '/v1/charges', {
+            'amount': amount,
+            'currency': currency,
+            'source': source,
+        }, idempotency_key)
+
+    def create_refund(self, charge, idempotency_key, amount=None):
+        params = {'charge': charge}
+        if amount is not None:
+            params['amount'] = amount
+        return self.request('refund', '/v1/refunds', params, idempotency_key)
+
+    def request(self, operation, url, params, idempotency_key):
+        attempt = 0
+        while True:
+            try:
+                return self.send(operation, url, params, idempotency_key)
+            except GatewayUnavailable:
+                raise
+            except RETRYABLE_ERRORS:
+                if attempt >= self.max_retries:
+                    raise
+            # full jitter keeps retrying clients from stampeding together
+            time.sleep(random.uniform(0, min(self.backoff_cap, self.backoff * 2 ** attempt)))
+            attempt += 1
+
+    def send(self, operation, url, params, idempotency_key):
+        if not self.breaker.allow():
+            error = GatewayUnavailable('Payment processor is unavailable')
+            self.metrics.observe(operation, 0, error)
+            raise error
+
+        requestor = api_requestor.APIRequestor(
+            key=self.api_key, client=self.http_client, api_base=self.api_base)
+        started = time.monotonic()
+        try:
+            response, api_key = requestor.request(
+                'post', url, params, {'Idempotency-Key': idempotency_key})
+        except stripe.error.StripeError as e:
+            self.metrics.observe(operation, time.monotonic() - started, e)
+            if e.http_status == 409:
+                # the first request under this key is still running at
+                # Stripe; its outcome is unknown, which is not a failure
+                self.breaker.record_success()
+                raise RequestInProgress(
+                    e.user_message, e.http_body, e.http_status, e.json_body,
+                    e.headers, e.code) from e
+            if isinstance(e, RETRYABLE_ERRORS):
+                self.breaker.record_failure()
+            else:
+                # the processor answered; a decline says nothing about its health
+                self.breaker.record_success()
+            raise
+        self.breaker.record_success()
+        self.metrics.observe(operation, time.monotonic() - started)
+        return util.convert_to_stripe_object(response, api_key)
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway():
+    global _gateway
+    with _gateway_lock:
+        if _gateway is None:
+            _gateway = StripeGateway(
+                api_key=settings.STRIPE_SECRET_KEY,
+                api_base=settings.STRIPE_API_BASE,
+                connect_timeout=settings.STRIPE_CONNECT_TIMEOUT,
+                read_timeout=settings.STRIPE_READ_TIMEOUT,
+                max_retries=settings.STRIPE_MAX_RETRIES,
+                backoff_cap=settings.STRIPE_BACKOFF_CAP,
+                breaker=CircuitBreaker(
+                    threshold=settings.STRIPE_BREAKER_THRESHOLD,
+                    reset_timeout=settings.STRIPE_BREAKER_RESET_TIMEOUT))
+        return _gateway
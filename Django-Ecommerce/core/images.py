@@ -0,0 +1,263 @@
+"""
+Responsive renditions and placeholders of uploaded images.
+
+When an Item, Category or Slide is saved with a newly uploaded image,
+``render_upload`` stores a 16px preview of it on the model
+(``image_placeholder``), then writes it again at each of
+RENDITION_WIDTHS narrower than the original, in WebP and JPEG, under
+``renditions/`` in the same storage, and records each file as an
+ImageRendition. Templates use ``{% responsive_image %}``
+(core/templatetags/image_template_tags.py) to emit a ``<picture>`` with
+``srcset``/``sizes`` so browsers download the smallest file that fills
+the slot, painted over the inline preview; images without renditions
+(old uploads, files that failed to decode) fall back to the original.
+"""
+import base64
+import hashlib
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models.signals import post_save, pre_save
+from django.dispatch import receiver
+from PIL import Image, ImageOps
+
+from .models import Category, ImageRendition, Item, Slide
+
+SAVE_OPTIONS = {
+    'webp': {'format': 'WEBP', 'method': 4},
+    'jpeg': {'format': 'JPEG', 'optimize': True, 'progressive': True},
+}
+EXTENSIONS = {'webp': 'webp', 'jpeg': 'jpg'}
+IMAGE_MODELS = [Item, Category, Slide]
+PLACEHOLDER_WIDTH = 16
+
+
+def rendition_name(source, width, fmt):
+    stem = os.path.splitext(source)[0]
+    return 'renditions/{}-{}w.{}'.format(stem, width, EXTENSIONS[fmt])
+
+
+def target_widths(width):
+    # never upscale; an original narrower than every width gets one copy
+    # at its own size so it is still re-encoded
+    widths = [w for w in settings.RENDITION_WIDTHS if w < width]
+    return widths or [width]
+
+
+def encode(image, fmt):
+    buffer = BytesIO()
+    image.save(buffer, quality=settings.RENDITION_QUALITY, **SAVE_OPTIONS[fmt])
+    return buffer.getvalue()
+
+
+def rendition_spec():
+    # everything that changes the output; stored with each rendition
+    return 'w={};q={};f={}'.format(
+        ','.join(map(str, settings.RENDITION_WIDTHS)), settings.RENDITION_QUALITY,
+        ','.join(SAVE_OPTIONS))
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def render(storage, source, data):
+    """
+    Decodes `data` (the bytes of `source`), writes every rendition to
+    `storage` and returns the unsaved ImageRendition rows. Touches no
+    database, so it can run in a worker process. Raises OSError if the
+    image cannot be decoded.
+    """
+    original = Image.open(BytesIO(data))
+    original.load()
+    original = ImageOps.exif_transpose(original)
+    if original.mode not in ('RGB', 'L'):
+        # JPEG has no alpha; flatten onto white
+        background = Image.new('RGB', original.size, 'white')
+        background.paste(original, mask=original.convert('RGBA').split()[-1])
+        original = background
+
+    source_hash, spec = content_hash(data), rendition_spec()
+    renditions = []
+    for width in target_widths(original.width):
+        height = max(1, round(original.height * width / original.width))
+        resized = original.resize((width, height), Image.LANCZOS)
+        for fmt in SAVE_OPTIONS:
+            name = rendition_name(source, width, fmt)
+            encoded = encode(resized, fmt)
+            if storage.exists(name):
+                storage.delete(name)
+            name = storage.save(name, ContentFile(encoded))
+            renditions.append(ImageRendition(
+                source=source, format=fmt, width=width, height=height,
+                name=name, size=len(encoded), source_hash=source_hash, spec=spec))
+    return renditions
+
+
+def replace_renditions(storage, source, renditions):
+    """
+    Swaps the rows of `source` for `renditions` and deletes files the new
+    set no longer uses (widths dropped from the settings).
+    """
+    with transaction.atomic():
+        old = ImageRendition.objects.filter(source=source)
+        stale = set(old.values_list('name', flat=True)) - {r.name for r in renditions}
+        old.delete()
+        ImageRendition.objects.bulk_create(renditions)
+        # content-addressed files can be shared with another source
+        stale -= set(ImageRendition.objects.filter(name__in=stale).values_list('name', flat=True))
+    for name in stale:
+        storage.delete(name)
+
+
+def placeholder(data):
+    """
+    A PLACEHOLDER_WIDTH px JPEG of the image as a data: URI (well under
+    1 KB), shown stretched while the real image loads.
+    """
+    image = Image.open(BytesIO(data))
+    # let the JPEG decoder downscale instead of decoding every pixel
+    image.draft('RGB', (PLACEHOLDER_WIDTH * 4, PLACEHOLDER_WIDTH * 4))
+    image = ImageOps.exif_transpose(image).convert('RGB')
+    image.thumbnail((PLACEHOLDER_WIDTH, PLACEHOLDER_WIDTH), Image.LANCZOS)
+    buffer = BytesIO()
+    image.save(buffer, 'JPEG', quality=50)
+    return 'data:image/jpeg;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def save_placeholder(source, value):
+    for model in IMAGE_MODELS:
+        model.objects.filter(image=source).exclude(
+            image_placeholder=value).update(image_placeholder=value)
+
+
+def referenced_images():
+    """
+    Every distinct image name used by an Item, Category or Slide.
+    """
+    names = set()
+    for model in IMAGE_MODELS:
+        names.update(model.objects.exclude(image='').values_list('image', flat=True).distinct())
+    return sorted(names)
+
+
+def unplaced_images():
+    """
+    Image names used by at least one row that has no placeholder yet.
+    """
+    names = set()
+    for model in IMAGE_MODELS:
+        names.update(model.objects.exclude(image='').filter(
+            image_placeholder='').values_list('image', flat=True).distinct())
+    return names
+
+
+def current_hashes():
+    """
+    source -> hash of the original its renditions were made from, for
+    the sources rendered with the current settings.
+    """
+    return dict(ImageRendition.objects.filter(spec=rendition_spec()).values_list(
+        'source', 'source_hash').distinct())
+
+
+def regenerate(source, known_hash=None, needs_placeholder=True):
+    """
+    Process pool task: renders `source` unless its content still hashes
+    to `known_hash`. Returns (status, bytes read, rows, placeholder); the
+    caller saves the rows and the placeholder. An unchanged image only
+    gets a placeholder if `needs_placeholder`.
+    """
+    storage = Item._meta.get_field('image').storage
+    try:
+        with storage.open(source, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return 'missing', 0, [], ''
+    try:
+        if known_hash and content_hash(data) == known_hash:
+            return 'skipped', len(data), [], placeholder(data) if needs_placeholder else ''
+        return 'rendered', len(data), render(storage, source, data), placeholder(data)
+    except OSError:
+        return 'failed', len(data), [], ''
+
+
+class RenditionCache(dict):
+    '''
+    source -> [(format, width, name), ...] ordered by width, read for any
+    number of sources in one query.
+    '''
+    def load(self, sources):
+        missing = {source for source in sources if source and source not in self}
+        if not missing:
+            return
+        for source in missing:
+            # sources without renditions are remembered too
+            self[source] = []
+        rows = ImageRendition.objects.filter(source__in=missing).order_by(
+            'width').values_list('source', 'format', 'width', 'name')
+        for source, fmt, width, name in rows:
+            self[source].append((fmt, width, name))
+
+    def rows(self, source):
+        self.load([source])
+        return self[source]
+
+
+def srcsets(field_file, renditions=None):
+    """
+    {format: 'url 320w, url 640w, ...'} for the renditions of `field_file`,
+    read from the RenditionCache `renditions` when given.
+    """
+    if renditions is None:
+        renditions = RenditionCache()
+    candidates = {}
+    for fmt, width, name in renditions.rows(field_file.name):
+        url = field_file.storage.url(name)
+        candidates.setdefault(fmt, []).append('{} {}w'.format(url, width))
+    return {fmt: ', '.join(urls) for fmt, urls in candidates.items()}
+
+
+def image_url(field_file, width, renditions=None):
+    """
+    URL of the smallest JPEG rendition at least `width` px wide, or of the
+    original when none is (it is then the best fit anyway).
+    """
+    if renditions is None:
+        renditions = RenditionCache()
+    for fmt, rendition_width, name in renditions.rows(field_file.name):
+        if fmt == 'jpeg' and rendition_width >= width:
+            return field_file.storage.url(name)
+    return field_file.url
+
+
+@receiver(pre_save, sender=Item)
+@receiver(pre_save, sender=Category)
+@receiver(pre_save, sender=Slide)
+def note_upload(sender, instance, **kwargs):
+    # the FieldFile is only uncommitted when a new file was assigned
+    image = instance.image
+    instance._image_uploaded = bool(image) and not image._committed
+
+
+@receiver(post_save, sender=Item)
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Slide)
+def render_upload(sender, instance, **kwargs):
+    if not getattr(instance, '_image_uploaded', False):
+        return
+    instance._image_uploaded = False
+    storage, source = instance.image.storage, instance.image.name
+    try:
+        with storage.open(source, 'rb') as f:
+            data = f.read()
+        instance.image_placeholder = placeholder(data)
+        save_placeholder(source, instance.image_placeholder)
+        if settings.RENDITIONS_ON_UPLOAD:
+            replace_renditions(storage, source, render(storage, source, data))
+    except OSError:
+        # not an image Pillow can read; pages keep the original
+        pass
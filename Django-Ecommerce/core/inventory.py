@@ -0,0 +1,198 @@
+"""
+Stock reservation for items with a tracked ``Item.stock``.
+
+Every change to the on-hand count is a single conditional UPDATE, so
+concurrent buyers can never take the count below zero and no Python-side
+read-modify-write happens. Hot items can spread their count over
+``StockSlot`` rows (``Item.stock_shards``) so buyers stop queueing on a
+single row lock.
+"""
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Item, StockReservation, StockSlot
+
+
+class OutOfStock(Exception):
+    def __init__(self, item):
+        super().__init__('{} is out of stock'.format(item))
+        self.item = item
+
+
+def take(item, quantity):
+    """
+    Takes `quantity` units if that many are available. Returns True on
+    success.
+    """
+    if item.is_sharded:
+        return take_from_slots(item, quantity)
+    return Item.objects.filter(
+        pk=item.pk, stock__gte=quantity
+    ).update(stock=F('stock') - quantity) == 1
+
+
+def take_from_slots(item, quantity):
+    """
+    Tries the slots in random order so concurrent buyers land on
+    different rows; empty slots simply fail their conditional UPDATE. A
+    quantity no single slot can cover is gathered from several, and
+    handed back if the total falls short.
+    """
+    order = random.sample(range(item.stock_shards), item.stock_shards)
+    for slot in order:
+        if StockSlot.objects.filter(
+                item=item, slot=slot, stock__gte=quantity
+        ).update(stock=F('stock') - quantity):
+            return True
+
+    slots = list(StockSlot.objects.filter(
+        item=item, stock__gt=0).values_list('slot', 'stock'))
+    taken = []
+    remaining = quantity
+    for slot, seen in slots:
+        part = min(remaining, seen)
+        if StockSlot.objects.filter(
+                item=item, slot=slot, stock__gte=part
+        ).update(stock=F('stock') - part):
+            taken.append((slot, part))
+            remaining -= part
+            if not remaining:
+                return True
+    for slot, part in taken:
+        StockSlot.objects.filter(item=item, slot=slot).update(stock=F('stock') + part)
+    return False
+
+
+def give_back(item_id, quantity):
+    shards = Item.objects.filter(pk=item_id).values_list('stock_shards', flat=True).first()
+    if shards and shards > 1:
+        StockSlot.objects.filter(
+            item_id=item_id, slot=random.randrange(shards)
+        ).update(stock=F('stock') + quantity)
+    else:
+        Item.objects.filter(pk=item_id, stock__isnull=False).update(
+            stock=F('stock') + quantity)
+
+
+def force_take(item, quantity):
+    if item.is_sharded:
+        StockSlot.objects.filter(
+            item=item, slot=random.randrange(item.stock_shards)
+        ).update(stock=F('stock') - quantity)
+    else:
+        Item.objects.filter(pk=item.pk).update(stock=F('stock') - quantity)
+
+
+def reshard(item, shards, total=None):
+    """
+    Moves the item between single-row and sharded stock, spreading
+    `total` (default: the current count) evenly over the slots. Items
+    without tracked stock are left untracked and unsharded.
+    """
+    with transaction.atomic():
+        item = Item.objects.select_for_update().get(pk=item.pk)
+        if total is None:
+            if item.stock is None:
+                # no count to spread; sharding would start it at zero
+                if item.stock_shards:
+                    item.stock_shards = 0
+                    item.save(update_fields=['stock_shards'])
+                return item
+            total = item.get_stock()
+        StockSlot.objects.filter(item=item).delete()
+        item.stock_shards = shards if shards > 1 else 0
+        if item.is_sharded:
+            share, extra = divmod(total or 0, shards)
+            StockSlot.objects.bulk_create(
+                StockSlot(item=item, slot=slot, stock=share + (slot < extra))
+                for slot in range(shards))
+            # the row keeps a non-null value so the item still counts as tracked
+            item.stock = 0
+        else:
+            item.stock = total
+        item.save(update_fields=['stock', 'stock_shards'])
+    return item
+
+
+def reserve_order(order):
+    """
+    (Re)reserves every tracked line of the order for
+    STOCK_RESERVATION_TTL seconds. Raises OutOfStock and reserves
+    nothing if any line cannot be covered.
+    """
+    expires_at = timezone.now() + timedelta(seconds=settings.STOCK_RESERVATION_TTL)
+    with transaction.atomic():
+        release_order(order)
+        reservations = []
+        for line in order.items.select_related('item').filter(item__stock__isnull=False):
+            if not take(line.item, line.quantity):
+                raise OutOfStock(line.item)
+            reservations.append(StockReservation(
+                item_id=line.item_id, order=order,
+                quantity=line.quantity, expires_at=expires_at))
+        StockReservation.objects.bulk_create(reservations)
+    return reservations
+
+
+def release_order(order):
+    for reservation in StockReservation.objects.filter(order=order, committed=False):
+        release(reservation)
+
+
+def release_orders(orders):
+    """
+    `release_order` for every cart in `orders`, e.g. before they are
+    deleted, which would drop the reservations without giving back stock.
+    """
+    for reservation in StockReservation.objects.filter(order__in=orders, committed=False):
+        release(reservation)
+
+
+def release(reservation):
+    # deleting the row first makes sure only one caller gives the units back
+    with transaction.atomic():
+        deleted, _ = StockReservation.objects.filter(
+            pk=reservation.pk, committed=False).delete()
+        if deleted:
+            give_back(reservation.item_id, reservation.quantity)
+    return bool(deleted)
+
+
+def commit_order(order):
+    """
+    Called from finalize_order. Lines whose reservation lapsed before the
+    payment went through are taken unconditionally, since the customer
+    has already been charged; the count may go negative and shows up as
+    an oversell instead of a lost order.
+    """
+    covered = set()
+    for reservation in StockReservation.objects.filter(order=order, committed=False):
+        # conditional, so a reservation released in the meantime is not counted
+        if StockReservation.objects.filter(
+                pk=reservation.pk, committed=False).update(committed=True):
+            covered.add(reservation.item_id)
+    lines = order.items.select_related('item').filter(
+        item__stock__isnull=False).exclude(item_id__in=covered)
+    for line in lines:
+        force_take(line.item, line.quantity)
+
+
+def release_expired(batch_size=500):
+    """
+    Hands the units of expired, unpaid reservations back. Returns the
+    number of reservations released.
+    """
+    released = 0
+    while True:
+        expired = list(StockReservation.objects.filter(
+            committed=False, expires_at__lt=timezone.now()
+        ).order_by('expires_at')[:batch_size])
+        if not expired:
+            return released
+        for reservation in expired:
+            released += release(reservation)
@@ -0,0 +1,59 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection, transaction
+
+from core.inventory import reshard, take
+from core.models import Category, Item
+
+
+class Command(BaseCommand):
+    help = 'Measures reservation throughput on a single hot item, with and without sharded stock'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buyers', type=int, default=32,
+                            help='Concurrent buyer threads')
+        parser.add_argument('--purchases', type=int, default=2000,
+                            help='Purchases attempted per run')
+        parser.add_argument('--shards', type=int, nargs='+', default=[0, 8, 32],
+                            help='Slot counts to compare (0 = single row)')
+
+    def handle(self, *args, **options):
+        category = Category.objects.create(
+            title='Benchmark', slug='bench-stock-{}'.format(int(time.time())),
+            description='', image='')
+        try:
+            item = Item.objects.create(
+                title='Benchmark item', price=1, category=category, label='S',
+                slug=category.slug, stock_no='BENCH', description_short='',
+                description_long='', image='')
+            for shards in options['shards']:
+                self.run(item, shards, options['buyers'], options['purchases'])
+        finally:
+            category.delete()
+
+    def run(self, item, shards, buyers, purchases):
+        item = reshard(item, shards, purchases)
+
+        def buy(_):
+            try:
+                # each purchase commits on its own, like a checkout request
+                with transaction.atomic():
+                    return 'sold' if take(item, 1) else 'missed'
+            except OperationalError:
+                # SQLite gives up on its database-wide write lock
+                return 'locked'
+            finally:
+                connection.close()
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=buyers) as pool:
+            results = list(pool.map(buy, range(purchases)))
+        elapsed = time.monotonic() - started
+
+        item.refresh_from_db()
+        self.stdout.write('{:>10}: {} sold, {} missed, {} lock errors, {} left, {:.0f} purchases/s'.format(
+            '{} slots'.format(shards) if shards > 1 else 'single row',
+            results.count('sold'), results.count('missed'), results.count('locked'),
+            item.get_stock(), purchases / elapsed))
@@ -0,0 +1,53 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.images import IMAGE_MODELS
+from core.models import ImageRendition
+from core.storage import is_hashed
+
+
+class Command(BaseCommand):
+    help = 'Moves images saved under upload names to content-addressed names'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--delete', action='store_true',
+                            help='Delete the old files once nothing refers to them')
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        names = set()
+        for model in IMAGE_MODELS:
+            names.update(model.objects.exclude(image='').values_list('image', flat=True))
+        legacy = [name for name in sorted(names) if not is_hashed(name)]
+        found = [name for name in legacy if default_storage.exists(name)]
+        if options['dry_run']:
+            self.stdout.write('(dry run) {} files to move, {} missing'.format(
+                len(found), len(legacy) - len(found)))
+            return
+
+        targets, deleted = set(), 0
+        for name in found:
+            with default_storage.open(name, 'rb') as f:
+                new = default_storage.save(name, f)
+            targets.add(new)
+            with transaction.atomic():
+                for model in IMAGE_MODELS:
+                    model.objects.filter(image=name).update(image=new)
+                renditions = ImageRendition.objects.filter(source=name)
+                orphans = []
+                if ImageRendition.objects.filter(source=new).exists():
+                    # the same picture was uploaded before; keep its renditions
+                    orphans = list(renditions.values_list('name', flat=True))
+                    renditions.delete()
+                else:
+                    renditions.update(source=new)
+            if options['delete']:
+                for old in [name] + orphans:
+                    if not ImageRendition.objects.filter(name=old).exists():
+                        default_storage.delete(old)
+                        deleted += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            '{} files moved into {} content-addressed files, {} missing, {} old files deleted'.format(
+                len(found), len(targets), len(legacy) - len(found), deleted)))
@@ -0,0 +1,55 @@
+import csv
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.analytics import (
+    COHORT_COLUMNS, ORDER_COLUMNS, USER_COLUMNS, build, load, month_label)
+
+TABLES = {'cohorts': COHORT_COLUMNS, 'users': USER_COLUMNS, 'orders': ORDER_COLUMNS}
+
+
+class Command(BaseCommand):
+    help = 'Computes per-customer and per-cohort revenue metrics and exports them as CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=settings.ANALYTICS_PATH,
+                            help='Column file the metrics are saved to and read from')
+        parser.add_argument('--cached', action='store_true',
+                            help='Read the saved column file instead of the database')
+        parser.add_argument('--table', choices=sorted(TABLES), default='cohorts')
+        parser.add_argument('--output', help='CSV file to write (default: stdout)')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        if options['cached'] and os.path.exists(options['path']):
+            tables = load(options['path'])
+            source = 'Loaded {}'.format(options['path'])
+        else:
+            tables = build(options['path'])
+            source = 'Computed and saved to {}'.format(options['path'])
+        elapsed = time.monotonic() - started
+
+        names = TABLES[options['table']]
+        table = tables[options['table']]
+        output = open(options['output'], 'w', newline='') if options['output'] else self.stdout
+        try:
+            writer = csv.writer(output)
+            writer.writerow(names)
+            for row in zip(*(table[name].tolist() for name in names)):
+                writer.writerow([self.format(name, value) for name, value in zip(names, row)])
+        finally:
+            if options['output']:
+                output.close()
+        self.stderr.write(self.style.SUCCESS('{} in {:.2f}s: {} orders, {} customers'.format(
+            source, elapsed, len(tables['orders']['order_id']),
+            len(tables['users']['user_id']))))
+
+    def format(self, name, value):
+        if name in ('cohort', 'month'):
+            return month_label(value)
+        if isinstance(value, float):
+            return round(value, 4)
+        return value
@@ -0,0 +1,44 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.catalog import csv_lines, export_rows, ndjson_lines
+from core.models import Item
+
+
+class Command(BaseCommand):
+    help = 'Streams the item catalogue out as CSV or NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=['csv', 'ndjson'], default='csv')
+        parser.add_argument('--output', help='File to write (default: stdout)')
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='Rows read from the database at a time')
+        parser.add_argument('--category', help='Only items of this category slug')
+
+    def handle(self, *args, **options):
+        items = Item.objects.all()
+        if options['category']:
+            items = items.filter(category__slug=options['category'])
+        exported = 0
+
+        def counted(rows):
+            nonlocal exported
+            for row in rows:
+                exported += 1
+                yield row
+
+        rows = counted(export_rows(items, options['chunk_size']))
+        lines = csv_lines(rows) if options['format'] == 'csv' else ndjson_lines(rows)
+
+        started = time.monotonic()
+        out = open(options['output'], 'w', newline='') if options['output'] else sys.stdout
+        try:
+            out.writelines(lines)
+        finally:
+            if options['output']:
+                out.close()
+        if options['output']:
+            self.stdout.write(self.style.SUCCESS('Exported {} items in {:.2f}s'.format(
+                exported, time.monotonic() - started)))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from core.fake_stripe import FakeStripeServer
+
+
+class Command(BaseCommand):
+    help = 'Runs a local Stripe stand-in for offline payment testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', type=str, default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=12111)
+        parser.add_argument('--latency', type=float, default=0,
+                            help='Seconds to wait before answering each request')
+        parser.add_argument('--error-rate', type=float, default=0,
+                            help='Fraction of requests answered with a 500')
+
+    def handle(self, *args, **options):
+        server = FakeStripeServer(
+            (options['host'], options['port']),
+            latency=options['latency'],
+            error_rate=options['error_rate'],
+            verbose=options['verbosity'] > 1)
+        self.stdout.write(self.style.SUCCESS(
+            'Fake Stripe listening on {} (set STRIPE_API_BASE to this URL)'.format(server.url)))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,98 @@
+import csv
+import secrets
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, transaction
+from django.utils.dateparse import parse_datetime
+
+from core.coupons import normalize, rebuild_filter
+from core.models import Coupon
+
+# no 0/O or 1/I, so codes survive being read out or typed in
+CODE_ALPHABET = 'ABCDEFGHJKLMNPQRSTUVWXYZ23456789'
+
+
+def make_code(prefix, length):
+    return prefix + ''.join(secrets.choice(CODE_ALPHABET) for _ in range(length))
+
+
+class Command(BaseCommand):
+    help = 'Mints unique coupon codes for a campaign in bulk'
+
+    def add_arguments(self, parser):
+        parser.add_argument('campaign', help='Campaign name stored on every code')
+        parser.add_argument('--count', type=int, default=1000)
+        parser.add_argument('--prefix', default='', help='Prepended to every code')
+        parser.add_argument('--length', type=int, default=10,
+                            help='Random characters per code')
+        parser.add_argument('--amount', type=float, default=0)
+        parser.add_argument('--percent-off', type=int, default=0)
+        parser.add_argument('--min-spend', type=float, default=0)
+        parser.add_argument('--max-uses', type=int, default=1,
+                            help='Uses per code (0 = unlimited)')
+        parser.add_argument('--valid-until', help='ISO 8601 date and time')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Codes inserted per statement')
+        parser.add_argument('--output', help='Write the new codes to this CSV file')
+
+    def handle(self, *args, **options):
+        prefix = normalize(options['prefix'])
+        if len(prefix) + options['length'] > Coupon._meta.get_field('code').max_length:
+            raise CommandError('Prefix and length do not fit in a coupon code')
+        valid_until = None
+        if options['valid_until']:
+            valid_until = parse_datetime(options['valid_until'])
+            if valid_until is None:
+                raise CommandError('Invalid --valid-until')
+
+        template = dict(
+            campaign=options['campaign'],
+            amount=options['amount'],
+            percent_off=options['percent_off'],
+            min_spend=options['min_spend'],
+            max_uses=options['max_uses'] or None,
+            valid_until=valid_until,
+        )
+        output = open(options['output'], 'w', newline='') if options['output'] else None
+        writer = csv.writer(output) if output else None
+
+        started = time.monotonic()
+        created = 0
+        try:
+            while created < options['count']:
+                wanted = min(options['batch_size'], options['count'] - created)
+                codes = self.create_batch(prefix, options['length'], wanted, template)
+                created += len(codes)
+                if writer:
+                    writer.writerows([code] for code in codes)
+        finally:
+            if output:
+                output.close()
+        elapsed = time.monotonic() - started
+        self.stdout.write('Created {} codes in {:.2f}s'.format(created, elapsed))
+
+        started = time.monotonic()
+        bloom = rebuild_filter()
+        self.stdout.write(self.style.SUCCESS(
+            'Rebuilt the code filter: {} codes, {} KiB, in {:.2f}s'.format(
+                bloom.count, len(bloom.bits) // 1024, time.monotonic() - started)))
+
+    def create_batch(self, prefix, length, wanted, template):
+        """
+        Draws `wanted` fresh codes and inserts them in one statement.
+        Returns the codes inserted, which may be fewer on a collision.
+        """
+        codes = set()
+        while len(codes) < wanted:
+            codes.add(make_code(prefix, length))
+        taken = set(Coupon.objects.filter(code__in=codes).values_list('code', flat=True))
+        codes = sorted(codes - taken)
+        try:
+            with transaction.atomic():
+                Coupon.objects.bulk_create(
+                    [Coupon(code=code, **template) for code in codes])
+        except IntegrityError:
+            # someone inserted one of these codes meanwhile; draw again
+            return []
+        return codes
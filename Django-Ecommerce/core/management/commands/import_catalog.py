@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.catalog import import_rows, read_rows
+
+
+class Command(BaseCommand):
+    help = 'Creates and updates items from a CSV or NDJSON feed, matched on slug or SKU'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'ndjson'],
+                            help='Default: guessed from the file extension')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Rows compared and written per transaction')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report what would change')
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or ('ndjson' if options['path'].endswith(
+            ('.ndjson', '.jsonl')) else 'csv')
+        started = time.monotonic()
+        try:
+            with open(options['path'], newline='', encoding='utf-8') as f:
+                stats = import_rows(
+                    read_rows(f, fmt), options['batch_size'], options['dry_run'])
+        except FileNotFoundError:
+            raise CommandError('No such file: {}'.format(options['path']))
+
+        for number, error in stats['errors']:
+            self.stderr.write('Row {}: {}'.format(number, error))
+        self.stdout.write(self.style.SUCCESS(
+            '{}{} created, {} updated, {} unchanged, {} rejected in {:.2f}s'.format(
+                '(dry run) ' if options['dry_run'] else '',
+                stats['created'], stats['updated'], stats['unchanged'],
+                stats['failed'], time.monotonic() - started)))
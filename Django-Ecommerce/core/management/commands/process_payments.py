@@ -0,0 +1,42 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core.payments import process_queued
+
+
+class Command(BaseCommand):
+    help = 'Charges queued payment attempts (used when PAYMENT_ASYNC is on)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Number of charges in flight at once')
+        parser.add_argument('--batch-size', type=int, default=50,
+                            help='Attempts claimed per pass and worker')
+        parser.add_argument('--sleep', type=float, default=0.5,
+                            help='Seconds to wait when the queue is empty')
+        parser.add_argument('--once', action='store_true',
+                            help='Drain the queue once and exit')
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while True:
+                started = time.monotonic()
+                handled = sum(pool.map(self.run_pass, [options['batch_size']] * workers))
+                if handled:
+                    self.stdout.write('Processed {} payments in {:.3f}s'.format(
+                        handled, time.monotonic() - started))
+                if options['once'] and not handled:
+                    break
+                if not handled:
+                    time.sleep(options['sleep'])
+
+    def run_pass(self, batch_size):
+        close_old_connections()
+        try:
+            return process_queued(batch_size)
+        finally:
+            close_old_connections()
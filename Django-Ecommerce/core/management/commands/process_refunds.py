@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.refunds import execute_refunds
+
+
+class Command(BaseCommand):
+    help = 'Issues queued refunds through the payment gateway'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Refunds in flight at once (default: REFUND_WORKERS)')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Refunds claimed per pass')
+        parser.add_argument('--sleep', type=float, default=1,
+                            help='Seconds to wait when the queue is empty')
+        parser.add_argument('--once', action='store_true',
+                            help='Drain the queue once and exit')
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            results = execute_refunds(options['workers'], options['batch_size'])
+            if results:
+                self.stdout.write(self.style.SUCCESS(
+                    '{} refunded, {} failed, {} retried in {:.3f}s'.format(
+                        results.get('S', 0), results.get('F', 0), results.get('Q', 0),
+                        time.monotonic() - started)))
+            if options['once']:
+                break
+            if not results:
+                time.sleep(options['sleep'])
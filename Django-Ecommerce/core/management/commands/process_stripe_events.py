@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.webhooks import apply_pending
+
+
+class Command(BaseCommand):
+    help = 'Applies received Stripe webhook events to orders and payments'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--sleep', type=float, default=1,
+                            help='Seconds to wait when no events are pending')
+        parser.add_argument('--once', action='store_true',
+                            help='Drain pending events once and exit')
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            handled = apply_pending(options['batch_size'])
+            if handled:
+                self.stdout.write('Applied {} events in {:.3f}s'.format(
+                    handled, time.monotonic() - started))
+                continue
+            if options['once']:
+                break
+            time.sleep(options['sleep'])
@@ -0,0 +1,101 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from core import coupons, inventory
+from core.models import Order, OrderItem
+
+
+class Command(BaseCommand):
+    help = 'Deletes unpaid carts that have been idle for longer than N days'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30,
+                            help='Carts idle for longer than this are removed')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of carts deleted per transaction')
+        parser.add_argument('--sleep', type=float, default=0,
+                            help='Seconds to pause between batches')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only count what would be removed')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        batch_size = options['batch_size']
+
+        stale = Order.objects.filter(ordered=False, updated__lt=cutoff)
+        if options['dry_run']:
+            self.stdout.write('{} stale carts older than {}'.format(
+                stale.count(), cutoff.isoformat()))
+            return
+
+        total_orders = total_items = batches = 0
+        started = time.monotonic()
+        while True:
+            pks = list(stale.order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                break
+            batch_started = time.monotonic()
+            orders, items = self.delete_carts(pks, cutoff)
+            batches += 1
+            total_orders += orders
+            total_items += items
+            self.stdout.write('Batch {}: {} carts, {} cart lines removed in {:.3f}s'.format(
+                batches, orders, items, time.monotonic() - batch_started))
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        batch_started = time.monotonic()
+        orphans = self.delete_orphans(cutoff, batch_size)
+        total_items += orphans
+        self.stdout.write('Orphaned cart lines: {} removed in {:.3f}s'.format(
+            orphans, time.monotonic() - batch_started))
+
+        self.stdout.write(self.style.SUCCESS(
+            'Removed {} carts and {} cart lines in {} batches ({:.2f}s)'.format(
+                total_orders, total_items, batches, time.monotonic() - started)))
+
+    def delete_carts(self, pks, cutoff):
+        with transaction.atomic():
+            # re-check idleness so a cart touched since the scan survives
+            pks = list(Order.objects.filter(
+                pk__in=pks, ordered=False, updated__lt=cutoff
+            ).values_list('pk', flat=True))
+            item_pks = list(Order.items.through.objects.filter(
+                order_id__in=pks
+            ).values_list('orderitem_id', flat=True))
+            _, items = OrderItem.objects.filter(
+                pk__in=item_pks, ordered=False).delete()
+            carts = Order.objects.filter(pk__in=pks)
+            coupons.release_orders(carts)
+            inventory.release_orders(carts)
+            _, orders = carts.delete()
+        return orders.get('core.Order', 0), items.get('core.OrderItem', 0)
+
+    def delete_orphans(self, cutoff, batch_size):
+        """
+        remove_from_cart detaches lines from the order but leaves the row
+        behind; drop those once their owner has gone quiet.
+        """
+        active_users = Order.objects.filter(
+            ordered=False, updated__gte=cutoff).values('user')
+        orphans = OrderItem.objects.filter(
+            ordered=False, order__isnull=True
+        ).exclude(
+            user__in=active_users
+        ).exclude(
+            user__last_login__gte=cutoff
+        )
+        removed = 0
+        while True:
+            pks = list(orphans.order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                break
+            with transaction.atomic():
+                _, deleted = OrderItem.objects.filter(
+                    pk__in=pks, ordered=False).delete()
+            removed += deleted.get('core.OrderItem', 0)
+        return removed
@@ -0,0 +1,68 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from core.models import Order
+from core.reports import save_rollups, tally
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the daily sales rollups from the paid orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help='First day, YYYY-MM-DD (default: first order)')
+        parser.add_argument('--end', help='Last day, YYYY-MM-DD (default: today)')
+        parser.add_argument('--chunk-days', type=int, default=14,
+                            help='Days recomputed per unit of work')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Chunks recomputed at once')
+
+    def handle(self, *args, **options):
+        start = self.parse(options['start'])
+        end = self.parse(options['end']) or timezone.localdate()
+        if start is None:
+            first = Order.objects.filter(ordered=True).order_by('ordered_date').values_list(
+                'ordered_date', flat=True).first()
+            if first is None:
+                self.stdout.write('No paid orders')
+                return
+            start = timezone.localdate(first)
+
+        step = timedelta(days=options['chunk_days'])
+        chunks = []
+        while start <= end:
+            chunks.append((start, min(start + step - timedelta(days=1), end)))
+            start += step
+
+        def run(chunk):
+            try:
+                return tally(*chunk)
+            finally:
+                connection.close()
+
+        started = time.monotonic()
+        # the workers only read; every write happens here, one chunk after
+        # the other, once they are done, since SQLite takes one writer at a
+        # time and fails the others with "database is locked"
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            results = list(pool.map(run, chunks))
+        orders = 0
+        for chunk, (count, totals, by_category) in zip(chunks, results):
+            save_rollups(*chunk, totals, by_category)
+            orders += count
+        self.stdout.write(self.style.SUCCESS(
+            'Rebuilt {} chunks from {} orders in {:.2f}s'.format(
+                len(chunks), orders, time.monotonic() - started)))
+
+    def parse(self, value):
+        if not value:
+            return None
+        day = parse_date(value)
+        if day is None:
+            raise CommandError('Invalid date: {}'.format(value))
+        return day
@@ -0,0 +1,67 @@
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from core.images import (
+    current_hashes, referenced_images, regenerate, replace_renditions, save_placeholder,
+    unplaced_images)
+from core.models import Item
+
+
+def init_worker():
+    # a no-op under fork; spawned workers need the app registry
+    django.setup()
+
+
+class Command(BaseCommand):
+    help = 'Rewrites the renditions and placeholders of every image used by an item, category or slide'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Processes encoding images (default: one per core)')
+        parser.add_argument('--force', action='store_true',
+                            help='Render images whose renditions are already current')
+        parser.add_argument('--progress-every', type=int, default=100,
+                            help='Report progress after this many images')
+
+    def handle(self, *args, **options):
+        sources = referenced_images()
+        # rows are saved as each image finishes, so a rerun after an
+        # interruption skips everything already done
+        known = {} if options['force'] else current_hashes()
+        unplaced = unplaced_images()
+        storage = Item._meta.get_field('image').storage
+        counts, read = Counter(), 0
+        started = time.monotonic()
+
+        # workers must not inherit this process's database connection
+        connections.close_all()
+        with ProcessPoolExecutor(options['workers'], initializer=init_worker) as pool:
+            futures = {
+                pool.submit(regenerate, source, known.get(source), source in unplaced): source
+                for source in sources}
+            for done, future in enumerate(as_completed(futures), start=1):
+                status, size, renditions, preview = future.result()
+                if status == 'rendered':
+                    replace_renditions(storage, futures[future], renditions)
+                if preview:
+                    save_placeholder(futures[future], preview)
+                elif status in ('missing', 'failed'):
+                    self.stderr.write('{}: {}'.format(futures[future], status))
+                counts[status] += 1
+                read += size
+                if done % options['progress_every'] == 0:
+                    self.stdout.write('{}/{} images'.format(done, len(sources)))
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            '{} images in {:.1f}s ({:.1f} images/s, {:.1f} MB/s read): '
+            '{} rendered, {} unchanged, {} missing, {} failed'.format(
+                len(sources), elapsed, len(sources) / elapsed if elapsed else 0,
+                read / 1e6 / elapsed if elapsed else 0, counts['rendered'],
+                counts['skipped'], counts['missing'], counts['failed'])))
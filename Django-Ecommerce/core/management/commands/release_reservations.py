@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.inventory import release_expired
+
+
+class Command(BaseCommand):
+    help = 'Hands the stock of expired checkout reservations back'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--every', type=float, default=0,
+                            help='Keep running, sweeping every N seconds')
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            released = release_expired(options['batch_size'])
+            self.stdout.write('Released {} reservations in {:.3f}s'.format(
+                released, time.monotonic() - started))
+            if not options['every']:
+                break
+            time.sleep(options['every'])
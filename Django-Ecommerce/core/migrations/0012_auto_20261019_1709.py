@@ -0,0 +1,32 @@
+# Generated by Django 2.2.4 on 2026-10-19 17:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_paymentattempt'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paymentattempt',
+            name='token',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='paymentattempt',
+            name='tries',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='paymentattempt',
+            name='status',
+            field=models.CharField(choices=[('Q', 'Queued'), ('P', 'Pending'), ('E', 'Error'), ('S', 'Succeeded'), ('F', 'Failed')], default='P', max_length=1),
+        ),
+        migrations.AddIndex(
+            model_name='paymentattempt',
+            index=models.Index(fields=['status', 'updated'], name='core_paymen_status_b4702a_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 2.2.4 on 2026-10-19 17:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_auto_20261019_1713'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='stock_shards',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='StockSlot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slot', models.IntegerField()),
+                ('stock', models.IntegerField(default=0)),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.Item')),
+            ],
+            options={
+                'unique_together': {('item', 'slot')},
+            },
+        ),
+    ]
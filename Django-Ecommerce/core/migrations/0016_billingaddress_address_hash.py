@@ -0,0 +1,41 @@
+# Generated by Django 2.2.4 on 2026-10-19 17:17
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def address_hash(street_address, apartment_address, country, zip, address_type):
+    # frozen copy of core.models.address_hash as of this migration
+    parts = [street_address, apartment_address, country, zip, address_type]
+    normalized = '|'.join(' '.join(str(p or '').lower().split()) for p in parts)
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
+def fill_address_hash(apps, schema_editor):
+    BillingAddress = apps.get_model('core', 'BillingAddress')
+    for address in BillingAddress.objects.iterator():
+        address.address_hash = address_hash(
+            address.street_address, address.apartment_address, address.country,
+            address.zip, address.address_type)
+        address.save(update_fields=['address_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_auto_20261019_1715'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='billingaddress',
+            name='address_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.RunPython(fill_address_hash, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='billingaddress',
+            index=models.Index(fields=['user', 'address_hash'], name='core_billin_user_id_42b1c9_idx'),
+        ),
+    ]
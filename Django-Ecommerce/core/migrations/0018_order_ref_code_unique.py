@@ -0,0 +1,50 @@
+# Generated by Django 2.2.4 on 2026-10-19 17:21
+
+import secrets
+import time
+
+from django.db import migrations, models
+
+REF_CODE_ALPHABET = '0123456789abcdefghjkmnpqrstvwxyz'
+
+
+def create_ref_code():
+    # frozen copy of core.models.create_ref_code as of this migration
+    value = (int(time.time() * 1000) << 50) | secrets.randbits(50)
+    chars = []
+    for _ in range(20):
+        value, index = divmod(value, 32)
+        chars.append(REF_CODE_ALPHABET[index])
+    return ''.join(reversed(chars))
+
+
+def clean_ref_codes(apps, schema_editor):
+    Order = apps.get_model('core', 'Order')
+    Order.objects.filter(ref_code='').update(ref_code=None)
+    seen = set()
+    for order in Order.objects.exclude(ref_code=None).order_by('pk').iterator():
+        if order.ref_code in seen:
+            order.ref_code = create_ref_code()
+            order.save(update_fields=['ref_code'])
+        seen.add(order.ref_code)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_auto_20261019_1719'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='ref_code',
+            field=models.CharField(blank=True, default=None, max_length=20, null=True),
+        ),
+        migrations.RunPython(clean_ref_codes, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='order',
+            name='ref_code',
+            field=models.CharField(blank=True, default=None, max_length=20, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 2.2.4 on 2026-10-19 17:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_order_ref_code_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='refund',
+            name='attempts',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='refund',
+            name='error',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='refund',
+            name='status',
+            field=models.CharField(choices=[('R', 'Requested'), ('Q', 'Queued'), ('P', 'Processing'), ('S', 'Refunded'), ('F', 'Failed')], default='R', max_length=1),
+        ),
+        migrations.AddField(
+            model_name='refund',
+            name='stripe_refund_id',
+            field=models.CharField(blank=True, max_length=50),
+        ),
+        migrations.AddField(
+            model_name='refund',
+            name='updated',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='refund',
+            index=models.Index(fields=['status', 'updated'], name='core_refund_status_594098_idx'),
+        ),
+    ]
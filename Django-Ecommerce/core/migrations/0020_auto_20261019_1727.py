@@ -0,0 +1,85 @@
+# Generated by Django 2.2.4 on 2026-10-19 17:27
+
+from django.db import migrations, models
+
+
+def rename_duplicate_codes(apps, schema_editor):
+    # later copies of a code get a numbered suffix; orders keep pointing
+    # at the same coupon row
+    Coupon = apps.get_model('core', 'Coupon')
+    taken = set(Coupon.objects.values_list('code', flat=True))
+    seen = set()
+    for coupon in Coupon.objects.order_by('pk').iterator():
+        if coupon.code in seen:
+            n = 2
+            while True:
+                suffix = '-{}'.format(n)
+                code = coupon.code[:15 - len(suffix)] + suffix
+                if code not in taken:
+                    break
+                n += 1
+            coupon.code = code
+            coupon.save(update_fields=['code'])
+            taken.add(code)
+        seen.add(coupon.code)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_auto_20261019_1721'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='coupon',
+            name='active',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name='coupon',
+            name='max_uses',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='coupon',
+            name='min_spend',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='coupon',
+            name='percent_off',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='coupon',
+            name='uses',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='coupon',
+            name='valid_from',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='coupon',
+            name='valid_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='coupon_redeemed',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name='coupon',
+            name='amount',
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunPython(rename_duplicate_codes, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='coupon',
+            name='code',
+            field=models.CharField(max_length=15, unique=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.4 on 2026-10-19 17:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_auto_20261019_1727'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='coupon',
+            name='campaign',
+            field=models.CharField(blank=True, db_index=True, max_length=50),
+        ),
+    ]
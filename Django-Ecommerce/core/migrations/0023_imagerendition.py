@@ -0,0 +1,28 @@
+# Generated by Django 2.2.4 on 2026-10-19 17:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0022_dailycategorysales_dailysales'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageRendition',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=255)),
+                ('format', models.CharField(choices=[('webp', 'WebP'), ('jpeg', 'JPEG')], max_length=4)),
+                ('width', models.IntegerField()),
+                ('height', models.IntegerField()),
+                ('name', models.CharField(max_length=255)),
+                ('size', models.IntegerField()),
+            ],
+            options={
+                'unique_together': {('source', 'format', 'width')},
+            },
+        ),
+    ]
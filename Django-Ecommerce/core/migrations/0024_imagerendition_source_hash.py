@@ -0,0 +1,23 @@
+# Generated by Django 2.2.4 on 2026-10-19 17:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0023_imagerendition'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imagerendition',
+            name='source_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='imagerendition',
+            name='spec',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+    ]
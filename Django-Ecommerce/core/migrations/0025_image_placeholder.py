@@ -0,0 +1,28 @@
+# Generated by Django 2.2.4 on 2026-10-19 17:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0024_imagerendition_source_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='image_placeholder',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='image_placeholder',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='slide',
+            name='image_placeholder',
+            field=models.TextField(blank=True, editable=False),
+        ),
+    ]
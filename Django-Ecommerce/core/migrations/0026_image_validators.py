@@ -0,0 +1,24 @@
+# Generated by Django 2.2.4 on 2026-10-19 17:56
+
+import core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0025_image_placeholder'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='category',
+            name='image',
+            field=models.ImageField(upload_to='', validators=[core.validators.ImageHeaderValidator(max_size=(4000, 4000))]),
+        ),
+        migrations.AlterField(
+            model_name='slide',
+            name='image',
+            field=models.ImageField(help_text='Size: 1920x570', upload_to='', validators=[core.validators.ImageHeaderValidator(max_size=(3840, 1140), min_size=(1920, 570))]),
+        ),
+    ]
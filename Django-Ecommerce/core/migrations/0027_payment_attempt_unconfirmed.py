@@ -0,0 +1,18 @@
+# Generated by Django 2.2.4 on 2026-10-19 18:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0026_image_validators'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='paymentattempt',
+            name='status',
+            field=models.CharField(choices=[('Q', 'Queued'), ('P', 'Pending'), ('E', 'Error'), ('U', 'Unconfirmed'), ('S', 'Succeeded'), ('F', 'Failed')], default='P', max_length=1),
+        ),
+    ]
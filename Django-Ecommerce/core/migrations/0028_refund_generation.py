@@ -0,0 +1,18 @@
+# Generated by Django 2.2.4 on 2026-10-19 18:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0027_payment_attempt_unconfirmed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='refund',
+            name='generation',
+            field=models.IntegerField(default=0),
+        ),
+    ]
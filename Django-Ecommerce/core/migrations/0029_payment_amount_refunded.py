@@ -0,0 +1,26 @@
+# Generated by Django 2.2.4 on 2026-10-19 18:28
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def fill_amount_refunded(apps, schema_editor):
+    # refunds recorded so far were counted in full
+    Payment = apps.get_model('core', 'Payment')
+    Payment.objects.filter(refunded=True).update(amount_refunded=F('amount'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0028_refund_generation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='amount_refunded',
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunPython(fill_amount_refunded, migrations.RunPython.noop),
+    ]
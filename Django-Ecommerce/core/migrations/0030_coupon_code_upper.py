@@ -0,0 +1,40 @@
+# Generated by Django 2.2.4 on 2026-10-19 18:30
+
+from django.db import migrations
+
+
+def upper_case_codes(apps, schema_editor):
+    # codes already in upper case keep them; the others are upper-cased,
+    # and one that now clashes gets a numbered suffix like in 0020
+    Coupon = apps.get_model('core', 'Coupon')
+    coupons = list(Coupon.objects.order_by('pk'))
+    taken = {coupon.code for coupon in coupons}
+    seen = set()
+    coupons.sort(key=lambda coupon: coupon.code != coupon.code.strip().upper())
+    for coupon in coupons:
+        code = coupon.code.strip().upper()
+        if code in seen:
+            n = 2
+            while True:
+                suffix = '-{}'.format(n)
+                candidate = code[:15 - len(suffix)] + suffix
+                if candidate not in taken:
+                    break
+                n += 1
+            code = candidate
+        if code != coupon.code:
+            coupon.code = code
+            coupon.save(update_fields=['code'])
+        taken.add(code)
+        seen.add(code)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0029_payment_amount_refunded'),
+    ]
+
+    operations = [
+        migrations.RunPython(upper_case_codes, migrations.RunPython.noop),
+    ]
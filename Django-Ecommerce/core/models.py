@@ -1,10 +1,17 @@
+import hashlib
+import secrets
+import time
+
 from django.conf import settings
 from django.db import models
 from django.db.models import Sum
 from django.shortcuts import reverse
+from django.utils import timezone
 from django_countries.fields import CountryField
 from django.core.validators import RegexValidator
 
+from .validators import ImageHeaderValidator
+
 # Create your models here.
 CATEGORY_CHOICES = (
     ('SB', 'Shirts And Blouses'),
@@ -29,7 +36,11 @@ class Slide(models.Model):
     caption1 = models.CharField(max_length=100)
     caption2 = models.CharField(max_length=100)
     link = models.CharField(max_length=100)
-    image = models.ImageField(help_text="Size: 1920x570")
+    image = models.ImageField(
+        help_text="Size: 1920x570", validators=[ImageHeaderValidator(
+            min_size=(1920, 570), max_size=(3840, 1140))])
+    # tiny inline preview shown while the image loads (core.images)
+    image_placeholder = models.TextField(blank=True, editable=False)
     is_active = models.BooleanField(default=True)
 
     def __str__(self):
@@ -47,7 +58,8 @@ class Category(models.Model):
         ],
     )
     description = models.TextField()
-    image = models.ImageField()
+    image = models.ImageField(validators=[ImageHeaderValidator(max_size=(4000, 4000))])
+    image_placeholder = models.TextField(blank=True, editable=False)
     is_active = models.BooleanField(default=True)
 
     slug_validator = RegexValidator(
@@ -73,9 +85,14 @@ class Item(models.Model):
     label = models.CharField(choices=LABEL_CHOICES, max_length=1)
     slug = models.SlugField()
     stock_no = models.CharField(max_length=10)
+    # units on hand and not reserved; None means stock is not tracked
+    stock = models.IntegerField(blank=True, null=True)
+    # above 1, stock lives in this many StockSlot rows to spread write load
+    stock_shards = models.IntegerField(default=0)
     description_short = models.CharField(max_length=50)
     description_long = models.TextField()
     image = models.ImageField()
+    image_placeholder = models.TextField(blank=True, editable=False)
     is_active = models.BooleanField(default=True)
 
     def __str__(self):
@@ -96,6 +113,27 @@ class Item(models.Model):
             'slug': self.slug
         })
 
+    @property
+    def is_sharded(self):
+        return self.stock_shards > 1
+
+    def get_stock(self):
+        if self.is_sharded:
+            return self.stockslot_set.aggregate(total=Sum('stock'))['total'] or 0
+        return self.stock
+
+
+class StockSlot(models.Model):
+    item = models.ForeignKey(Item, on_delete=models.CASCADE)
+    slot = models.IntegerField()
+    stock = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ['item', 'slot']
+
+    def __str__(self):
+        return f"{self.item.title} #{self.slot}"
+
 
 class OrderItem(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL,
@@ -103,31 +141,65 @@ class OrderItem(models.Model):
     ordered = models.BooleanField(default=False)
     item = models.ForeignKey(Item, on_delete=models.CASCADE)
     quantity = models.IntegerField(default=1)
+    # prices frozen when the order is paid; None while the line is in a cart
+    unit_price = models.FloatField(blank=True, null=True)
+    unit_discount_price = models.FloatField(blank=True, null=True)
 
     def __str__(self):
         return f"{self.quantity} of {self.item.title}"
 
+    def get_unit_price(self):
+        if self.unit_price is not None:
+            return self.unit_price
+        return self.item.price
+
+    def get_unit_discount_price(self):
+        if self.unit_price is not None:
+            return self.unit_discount_price
+        return self.item.discount_price
+
     def get_total_item_price(self):
-        return self.quantity * self.item.price
+        return self.quantity * self.get_unit_price()
 
     def get_total_discount_item_price(self):
-        return self.quantity * self.item.discount_price
+        return self.quantity * self.get_unit_discount_price()
 
     def get_amount_saved(self):
         return self.get_total_item_price() - self.get_total_discount_item_price()
 
     def get_final_price(self):
-        if self.item.discount_price:
+        if self.get_unit_discount_price():
             return self.get_total_discount_item_price()
         return self.get_total_item_price()
 
 
+REF_CODE_ALPHABET = '0123456789abcdefghjkmnpqrstvwxyz'
+
+
+def create_ref_code(now=None):
+    '''
+    20 characters of Crockford base32: 10 for the millisecond timestamp,
+    so codes sort by creation time, and 10 (50 bits) of randomness. The
+    unique index on Order.ref_code settles the remaining odds.
+    '''
+    millis = int((now if now is not None else time.time()) * 1000)
+    value = (millis << 50) | secrets.randbits(50)
+    chars = []
+    for _ in range(20):
+        value, index = divmod(value, 32)
+        chars.append(REF_CODE_ALPHABET[index])
+    return ''.join(reversed(chars))
+
+
 class Order(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL,
                              on_delete=models.CASCADE)
-    ref_code = models.CharField(max_length=20)
+    # set when the order is paid; carts have none
+    ref_code = models.CharField(
+        max_length=20, unique=True, blank=True, null=True, default=None)
     items = models.ManyToManyField(OrderItem)
     start_date = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
     ordered_date = models.DateTimeField()
     ordered = models.BooleanField(default=False)
     shipping_address = models.ForeignKey(
@@ -138,6 +210,8 @@ class Order(models.Model):
         'Payment', on_delete=models.SET_NULL, blank=True, null=True)
     coupon = models.ForeignKey(
         'Coupon', on_delete=models.SET_NULL, blank=True, null=True)
+    # set once the coupon's use has been counted at payment
+    coupon_redeemed = models.BooleanField(default=False)
     being_delivered = models.BooleanField(default=False)
     received = models.BooleanField(default=False)
     refund_requested = models.BooleanField(default=False)
@@ -153,17 +227,47 @@ class Order(models.Model):
     6. Refunds
     '''
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['ordered', 'updated']),
+        ]
+
     def __str__(self):
         return self.user.username
 
-    def get_total(self):
+    def touch(self):
+        """
+        Mark the cart as active without rewriting the whole row.
+        """
+        self.updated = timezone.now()
+        Order.objects.filter(pk=self.pk).update(updated=self.updated)
+
+    def get_subtotal(self):
         total = 0
         for order_item in self.items.all():
             total += order_item.get_final_price()
-        if self.coupon:
-            total -= self.coupon.amount
         return total
 
+    def get_coupon_discount(self, subtotal=None):
+        if not self.coupon:
+            return 0
+        if subtotal is None:
+            subtotal = self.get_subtotal()
+        return self.coupon.get_discount(subtotal)
+
+    def get_total(self):
+        total = self.get_subtotal()
+        return total - self.get_coupon_discount(total)
+
+
+def address_hash(street_address, apartment_address, country, zip, address_type):
+    '''
+    Same hash for addresses that differ only in case or spacing.
+    '''
+    parts = [street_address, apartment_address, country, zip, address_type]
+    normalized = '|'.join(' '.join(str(p or '').lower().split()) for p in parts)
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
 
 class BillingAddress(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL,
@@ -174,38 +278,270 @@ class BillingAddress(models.Model):
     zip = models.CharField(max_length=100)
     address_type = models.CharField(max_length=1, choices=ADDRESS_CHOICES)
     default = models.BooleanField(default=False)
+    address_hash = models.CharField(max_length=64, blank=True, editable=False)
 
     def __str__(self):
         return self.user.username
 
+    def save(self, *args, **kwargs):
+        self.address_hash = address_hash(
+            self.street_address, self.apartment_address, self.country,
+            self.zip, self.address_type)
+        super().save(*args, **kwargs)
+
     class Meta:
         verbose_name_plural = 'BillingAddresses'
+        indexes = [
+            models.Index(fields=['user', 'address_hash']),
+        ]
 
 
 class Payment(models.Model):
-    stripe_charge_id = models.CharField(max_length=50)
+    stripe_charge_id = models.CharField(max_length=50, db_index=True)
     user = models.ForeignKey(settings.AUTH_USER_MODEL,
                              on_delete=models.SET_NULL, blank=True, null=True)
     amount = models.FloatField()
     timestamp = models.DateTimeField(auto_now_add=True)
+    # kept in sync by the Stripe webhook
+    refunded = models.BooleanField(default=False)
+    # dollars given back once refunded; what the sales rollups count
+    amount_refunded = models.FloatField(default=0)
+    disputed = models.BooleanField(default=False)
 
     def __str__(self):
         return self.user.username
 
 
+class StockReservation(models.Model):
+    '''
+    Units taken off Item.stock at checkout. Committed at payment,
+    handed back by release_reservations once expired.
+    '''
+    item = models.ForeignKey(Item, on_delete=models.CASCADE)
+    order = models.ForeignKey(Order, on_delete=models.CASCADE)
+    quantity = models.IntegerField()
+    expires_at = models.DateTimeField()
+    committed = models.BooleanField(default=False)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['committed', 'expires_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} of {self.item.title}"
+
+
+class DailySales(models.Model):
+    '''
+    Sales of one day, by order date. Kept current by core.reports as
+    orders are paid and refunded; rebuild_sales recomputes history.
+    '''
+    date = models.DateField(unique=True)
+    orders = models.IntegerField(default=0)
+    units = models.IntegerField(default=0)
+    # after coupon discounts
+    revenue = models.FloatField(default=0)
+    discount = models.FloatField(default=0)
+    refunds = models.IntegerField(default=0)
+    refunded = models.FloatField(default=0)
+
+    class Meta:
+        verbose_name_plural = 'daily sales'
+
+    def __str__(self):
+        return str(self.date)
+
+
+class DailyCategorySales(models.Model):
+    '''
+    The lines of one day's orders by category and label, before coupons.
+    '''
+    date = models.DateField()
+    category = models.ForeignKey(Category, on_delete=models.CASCADE)
+    label = models.CharField(choices=LABEL_CHOICES, max_length=1)
+    orders = models.IntegerField(default=0)
+    units = models.IntegerField(default=0)
+    revenue = models.FloatField(default=0)
+
+    class Meta:
+        unique_together = [('date', 'category', 'label')]
+        verbose_name_plural = 'daily category sales'
+
+    def __str__(self):
+        return f"{self.date} {self.category_id} {self.label}"
+
+
+PAYMENT_ATTEMPT_STATUS_CHOICES = (
+    ('Q', 'Queued'),
+    ('P', 'Pending'),
+    ('E', 'Error'),
+    ('U', 'Unconfirmed'),
+    ('S', 'Succeeded'),
+    ('F', 'Failed'),
+)
+
+
+class PaymentAttempt(models.Model):
+    '''
+    One row per idempotency key sent to Stripe.
+    Queued: waiting for the process_payments worker
+    Pending: a request is in flight
+    Error: the outcome is unknown, retry with the same key
+    Unconfirmed: out of retries with the outcome still unknown; replayed
+    with the same key every PAYMENT_RECONCILE_INTERVAL until Stripe answers
+    Succeeded / Failed: final, retries reuse the stored result
+    '''
+    order = models.ForeignKey(Order, on_delete=models.CASCADE)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL,
+                             on_delete=models.SET_NULL, blank=True, null=True)
+    idempotency_key = models.CharField(max_length=64, unique=True)
+    amount = models.IntegerField()
+    status = models.CharField(
+        max_length=1, choices=PAYMENT_ATTEMPT_STATUS_CHOICES, default='P')
+    stripe_charge_id = models.CharField(max_length=50, blank=True)
+    error = models.CharField(max_length=255, blank=True)
+    # card token kept only until the queued charge has been made
+    token = models.CharField(max_length=255, blank=True)
+    tries = models.IntegerField(default=0)
+    payment = models.ForeignKey(
+        Payment, on_delete=models.SET_NULL, blank=True, null=True)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'updated']),
+        ]
+
+    def __str__(self):
+        return self.idempotency_key
+
+
+class StripeEvent(models.Model):
+    '''
+    Append-only log of webhook deliveries; the unique event id drops
+    Stripe's redeliveries. Applied later by process_stripe_events.
+    '''
+    event_id = models.CharField(max_length=255, unique=True)
+    type = models.CharField(max_length=100)
+    payload = models.TextField()
+    received = models.DateTimeField(auto_now_add=True)
+    processed = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['processed', 'received']),
+        ]
+
+    def __str__(self):
+        return self.event_id
+
+
 class Coupon(models.Model):
-    code = models.CharField(max_length=15)
-    amount = models.FloatField()
+    code = models.CharField(max_length=15, unique=True)
+    # flat amount off, percent_off of the subtotal, or both
+    amount = models.FloatField(default=0)
+    percent_off = models.PositiveSmallIntegerField(default=0)
+    min_spend = models.FloatField(default=0)
+    valid_from = models.DateTimeField(blank=True, null=True)
+    valid_until = models.DateTimeField(blank=True, null=True)
+    # blank means unlimited; uses only ever moves through conditional UPDATEs
+    max_uses = models.PositiveIntegerField(blank=True, null=True)
+    uses = models.PositiveIntegerField(default=0)
+    active = models.BooleanField(default=True)
+    # set on codes minted in bulk by generate_coupons
+    campaign = models.CharField(max_length=50, blank=True, db_index=True)
 
     def __str__(self):
         return self.code
 
+    def save(self, *args, **kwargs):
+        # codes are looked up upper-cased, so store them that way too and
+        # let the unique index catch 'abc' vs 'ABC'
+        self.code = self.code.strip().upper()
+        super().save(*args, **kwargs)
+
+    def get_error(self, subtotal, now=None):
+        '''
+        Returns why the coupon cannot be applied to `subtotal`, or None.
+        '''
+        now = now or timezone.now()
+        if not self.active:
+            return "This coupon is no longer active"
+        if self.valid_from and now < self.valid_from:
+            return "This coupon is not valid yet"
+        if self.valid_until and now >= self.valid_until:
+            return "This coupon has expired"
+        if self.max_uses is not None and self.uses >= self.max_uses:
+            return "This coupon has been used up"
+        if subtotal < self.min_spend:
+            return "This coupon needs a minimum spend of ${:.2f}".format(self.min_spend)
+        return None
+
+    def get_discount(self, subtotal):
+        discount = self.amount + subtotal * self.percent_off / 100
+        return min(discount, subtotal)
+
+
+REFUND_STATUS_CHOICES = (
+    ('R', 'Requested'),
+    ('Q', 'Queued'),
+    ('P', 'Processing'),
+    ('S', 'Refunded'),
+    ('F', 'Failed'),
+)
+
 
 class Refund(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE)
     reason = models.TextField()
     accepted = models.BooleanField(default=False)
     email = models.EmailField()
+    status = models.CharField(
+        max_length=1, choices=REFUND_STATUS_CHOICES, default='R')
+    stripe_refund_id = models.CharField(max_length=50, blank=True)
+    attempts = models.IntegerField(default=0)
+    # bumped whenever a failed refund is queued again, so the retry goes
+    # out under a fresh idempotency key
+    generation = models.IntegerField(default=0)
+    error = models.CharField(max_length=255, blank=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'updated']),
+        ]
 
     def __str__(self):
         return f"{self.pk}"
+
+
+RENDITION_FORMAT_CHOICES = (
+    ('webp', 'WebP'),
+    ('jpeg', 'JPEG'),
+)
+
+
+class ImageRendition(models.Model):
+    '''
+    A resized copy of an uploaded image (Item, Category or Slide), keyed
+    by the original's storage name. Written by core.images at upload.
+    '''
+    source = models.CharField(max_length=255)
+    format = models.CharField(max_length=4, choices=RENDITION_FORMAT_CHOICES)
+    width = models.IntegerField()
+    height = models.IntegerField()
+    name = models.CharField(max_length=255)
+    size = models.IntegerField()
+    # sha256 of the original and the settings it was rendered with, so a
+    # regeneration can skip what is already current
+    source_hash = models.CharField(max_length=64, blank=True)
+    spec = models.CharField(max_length=100, blank=True)
+
+    class Meta:
+        unique_together = ['source', 'format', 'width']
+
+    def __str__(self):
+        return self.name
@@ -0,0 +1,219 @@
+from datetime import timedelta
+
+import stripe
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import coupons
+from .gateway import RETRYABLE_ERRORS, get_gateway
+from .inventory import commit_order
+from .models import Order, OrderItem, Payment, PaymentAttempt, create_ref_code
+from .reports import record_order
+
+
+def get_amount(order):
+    return int(order.get_total() * 100)
+
+
+def idempotency_key(order, amount):
+    """
+    Derived from the order and the amount being charged. A declined
+    attempt is final for its key, so the next try gets a fresh one.
+    """
+    failed = PaymentAttempt.objects.filter(
+        order=order, amount=amount, status='F').count()
+    return 'order-{}-{}-{}'.format(order.pk, amount, failed)
+
+
+# attempts whose outcome is not settled yet
+OPEN_STATUSES = ['Q', 'P', 'E', 'U']
+
+
+def claim_attempt(order, user, amount, token, status='P'):
+    """
+    Returns (attempt, claimed). Only the caller holding the claim may
+    talk to Stripe; everyone else gets the stored attempt back. While an
+    attempt of the order is still open, no other is created: a cart
+    edited since gets the open attempt (and its amount) back.
+    """
+    key = idempotency_key(order, amount)
+    with transaction.atomic():
+        # serializes submits of the same order
+        Order.objects.select_for_update().filter(pk=order.pk).exists()
+        attempt = PaymentAttempt.objects.filter(
+            order=order, status__in=OPEN_STATUSES).exclude(idempotency_key=key).first()
+        if attempt is None:
+            try:
+                with transaction.atomic():
+                    attempt = PaymentAttempt.objects.create(
+                        order=order, user=user, idempotency_key=key, amount=amount,
+                        token=token or '', status=status)
+                return attempt, True
+            except IntegrityError:
+                attempt = PaymentAttempt.objects.get(idempotency_key=key)
+
+    stale = timezone.now() - timedelta(seconds=settings.PAYMENT_ATTEMPT_TIMEOUT)
+    claimed = PaymentAttempt.objects.filter(
+        pk=attempt.pk, status='E'
+    ).update(status=status, updated=timezone.now()) or PaymentAttempt.objects.filter(
+        pk=attempt.pk, status='P', updated__lt=stale
+    ).update(status=status, updated=timezone.now())
+    attempt.refresh_from_db()
+    return attempt, bool(claimed)
+
+
+def charge_order(order, user, token):
+    """
+    Charges the order at most once, however many times it is submitted.
+    Stripe errors are re-raised after the attempt has been recorded.
+    """
+    amount = get_amount(order)
+    attempt, claimed = claim_attempt(order, user, amount, token)
+    if not claimed:
+        return attempt
+    return perform_charge(attempt)
+
+
+def enqueue_charge(order, user, token):
+    """
+    Records the charge for the process_payments worker and returns
+    straight away, so the web worker never waits on Stripe.
+    """
+    amount = get_amount(order)
+    attempt, _ = claim_attempt(order, user, amount, token, status='Q')
+    return attempt
+
+
+def perform_charge(attempt):
+    """
+    Sends a claimed attempt to Stripe. A replay always reuses the stored
+    token, since Stripe rejects a known key sent with different params.
+    """
+    order = attempt.order
+    if Order.objects.filter(pk=order.pk, ordered=True).exists():
+        # paid through another attempt meanwhile; never charge it twice
+        attempt.status = 'F'
+        attempt.error = 'This order has already been paid'
+        attempt.token = ''
+        attempt.save()
+        return attempt
+    attempt.tries += 1
+    attempt.save(update_fields=['tries', 'updated'])
+    try:
+        charge = get_gateway().create_charge(
+            amount=attempt.amount,  # cents
+            currency="usd",
+            source=attempt.token,
+            idempotency_key=attempt.idempotency_key
+        )
+    except RETRYABLE_ERRORS as e:
+        record_error(attempt, 'E', e)
+        raise
+    except stripe.error.StripeError as e:
+        record_error(attempt, 'F', e)
+        raise
+
+    with transaction.atomic():
+        # create the payment
+        payment = Payment()
+        payment.stripe_charge_id = charge['id']
+        payment.user = attempt.user
+        payment.amount = attempt.amount / 100
+        payment.save()
+
+        attempt.status = 'S'
+        attempt.stripe_charge_id = charge['id']
+        attempt.payment = payment
+        attempt.token = ''
+        if not finalize_order(order, payment):
+            attempt.error = 'The order was already paid; refund this charge'
+        attempt.save()
+    return attempt
+
+
+def finalize_order(order, payment):
+    """
+    Closes the cart: freezes each line's prices, moves the lines out of
+    the (user, item, ordered=False) space add_to_cart draws from, and
+    marks the order paid, all in one transaction. Returns False, changing
+    nothing, if the order had already been paid.
+    """
+    with transaction.atomic():
+        if not Order.objects.select_for_update().filter(pk=order.pk, ordered=False).exists():
+            return False
+        lines = list(order.items.select_related('item'))
+        for line in lines:
+            line.ordered = True
+            line.unit_price = line.item.price
+            line.unit_discount_price = line.item.discount_price
+        OrderItem.objects.bulk_update(
+            lines, ['ordered', 'unit_price', 'unit_discount_price'])
+        commit_order(order)
+
+        # assign the payment to the order
+        order.ordered = True
+        order.ordered_date = timezone.now()
+        order.payment = payment
+        for _ in range(3):
+            order.ref_code = create_ref_code()
+            try:
+                with transaction.atomic():
+                    order.save()
+                break
+            except IntegrityError:
+                continue
+        else:
+            raise IntegrityError('Could not allocate a unique ref_code')
+        record_order(order, lines)
+    return True
+
+
+def process_queued(limit=50):
+    """
+    One pass of the payment worker: claims queued attempts (and ones left
+    in flight by a crashed worker) and charges them. Returns the number
+    of attempts handled.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.PAYMENT_ATTEMPT_TIMEOUT)
+    unconfirmed = now - timedelta(seconds=settings.PAYMENT_RECONCILE_INTERVAL)
+    claimable = (Q(status='Q') | Q(status='P', updated__lt=stale) |
+                 Q(status='U', updated__lt=unconfirmed))
+    pks = list(PaymentAttempt.objects.filter(claimable).order_by(
+        'updated').values_list('pk', flat=True)[:limit])
+
+    handled = 0
+    for pk in pks:
+        claimed = PaymentAttempt.objects.filter(claimable, pk=pk).update(
+            status='P', updated=timezone.now())
+        if not claimed:
+            # another worker got there first
+            continue
+        attempt = PaymentAttempt.objects.select_related('order', 'user').get(pk=pk)
+        try:
+            perform_charge(attempt)
+        except RETRYABLE_ERRORS as e:
+            if attempt.tries < settings.PAYMENT_MAX_TRIES:
+                PaymentAttempt.objects.filter(pk=pk, status='E').update(status='Q')
+            else:
+                # out of retries, but the charge may still have gone
+                # through: keep the key, the coupon use and the stock, and
+                # replay the same request later until Stripe answers
+                PaymentAttempt.objects.filter(pk=pk, status='E').update(status='U')
+        except stripe.error.StripeError:
+            pass
+        handled += 1
+    return handled
+
+
+def record_error(attempt, status, error):
+    attempt.status = status
+    attempt.error = (
+        error.user_message or str(error) or 'The payment could not be completed')[:255]
+    if status == 'F':
+        attempt.token = ''
+        # the next try counts the coupon again
+        coupons.release(attempt.order)
+    attempt.save()
@@ -0,0 +1,140 @@
+"""
+Per-client rate limiting for the endpoints that write on every request.
+
+Each policy in RATELIMIT_POLICIES is a token bucket: `burst` requests at
+once, refilled at `burst` per `period` seconds. Clients are told apart by
+their session key, taken from the session cookie unless the session has
+already been loaded, and otherwise by the client address, so a client
+over its limit gets a 429 without a single query.
+
+The default backend keeps the buckets in process memory, so every worker
+enforces the limit on its own. With RATELIMIT_BACKEND = 'cache' the count
+lives in the Django cache named by RATELIMIT_CACHE and is shared by all
+workers; it then becomes a fixed window of `period` seconds, because an
+atomic incr is all a shared cache offers.
+"""
+import math
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+
+
+class LocalBackend:
+    # buckets that have refilled completely are dropped past this many
+    MAX_BUCKETS = 10000
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def hit(self, key, burst, period):
+        """
+        Takes one token. Returns 0 if allowed, otherwise the seconds
+        until a token is available.
+        """
+        rate = burst / period
+        now = self.clock()
+        with self.lock:
+            tokens, last = self.buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - last) * rate)
+            if tokens >= 1:
+                self.buckets[key] = (tokens - 1, now)
+                if len(self.buckets) > self.MAX_BUCKETS:
+                    self.prune(now)
+                return 0
+            self.buckets[key] = (tokens, now)
+            return (1 - tokens) / rate
+
+    def prune(self, now):
+        policies = settings.RATELIMIT_POLICIES.values()
+        longest = max(period for burst, period in policies) if policies else 0
+        self.buckets = {
+            key: (tokens, last) for key, (tokens, last) in self.buckets.items()
+            if now - last < longest
+        }
+
+    def reset(self):
+        with self.lock:
+            self.buckets.clear()
+
+
+class CacheBackend:
+    def __init__(self, alias):
+        self.alias = alias
+
+    def hit(self, key, burst, period):
+        cache = caches[self.alias]
+        window = int(time.time() // period)
+        key = 'ratelimit:{}:{}'.format(key, window)
+        # add is a no-op when the window already exists
+        cache.add(key, 0, period)
+        try:
+            count = cache.incr(key)
+        except ValueError:
+            # evicted between add and incr
+            cache.set(key, 1, period)
+            count = 1
+        if count <= burst:
+            return 0
+        return (window + 1) * period - time.time()
+
+    def reset(self):
+        caches[self.alias].clear()
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            if settings.RATELIMIT_BACKEND == 'cache':
+                _backend = CacheBackend(settings.RATELIMIT_CACHE)
+            else:
+                _backend = LocalBackend()
+        return _backend
+
+
+def client_key(request):
+    session = getattr(request, 'session', None)
+    if session is not None and hasattr(session, '_session_cache'):
+        # already read for this request; the key costs nothing more
+        session_key = session.session_key
+    else:
+        # reading the session would cost a query on every request
+        session_key = request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    if session_key:
+        return 'session:{}'.format(session_key)
+    address = request.META.get('REMOTE_ADDR', '')
+    if settings.RATELIMIT_TRUST_FORWARDED:
+        forwarded = request.META.get('HTTP_X_FORWARDED_FOR')
+        if forwarded:
+            address = forwarded.split(',')[0].strip()
+    return 'ip:{}'.format(address)
+
+
+def ratelimit(policy):
+    """
+    View decorator applying the named policy from RATELIMIT_POLICIES.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if settings.RATELIMIT_ENABLE:
+                burst, period = settings.RATELIMIT_POLICIES[policy]
+                wait = get_backend().hit(
+                    '{}:{}'.format(policy, client_key(request)), burst, period)
+                if wait:
+                    response = HttpResponse('Too many requests', status=429)
+                    response['Retry-After'] = str(math.ceil(wait))
+                    return response
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,164 @@
+"""
+Refunds issued through the payment gateway.
+
+The admin action only queues ``Refund`` rows; ``execute_refunds`` works
+the queue off with a bounded thread pool, so a large batch is limited by
+how many requests Stripe takes at once rather than by one round trip
+after the other. Every order is refunded under its own idempotency key,
+so a retried or duplicated refund never pays out twice.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import stripe
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .gateway import RETRYABLE_ERRORS, get_gateway
+from .models import Order, Payment, Refund
+from .reports import record_refund
+
+
+def refund_key(refund):
+    """
+    Stripe replays the stored answer for a known key, failures included,
+    so every re-queue of a failed refund (a new generation) gets its own.
+    """
+    key = 'refund-order-{}'.format(refund.order_id)
+    if refund.generation:
+        key += '-{}'.format(refund.generation)
+    return key
+
+
+def enqueue_refunds(orders):
+    """
+    Queues a refund for every paid order in `orders`, reusing the
+    customer's refund request when there is one. Returns the number of
+    refunds queued.
+    """
+    orders = orders.filter(payment__isnull=False).exclude(
+        payment__refunded=True).select_related('user')
+    queued = 0
+    with transaction.atomic():
+        pending = {
+            refund.order_id: refund
+            for refund in Refund.objects.filter(order__in=orders).exclude(status='S')
+        }
+        new = []
+        for order in orders:
+            refund = pending.get(order.pk)
+            if refund is None:
+                new.append(Refund(
+                    order=order, reason='Granted by staff',
+                    email=order.user.email, status='Q'))
+            elif refund.status in ('R', 'F'):
+                if refund.status == 'F':
+                    refund.generation += 1
+                refund.status = 'Q'
+                refund.attempts = 0
+                refund.error = ''
+                refund.save(update_fields=[
+                    'status', 'attempts', 'generation', 'error', 'updated'])
+            else:
+                # already queued or in flight
+                continue
+            queued += 1
+        Refund.objects.bulk_create(new)
+    return queued
+
+
+def claimable():
+    stale = timezone.now() - timedelta(seconds=settings.PAYMENT_ATTEMPT_TIMEOUT)
+    # refunds left in flight by a crashed worker are picked up again
+    return Q(status='Q') | Q(status='P', updated__lt=stale)
+
+
+def process_refund(refund):
+    """
+    Claims one queued refund and sends it to Stripe. Returns the final
+    status letter, or None if another worker had claimed it. `refund`
+    comes with its order and payment already loaded, so a worker only
+    ever issues single-row UPDATEs.
+    """
+    claimed = Refund.objects.filter(claimable(), pk=refund.pk).update(
+        status='P', attempts=F('attempts') + 1, updated=timezone.now())
+    if not claimed:
+        return None
+    refund.attempts += 1
+    payment = refund.order.payment
+
+    try:
+        result = get_gateway().create_refund(
+            charge=payment.stripe_charge_id,
+            idempotency_key=refund_key(refund))
+    except RETRYABLE_ERRORS as e:
+        status = 'Q' if refund.attempts < settings.REFUND_MAX_ATTEMPTS else 'F'
+        return record_error(refund, status, e)
+    except stripe.error.StripeError as e:
+        return record_error(refund, 'F', e)
+
+    # no transaction needed: the refund row is marked done last, and a
+    # worker that dies before that replays the same key and lands here again
+    if Payment.objects.filter(pk=payment.pk, refunded=False).update(
+            refunded=True, amount_refunded=payment.amount):
+        record_refund(refund.order, payment.amount)
+    Order.objects.filter(pk=refund.order_id).update(
+        refund_requested=False, refund_granted=True)
+    Refund.objects.filter(pk=refund.pk).update(
+        status='S', accepted=True, stripe_refund_id=result['id'],
+        error='', updated=timezone.now())
+    return 'S'
+
+
+def record_error(refund, status, error):
+    Refund.objects.filter(pk=refund.pk, status='P').update(
+        status=status, error=(error.user_message or str(error) or '')[:255],
+        updated=timezone.now())
+    return status
+
+
+def execute_refunds(max_workers=None, batch_size=500, orders=None):
+    """
+    Drains the refund queue with `max_workers` concurrent requests.
+    Returns a dict counting the outcome of every attempt made ('S', 'F',
+    or 'Q' for a transient error that was queued again).
+
+    With `orders`, only their refunds are tried, once each: refunds that
+    hit a transient error stay queued for ``manage.py process_refunds``
+    instead of being retried while the caller waits.
+    """
+    max_workers = max_workers or settings.REFUND_WORKERS
+    results = {}
+    tried = set()
+
+    def run(refund):
+        try:
+            return process_refund(refund)
+        finally:
+            # each pool thread holds its own connection
+            connection.close()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while True:
+            queue = Refund.objects.filter(claimable())
+            if orders is not None:
+                queue = queue.filter(order__in=orders).exclude(pk__in=tried)
+            refunds = list(queue.select_related(
+                'order__payment').order_by('updated')[:batch_size])
+            if not refunds:
+                break
+            statuses = [status for status in pool.map(run, refunds) if status]
+            if not statuses:
+                break
+            for status in statuses:
+                results[status] = results.get(status, 0) + 1
+            if orders is not None:
+                tried.update(refund.pk for refund in refunds)
+            elif 'Q' in statuses:
+                # some were requeued after a transient error; give the
+                # processor a moment before the next pass
+                time.sleep(settings.REFUND_RETRY_DELAY)
+    return results
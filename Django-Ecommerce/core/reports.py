@@ -0,0 +1,189 @@
+"""
+Sales rollups.
+
+``DailySales`` and ``DailyCategorySales`` hold one row per day (and per
+category and label), so the dashboard reads a few hundred small rows
+however many orders lie behind them. Paid orders and refunds are added
+as they happen; ``rebuild`` recomputes a date range from the orders with
+the same arithmetic, for the backfill and for repairs.
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import LABEL_CHOICES, Category, DailyCategorySales, DailySales, Order
+
+TOTAL_FIELDS = ['orders', 'units', 'revenue', 'discount', 'refunds', 'refunded']
+CATEGORY_FIELDS = ['orders', 'units', 'revenue']
+
+
+def order_date(order):
+    return timezone.localdate(order.ordered_date)
+
+
+def contributions(order, lines=None):
+    """
+    Returns the order's share of its day: a dict of totals and a dict of
+    (category_id, label) -> dict.
+    """
+    if lines is None:
+        lines = list(order.items.select_related('item'))
+    by_category = defaultdict(lambda: {'orders': 1, 'units': 0, 'revenue': 0})
+    subtotal = units = 0
+    for line in lines:
+        price = line.get_final_price()
+        subtotal += price
+        units += line.quantity
+        row = by_category[(line.item.category_id, line.item.label)]
+        row['units'] += line.quantity
+        row['revenue'] += price
+    discount = order.get_coupon_discount(subtotal)
+    totals = {
+        'orders': 1,
+        'units': units,
+        'revenue': subtotal - discount,
+        'discount': discount,
+        'refunds': 0,
+        'refunded': 0,
+    }
+    return totals, dict(by_category)
+
+
+def bump(model, keys, amounts):
+    """
+    Adds `amounts` to the row identified by `keys`, creating it first if
+    needed; the additions are UPDATEs with F() so concurrent orders on
+    the same day do not overwrite each other.
+    """
+    changes = {name: F(name) + value for name, value in amounts.items() if value}
+    if not changes:
+        return
+    if model.objects.filter(**keys).update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**keys, **amounts)
+    except IntegrityError:
+        # another order created the row first
+        model.objects.filter(**keys).update(**changes)
+
+
+def record_order(order, lines=None):
+    """
+    Called from finalize_order, inside its transaction.
+    """
+    day = order_date(order)
+    totals, by_category = contributions(order, lines)
+    bump(DailySales, {'date': day}, totals)
+    for (category_id, label), amounts in by_category.items():
+        bump(DailyCategorySales, {
+            'date': day, 'category_id': category_id, 'label': label}, amounts)
+
+
+def record_refund(order, amount):
+    """
+    Counts a refund against the day the order was placed. Callers make
+    sure each payment is only counted once.
+    """
+    bump(DailySales, {'date': order_date(order)}, {'refunds': 1, 'refunded': amount})
+
+
+def day_bounds(start, end):
+    tz = timezone.get_current_timezone()
+    return (timezone.make_aware(datetime.combine(start, time.min), tz),
+            timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min), tz))
+
+
+def tally(start, end):
+    """
+    Reads the paid orders of the days start..end (inclusive) and returns
+    (orders read, totals by day, totals by (day, category, label)). Only
+    reads, so ranges can be tallied in parallel. The range is read in one
+    go, so callers keep it to a few weeks.
+    """
+    since, until = day_bounds(start, end)
+    orders = Order.objects.filter(
+        ordered=True, ordered_date__gte=since, ordered_date__lt=until
+    ).select_related('coupon', 'payment').prefetch_related('items__item')
+
+    totals = defaultdict(lambda: dict.fromkeys(TOTAL_FIELDS, 0))
+    by_category = defaultdict(lambda: dict.fromkeys(CATEGORY_FIELDS, 0))
+    count = 0
+    for order in orders:
+        count += 1
+        day = order_date(order)
+        order_totals, order_categories = contributions(order, order.items.all())
+        if order.payment and order.payment.refunded:
+            order_totals['refunds'] = 1
+            order_totals['refunded'] = order.payment.amount_refunded
+        for name, value in order_totals.items():
+            totals[day][name] += value
+        for (category_id, label), amounts in order_categories.items():
+            for name, value in amounts.items():
+                by_category[(day, category_id, label)][name] += value
+    return count, totals, by_category
+
+
+def save_rollups(start, end, totals, by_category):
+    """
+    Replaces the rollups of the days start..end with a `tally` result.
+    """
+    with transaction.atomic():
+        DailySales.objects.filter(date__gte=start, date__lte=end).delete()
+        DailyCategorySales.objects.filter(date__gte=start, date__lte=end).delete()
+        DailySales.objects.bulk_create(
+            DailySales(date=day, **amounts) for day, amounts in totals.items())
+        DailyCategorySales.objects.bulk_create(
+            DailyCategorySales(date=day, category_id=category_id, label=label, **amounts)
+            for (day, category_id, label), amounts in by_category.items())
+
+
+def rebuild(start, end):
+    """
+    Recomputes the rollups for the days start..end (inclusive) from the
+    paid orders. Returns the number of orders read.
+    """
+    count, totals, by_category = tally(start, end)
+    save_rollups(start, end, totals, by_category)
+    return count
+
+
+def dashboard(start, end):
+    """
+    Everything the sales dashboard shows, read from the rollups only. The
+    category rows are scanned once, grouped by (category, label), and
+    folded into both breakdowns here.
+    """
+    days = list(DailySales.objects.filter(
+        date__gte=start, date__lte=end).order_by('date').values('date', *TOTAL_FIELDS))
+    totals = {name: sum(day[name] for day in days) for name in TOTAL_FIELDS}
+    totals['average'] = totals['revenue'] / totals['orders'] if totals['orders'] else 0
+
+    groups = DailyCategorySales.objects.filter(
+        date__gte=start, date__lte=end
+    ).values('category_id', 'label').annotate(
+        orders=Sum('orders'), units=Sum('units'), revenue=Sum('revenue')
+    ).order_by()
+    categories = defaultdict(lambda: dict.fromkeys(CATEGORY_FIELDS, 0))
+    labels = defaultdict(lambda: dict.fromkeys(CATEGORY_FIELDS, 0))
+    for group in groups:
+        for name in CATEGORY_FIELDS:
+            categories[group['category_id']][name] += group[name]
+            labels[group['label']][name] += group[name]
+    titles = dict(Category.objects.filter(pk__in=categories).values_list('pk', 'title'))
+    label_names = dict(LABEL_CHOICES)
+
+    def ranked(rows, names):
+        return sorted(
+            (dict(name=names.get(key, key), **amounts) for key, amounts in rows.items()),
+            key=lambda row: -row['revenue'])
+
+    return {
+        'totals': totals,
+        'days': days,
+        'categories': ranked(categories, titles),
+        'labels': ranked(labels, label_names),
+    }
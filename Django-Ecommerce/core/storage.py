@@ -0,0 +1,65 @@
+"""
+Content-addressed media storage.
+
+Every saved file is named after the sha256 of its content (keeping the
+requested directory and extension), so identical uploads are stored
+once, and a name never points at different bytes: its URL can be cached
+forever. Files saved under their own names before this storage was
+enabled keep working; ``manage.py dedupe_media`` moves them over.
+"""
+import hashlib
+import os
+import re
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.views.static import serve
+
+HASH_LENGTH = 32
+HASHED_NAME = re.compile(r'(^|/)[0-9a-f]{%d}(\.[^/]*)?$' % HASH_LENGTH)
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+def hashed_name(name, content):
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    directory = os.path.dirname(name)
+    extension = os.path.splitext(name)[1].lower()
+    return os.path.join(directory, digest.hexdigest()[:HASH_LENGTH] + extension)
+
+
+def is_hashed(name):
+    return bool(HASHED_NAME.search(name))
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    '''
+    FileSystemStorage that stores a file under the hash of its content
+    and returns the existing file instead of writing a copy.
+    '''
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = hashed_name(name, content).replace('\\', '/')
+        if self.exists(name):
+            return name
+        saved = self._save(name, content)
+        if saved != name:
+            # the same bytes were saved at the same moment; keep one copy
+            self.delete(saved)
+        return name
+
+
+def serve_media(request, path, document_root=None):
+    """
+    django.views.static.serve for MEDIA_URL in development, marking
+    content-addressed files as cacheable forever.
+    """
+    response = serve(request, path, document_root=document_root)
+    if is_hashed(path):
+        response['Cache-Control'] = IMMUTABLE
+    return response
@@ -2,9 +2,13 @@ from django import template
 from django.utils.safestring import mark_safe
 
 from core.models import Category
+from core.templatetags.image_template_tags import responsive_image
 
 register = template.Library()
 
+# banners sit two to a column, three columns from lg up, below the slides
+BANNER_SIZES = '(max-width: 991px) 100vw, 33vw'
+
 
 @register.simple_tag
 def categories():
@@ -44,11 +48,13 @@ def categories_div():
     item_div_list = ""
     for i, j in enumerate(items):
         if not i % 2:
-            items_div += """<div class="block1 hov-img-zoom pos-relative m-b-30"><img src="/media/{}" alt="IMG-BENNER"><div class="block1-wrapbtn w-size2"><a href="/category/{}" class="flex-c-m size2 m-text2 bg3 hov1 trans-0-4">{}</a></div></div>""".format(
-                j.image, j.slug, j.title)
+            items_div += """<div class="block1 hov-img-zoom pos-relative m-b-30">{}<div class="block1-wrapbtn w-size2"><a href="/category/{}" class="flex-c-m size2 m-text2 bg3 hov1 trans-0-4">{}</a></div></div>""".format(
+                responsive_image(
+                    j.image, BANNER_SIZES, 'IMG-BENNER', placeholder=j.image_placeholder, lazy=True), j.slug, j.title)
         else:
-            items_div_ = """<div class="block1 hov-img-zoom pos-relative m-b-30"><img src="/media/{}" alt="IMG-BENNER"><div class="block1-wrapbtn w-size2"><a href="/category/{}" class="flex-c-m size2 m-text2 bg3 hov1 trans-0-4">{}</a></div></div>""".format(
-                j.image, j.slug, j.title)
+            items_div_ = """<div class="block1 hov-img-zoom pos-relative m-b-30">{}<div class="block1-wrapbtn w-size2"><a href="/category/{}" class="flex-c-m size2 m-text2 bg3 hov1 trans-0-4">{}</a></div></div>""".format(
+                responsive_image(
+                    j.image, BANNER_SIZES, 'IMG-BENNER', placeholder=j.image_placeholder, lazy=True), j.slug, j.title)
             item_div_list += """<div class="col-sm-10 col-md-8 col-lg-4 m-l-r-auto">""" + items_div + items_div_ + """</div>"""
             items_div = ""
 
@@ -0,0 +1,67 @@
+from django import template
+from django.utils.html import format_html
+
+from core.images import RenditionCache, image_url, srcsets
+
+register = template.Library()
+
+# the shop grid: one column on phones, two on tablets, three from lg up
+GRID_SIZES = '(max-width: 767px) 100vw, (max-width: 991px) 50vw, 33vw'
+# grid images up to here are usually on screen at load and skip lazy loading
+EAGER_IMAGES = 4
+
+
+def renditions(context):
+    # one cache per page; the first image loads the renditions of every
+    # item in the page's object_list in a single query
+    cache = context.render_context.get(RenditionCache)
+    if cache is None:
+        cache = context.render_context[RenditionCache] = RenditionCache()
+        cache.load(getattr(getattr(obj, 'image', None), 'name', None)
+                   for obj in context.get('object_list') or [])
+    return cache
+
+
+@register.filter
+def below_fold(position):
+    """
+    {% responsive_image ... lazy=forloop.counter|below_fold %}
+    """
+    return position > EAGER_IMAGES
+
+
+@register.simple_tag(takes_context=True)
+def responsive_image(context, image, sizes=GRID_SIZES, alt='', style='', placeholder='', lazy=False):
+    """
+    <picture> with WebP and JPEG srcsets of the image's renditions; a
+    plain <img> of the original when it has none. `placeholder` (the
+    model's image_placeholder) is painted as the background until the
+    image arrives; `lazy` defers the download until it nears the viewport.
+    """
+    if not image:
+        return ''
+    if placeholder:
+        style = format_html('{} background: url({}) center / cover no-repeat;',
+                            style, placeholder)
+    candidates = srcsets(image, renditions(context))
+    img = format_html('<img src="{}" alt="{}" style="{}"', image.url, alt, style)
+    if lazy:
+        img = format_html('{} loading="lazy" decoding="async"', img)
+    if not candidates:
+        return format_html('{}>', img)
+    sources = ''
+    if 'webp' in candidates:
+        sources = format_html('<source type="image/webp" srcset="{}" sizes="{}">',
+                              candidates['webp'], sizes)
+    if 'jpeg' in candidates:
+        img = format_html('{} srcset="{}" sizes="{}"', img, candidates['jpeg'], sizes)
+    return format_html('<picture>{}{}></picture>', sources, img)
+
+
+@register.simple_tag(takes_context=True)
+def rendition_url(context, image, width):
+    """
+    URL of the smallest JPEG rendition at least `width` px wide, for CSS
+    backgrounds.
+    """
+    return image_url(image, width, renditions(context)) if image else ''
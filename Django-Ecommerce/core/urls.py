@@ -9,6 +9,9 @@ from .views import (
     remove_single_item_from_cart,
     CheckoutView,
     PaymentView,
+    PaymentStatusView,
+    payment_gateway_metrics,
+    stripe_webhook,
     AddCouponView,
     RequestRefundView,
     CategoryView
@@ -28,6 +31,9 @@ urlpatterns = [
     path('order-summary/', OrderSummaryView.as_view(), name='order-summary'),
     path('remove-item-from-cart/<slug>/', remove_single_item_from_cart,
          name='remove-single-item-from-cart'),
+    path('payment-metrics/', payment_gateway_metrics, name='payment-metrics'),
     path('payment/<payment_option>/', PaymentView.as_view(), name='payment'),
+    path('payment/status/<key>/', PaymentStatusView.as_view(), name='payment-status'),
+    path('webhooks/stripe/', stripe_webhook, name='stripe-webhook'),
     path('request-refund/', RequestRefundView.as_view(), name='request-refund')
 ]
@@ -0,0 +1,80 @@
+"""
+Upload checks that read only the image header.
+
+Pillow's ``Image.open`` parses the format and dimensions from the first
+few KB and decodes no pixels, so an oversized or wrong-format upload is
+refused without the cost of loading it; the file is then streamed to
+storage in chunks as usual.
+"""
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.utils.deconstruct import deconstructible
+from PIL import Image
+
+
+def read_header(f):
+    """
+    (format, width, height) of the image in `f`, leaving the file at its
+    start. Raises ValidationError if it is not an image Pillow knows.
+    """
+    f.seek(0)
+    try:
+        with Image.open(f) as image:
+            return image.format, image.width, image.height
+    except (OSError, Image.DecompressionBombError):
+        raise ValidationError('Upload a valid image.', code='invalid_image')
+    finally:
+        f.seek(0)
+
+
+@deconstructible
+class ImageHeaderValidator:
+    '''
+    Checks byte size, format and dimensions of a newly uploaded image.
+    Files already in storage are not re-read. `min_size` / `max_size` are
+    (width, height); byte size and formats default to
+    IMAGE_UPLOAD_MAX_BYTES and IMAGE_UPLOAD_FORMATS.
+    '''
+
+    def __init__(self, min_size=None, max_size=None, max_bytes=None, formats=None):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.formats = formats
+
+    def __call__(self, value):
+        if not value or getattr(value, '_committed', True):
+            return
+        max_bytes = self.max_bytes or settings.IMAGE_UPLOAD_MAX_BYTES
+        if value.size > max_bytes:
+            raise ValidationError(
+                'The file is %(size).1f MB; the limit is %(limit).1f MB.',
+                code='file_too_large',
+                params={'size': value.size / 1e6, 'limit': max_bytes / 1e6})
+
+        fmt, width, height = read_header(value.file)
+        formats = self.formats or settings.IMAGE_UPLOAD_FORMATS
+        if fmt not in formats:
+            raise ValidationError(
+                '%(format)s images are not accepted; use %(formats)s.',
+                code='invalid_format',
+                params={'format': fmt, 'formats': ', '.join(formats)})
+        if self.min_size and (width < self.min_size[0] or height < self.min_size[1]):
+            raise ValidationError(
+                'The image is %(width)dx%(height)d; it must be at least %(min)s.',
+                code='image_too_small',
+                params={'width': width, 'height': height,
+                        'min': '{}x{}'.format(*self.min_size)})
+        if self.max_size and (width > self.max_size[0] or height > self.max_size[1]):
+            raise ValidationError(
+                'The image is %(width)dx%(height)d; it must be at most %(max)s.',
+                code='image_too_large',
+                params={'width': width, 'height': height,
+                        'max': '{}x{}'.format(*self.max_size)})
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, ImageHeaderValidator) and
+            (self.min_size, self.max_size, self.max_bytes, self.formats) ==
+            (other.min_size, other.max_size, other.max_bytes, other.formats)
+        )
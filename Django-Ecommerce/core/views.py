@@ -1,26 +1,30 @@
 from django.conf import settings
 from django.contrib import messages
-from django.core.exceptions import ObjectDoesNotExist
+from django.core.exceptions import ImproperlyConfigured, ObjectDoesNotExist
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.shortcuts import render, get_object_or_404
 from django.views.generic import ListView, DetailView, View
 from django.shortcuts import redirect
 from django.utils import timezone
+from django.utils.decorators import method_decorator
 from .forms import CheckoutForm, CouponForm, RefundForm
-from .models import Item, OrderItem, Order, BillingAddress, Payment, Coupon, Refund, Category
-from django.http import HttpResponseRedirect
+from .models import address_hash, Item, OrderItem, Order, BillingAddress, Payment, PaymentAttempt, Coupon, Refund, Category
+from django.http import HttpResponse, HttpResponseRedirect, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from django.shortcuts import render_to_response
 
+from . import coupons
+from .gateway import get_gateway
+from .inventory import OutOfStock, reserve_order
+from .payments import charge_order, enqueue_charge
+from .ratelimit import ratelimit
+from . import webhooks
+
 # Create your views here.
-import random
-import string
 import stripe
-stripe.api_key = settings.STRIPE_SECRET_KEY
-
-
-def create_ref_code():
-    return ''.join(random.choices(string.ascii_lowercase + string.digits, k=20))
 
 
 class PaymentView(View):
@@ -39,30 +43,34 @@ class PaymentView(View):
             return redirect("core:checkout")
 
     def post(self, *args, **kwargs):
-        order = Order.objects.get(user=self.request.user, ordered=False)
+        order = Order.objects.filter(user=self.request.user, ordered=False).first()
+        if order is None:
+            # a retried submission whose first request already went through
+            messages.info(self.request, "You do not have an active order")
+            return redirect("/")
         token = self.request.POST.get('stripeToken')
-        amount = int(order.get_total() * 100)
         try:
-            charge = stripe.Charge.create(
-                amount=amount,  # cents
-                currency="usd",
-                source=token
-            )
-            # create the payment
-            payment = Payment()
-            payment.stripe_charge_id = charge['id']
-            payment.user = self.request.user
-            payment.amount = order.get_total()
-            payment.save()
-
-            # assign the payment to the order
-            order.ordered = True
-            order.payment = payment
-            # TODO : assign ref code
-            order.ref_code = create_ref_code()
+            # extend the checkout reservation to cover the charge
+            reserve_order(order)
+        except OutOfStock as e:
+            messages.warning(self.request, str(e))
+            return redirect("core:order-summary")
+        if order.coupon_id and not coupons.redeem(order):
+            order.coupon = None
             order.save()
-
-            messages.success(self.request, "Order was successful")
+            messages.warning(self.request, "Your coupon is no longer available")
+            return redirect("core:checkout")
+        if settings.PAYMENT_ASYNC:
+            attempt = enqueue_charge(order, self.request.user, token)
+            return redirect('core:payment-status', key=attempt.idempotency_key)
+        try:
+            attempt = charge_order(order, self.request.user, token)
+            if attempt.status == 'S':
+                messages.success(self.request, "Order was successful")
+            elif attempt.status == 'F':
+                messages.error(self.request, attempt.error)
+            else:
+                messages.info(self.request, "Your payment is being processed")
             return redirect("/")
 
         except stripe.error.CardError as e:
@@ -105,6 +113,50 @@ class PaymentView(View):
             return redirect("/")
 
 
+class PaymentStatusView(LoginRequiredMixin, View):
+    STATUS = {
+        'Q': 'pending',
+        'P': 'pending',
+        'E': 'pending',
+        'U': 'pending',
+        'S': 'succeeded',
+        'F': 'failed',
+    }
+
+    def get(self, *args, **kwargs):
+        attempt = get_object_or_404(
+            PaymentAttempt, idempotency_key=self.kwargs['key'], user=self.request.user)
+        status = self.STATUS[attempt.status]
+        if self.request.is_ajax():
+            return JsonResponse({'status': status, 'message': attempt.error})
+        context = {
+            'attempt': attempt,
+            'status': status
+        }
+        return render(self.request, "payment_status.html", context)
+
+
+@staff_member_required
+def payment_gateway_metrics(request):
+    gateway = get_gateway()
+    metrics = gateway.metrics.snapshot()
+    metrics['breaker'] = gateway.breaker.state
+    return JsonResponse(metrics)
+
+
+@csrf_exempt
+@require_POST
+def stripe_webhook(request):
+    try:
+        webhooks.ingest(request.body, request.META.get('HTTP_STRIPE_SIGNATURE', ''))
+    except ImproperlyConfigured:
+        # nothing to verify against; Stripe retries once it is configured
+        return HttpResponse(status=503)
+    except (stripe.error.SignatureVerificationError, ValueError, KeyError):
+        return HttpResponse(status=400)
+    return HttpResponse(status=200)
+
+
 class HomeView(ListView):
     template_name = "index.html"
     queryset = Item.objects.filter(is_active=True)
@@ -156,7 +208,7 @@ class CheckoutView(View):
     def get(self, *args, **kwargs):
         try:
             order = Order.objects.get(user=self.request.user, ordered=False)
-            form = CheckoutForm()
+            form = CheckoutForm(initial=self.get_initial())
             context = {
                 'form': form,
                 'couponform': CouponForm(),
@@ -169,11 +221,26 @@ class CheckoutView(View):
             messages.info(self.request, "You do not have an active order")
             return redirect("core:checkout")
 
+    def get_initial(self):
+        # pre-fill from the order's address, else the user's default one
+        order = Order.objects.filter(user=self.request.user, ordered=False).first()
+        address = order.billing_address if order and order.billing_address_id else None
+        if address is None:
+            address = BillingAddress.objects.filter(
+                user=self.request.user, address_type='B', default=True).first()
+        if address is None:
+            return {}
+        return {
+            'street_address': address.street_address,
+            'apartment_address': address.apartment_address,
+            'country': address.country,
+            'zip': address.zip,
+        }
+
     def post(self, *args, **kwargs):
         form = CheckoutForm(self.request.POST or None)
         try:
             order = Order.objects.get(user=self.request.user, ordered=False)
-            print(self.request.POST)
             if form.is_valid():
                 street_address = form.cleaned_data.get('street_address')
                 apartment_address = form.cleaned_data.get('apartment_address')
@@ -182,19 +249,38 @@ class CheckoutView(View):
                 # add functionality for these fields
                 # same_shipping_address = form.cleaned_data.get(
                 #     'same_shipping_address')
-                # save_info = form.cleaned_data.get('save_info')
+                save_info = form.cleaned_data.get('save_info')
                 payment_option = form.cleaned_data.get('payment_option')
-                billing_address = BillingAddress(
+                billing_address = BillingAddress.objects.filter(
                     user=self.request.user,
-                    street_address=street_address,
-                    apartment_address=apartment_address,
-                    country=country,
-                    zip=zip,
-                    address_type='B'
-                )
-                billing_address.save()
-                order.billing_address = billing_address
-                order.save()
+                    address_hash=address_hash(
+                        street_address, apartment_address, country, zip, 'B')
+                ).first()
+                if billing_address is None:
+                    billing_address = BillingAddress(
+                        user=self.request.user,
+                        street_address=street_address,
+                        apartment_address=apartment_address,
+                        country=country,
+                        zip=zip,
+                        address_type='B'
+                    )
+                    billing_address.save()
+                if save_info and not billing_address.default:
+                    BillingAddress.objects.filter(
+                        user=self.request.user, address_type='B', default=True
+                    ).update(default=False)
+                    billing_address.default = True
+                    billing_address.save(update_fields=['default'])
+                if order.billing_address_id != billing_address.pk:
+                    order.billing_address = billing_address
+                    order.save()
+
+                try:
+                    reserve_order(order)
+                except OutOfStock as e:
+                    messages.warning(self.request, str(e))
+                    return redirect("core:order-summary")
 
                 # add redirect to the selected payment option
                 if payment_option == 'S':
@@ -231,6 +317,7 @@ class CheckoutView(View):
 #     return render(request, "shop.html", context)
 
 
+@ratelimit('cart')
 @login_required
 def add_to_cart(request, slug):
     item = get_object_or_404(Item, slug=slug)
@@ -242,6 +329,7 @@ def add_to_cart(request, slug):
     order_qs = Order.objects.filter(user=request.user, ordered=False)
     if order_qs.exists():
         order = order_qs[0]
+        order.touch()
         if order.items.filter(item__slug=item.slug).exists():
             order_item.quantity += 1
             order_item.save()
@@ -260,6 +348,7 @@ def add_to_cart(request, slug):
     return redirect("core:order-summary")
 
 
+@ratelimit('cart')
 @login_required
 def remove_from_cart(request, slug):
     item = get_object_or_404(Item, slug=slug)
@@ -268,6 +357,7 @@ def remove_from_cart(request, slug):
         ordered=False)
     if order_qs.exists():
         order = order_qs[0]
+        order.touch()
         # check if the order item is in the order
         if order.items.filter(item__slug=item.slug).exists():
             order_item = OrderItem.objects.filter(
@@ -289,6 +379,7 @@ def remove_from_cart(request, slug):
     return redirect("core:product", slug=slug)
 
 
+@ratelimit('cart')
 @login_required
 def remove_single_item_from_cart(request, slug):
     item = get_object_or_404(Item, slug=slug)
@@ -297,6 +388,7 @@ def remove_single_item_from_cart(request, slug):
         ordered=False)
     if order_qs.exists():
         order = order_qs[0]
+        order.touch()
         # check if the order item is in the order
         if order.items.filter(item__slug=item.slug).exists():
             order_item = OrderItem.objects.filter(
@@ -322,13 +414,12 @@ def remove_single_item_from_cart(request, slug):
     return redirect("core:product", slug=slug)
 
 
-def get_coupon(request, code):
-    try:
-        coupon = Coupon.objects.get(code=code)
-        return coupon
-    except ObjectDoesNotExist:
-        messages.info(request, "This coupon does not exist")
-        return redirect("core:checkout")
+def get_coupon(request, code, order):
+    # checked against the cached rules; nothing is written until payment
+    coupon, error = coupons.find(code, order.get_subtotal())
+    if coupon is None:
+        messages.info(request, error)
+    return coupon
 
 
 # class AddCouponView(View):
@@ -349,6 +440,7 @@ def get_coupon(request, code):
 #                 return redirect("core:checkout")
 
 
+@method_decorator(ratelimit('coupon'), name='post')
 class AddCouponView(View):
     def post(self, *args, **kwargs):
         form = CouponForm(self.request.POST or None)
@@ -362,12 +454,14 @@ class AddCouponView(View):
                     return redirect("core:checkout")
 
                 code = form.cleaned_data.get('code')
-                coupon = get_coupon(self.request, code)
+                coupon = get_coupon(self.request, code, order)
 
                 if coupon is None:  
                     messages.info(self.request, "Invalid coupon code")
                     return redirect("core:checkout")
 
+                # a use counted by an earlier payment attempt goes back first
+                coupons.release(order)
                 order.coupon = coupon
                 order.save()
                 messages.success(self.request, "Successfully added coupon")
@@ -382,6 +476,7 @@ class AddCouponView(View):
 
 
 
+@method_decorator(ratelimit('refund'), name='post')
 class RequestRefundView(View):
     def get(self, *args, **kwargs):
         form = RefundForm()
@@ -393,7 +488,7 @@ class RequestRefundView(View):
     def post(self, *args, **kwargs):
         form = RefundForm(self.request.POST)
         if form.is_valid():
-            ref_code = form.cleaned_data.get('ref_code')
+            ref_code = form.cleaned_data.get('ref_code').strip().lower()
             message = form.cleaned_data.get('message')
             email = form.cleaned_data.get('email')
             # edit the order
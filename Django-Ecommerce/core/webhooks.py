@@ -0,0 +1,101 @@
+"""
+Stripe webhook handling.
+
+The endpoint only verifies the signature and appends the event to
+``StripeEvent``; everything else happens in ``apply_pending`` so the
+acknowledgement stays fast however many events Stripe sends at once.
+"""
+import json
+
+import stripe
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Order, Payment, Refund, StripeEvent
+from .reports import record_refund
+
+
+def ingest(payload, signature):
+    """
+    Stores a verified event. Returns False if it had been seen before.
+    Raises stripe.error.SignatureVerificationError or ValueError, and
+    ImproperlyConfigured while STRIPE_WEBHOOK_SECRET is unset.
+    """
+    if not settings.STRIPE_WEBHOOK_SECRET:
+        raise ImproperlyConfigured('STRIPE_WEBHOOK_SECRET is not set')
+    payload = payload.decode('utf-8')
+    stripe.WebhookSignature.verify_header(
+        payload, signature, settings.STRIPE_WEBHOOK_SECRET,
+        stripe.Webhook.DEFAULT_TOLERANCE)
+    event = json.loads(payload)
+    try:
+        with transaction.atomic():
+            StripeEvent.objects.create(
+                event_id=event['id'], type=event.get('type', ''), payload=payload)
+    except IntegrityError:
+        return False
+    return True
+
+
+def charge_id(event):
+    obj = event['data']['object']
+    # dispute events carry the charge id, charge events are the charge
+    return obj.get('charge') or obj.get('id')
+
+
+def apply_pending(batch_size=500):
+    """
+    Applies one batch of unprocessed events with a handful of bulk
+    UPDATEs. Returns the number of events handled.
+    """
+    with transaction.atomic():
+        events = list(StripeEvent.objects.select_for_update().filter(
+            processed__isnull=True).order_by('received')[:batch_size])
+        if not events:
+            return 0
+
+        # charge id -> dollars refunded, for charges refunded in full
+        refunded_amounts = {}
+        disputed, dispute_lost, dispute_won = set(), set(), set()
+        for row in events:
+            event = json.loads(row.payload)
+            if row.type == 'charge.refunded':
+                charge = event['data']['object']
+                # also sent for partial refunds, which leave the order as it is
+                if charge.get('refunded'):
+                    refunded_amounts[charge_id(event)] = charge.get('amount_refunded', 0) / 100
+            elif row.type == 'charge.dispute.created':
+                disputed.add(charge_id(event))
+            elif row.type == 'charge.dispute.closed':
+                if event['data']['object'].get('status') == 'lost':
+                    dispute_lost.add(charge_id(event))
+                else:
+                    dispute_won.add(charge_id(event))
+
+        Payment.objects.filter(stripe_charge_id__in=disputed).update(disputed=True)
+        Payment.objects.filter(stripe_charge_id__in=dispute_won).update(disputed=False)
+
+        # a lost dispute takes the whole charge back just like a refund
+        refunded = set(refunded_amounts) | dispute_lost
+        newly_refunded = list(Order.objects.filter(
+            payment__stripe_charge_id__in=refunded, payment__refunded=False
+        ).select_related('payment'))
+        for order in newly_refunded:
+            payment = order.payment
+            amount = refunded_amounts.get(payment.stripe_charge_id) or payment.amount
+            # stored on the payment too, so a rebuild counts the same amount
+            Payment.objects.filter(pk=payment.pk).update(refunded=True, amount_refunded=amount)
+            record_refund(order, amount)
+        Payment.objects.filter(stripe_charge_id__in=refunded, refunded=False).update(
+            refunded=True, amount_refunded=F('amount'))
+        Order.objects.filter(payment__stripe_charge_id__in=refunded).update(
+            refund_requested=False, refund_granted=True)
+        Refund.objects.filter(order__payment__stripe_charge_id__in=refunded).update(
+            accepted=True)
+
+        StripeEvent.objects.filter(
+            pk__in=[row.pk for row in events]).update(processed=timezone.now())
+    return len(events)
@@ -77,6 +77,8 @@ STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static_in_env')]
 STATIC_ROOT = os.path.join(BASE_DIR, 'static_root')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media_root')
+# uploads are named by content hash: stored once, cacheable forever
+DEFAULT_FILE_STORAGE = 'core.storage.ContentAddressedStorage'
 
 DATABASES = {
     "default": {
@@ -126,3 +128,65 @@ CRISPY_TEMPLATE_PACK = 'bootstrap4'
 
 STRIPE_PUBLIC_KEY = 'pk_test_lX3r6OMjOU2yzFsNSHq6belT00EY82kZmH'
 STRIPE_SECRET_KEY = 'sk_test_tn0CTDaIJHUJyAqhsf39cfsC00LNjsqDnb'
+# point at `manage.py fake_stripe` to exercise payments offline
+STRIPE_API_BASE = os.getenv('STRIPE_API_BASE', 'https://api.stripe.com')
+# no default: webhooks are refused until the endpoint's secret is set
+STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET')
+STRIPE_CONNECT_TIMEOUT = 3
+STRIPE_READ_TIMEOUT = 10
+STRIPE_MAX_RETRIES = 2
+# longest pause (seconds) between two of those retries
+STRIPE_BACKOFF_CAP = 2
+# consecutive failures before the gateway stops calling Stripe, and for how long
+STRIPE_BREAKER_THRESHOLD = 5
+STRIPE_BREAKER_RESET_TIMEOUT = 30
+# seconds after which an in-flight payment attempt may be replayed: only
+# once every try the gateway can make for it has timed out, plus a margin
+PAYMENT_ATTEMPT_TIMEOUT = (
+    (STRIPE_MAX_RETRIES + 1) * (STRIPE_CONNECT_TIMEOUT + STRIPE_READ_TIMEOUT) +
+    STRIPE_MAX_RETRIES * STRIPE_BACKOFF_CAP + 15)
+# hand charges to `manage.py process_payments` instead of charging in the request
+PAYMENT_ASYNC = os.getenv('PAYMENT_ASYNC') == '1'
+PAYMENT_MAX_TRIES = 5
+# seconds between replays of a charge whose outcome is still unknown after
+# PAYMENT_MAX_TRIES
+PAYMENT_RECONCILE_INTERVAL = 300
+# leave refunds granted in the admin to `manage.py process_refunds` instead
+# of issuing them while the admin request waits
+REFUND_ASYNC = os.getenv('REFUND_ASYNC') == '1'
+REFUND_WORKERS = 8
+REFUND_MAX_ATTEMPTS = 5
+# seconds between passes over refunds that hit a transient error
+REFUND_RETRY_DELAY = 1
+# admin changelists show the planner's row estimate above this many rows
+ADMIN_ESTIMATED_COUNT_ABOVE = 100000
+# (burst, period in seconds) per client for the endpoints that write on every hit
+RATELIMIT_ENABLE = True
+RATELIMIT_POLICIES = {
+    'cart': (30, 60),
+    'coupon': (10, 60),
+    'refund': (5, 3600),
+}
+# 'local' keeps buckets per process; 'cache' shares them through RATELIMIT_CACHE
+RATELIMIT_BACKEND = 'local'
+RATELIMIT_CACHE = 'default'
+# only behind a proxy that sets X-Forwarded-For itself
+RATELIMIT_TRUST_FORWARDED = False
+# seconds a process keeps its snapshot of the active coupons
+COUPON_CACHE_TTL = 60
+# Bloom filter of the campaign codes, rebuilt by `manage.py generate_coupons`
+COUPON_FILTER_PATH = os.path.join(BASE_DIR, 'coupon_codes.bloom')
+# uploads larger than this are refused before their pixels are decoded
+IMAGE_UPLOAD_MAX_BYTES = 5 * 1024 * 1024
+IMAGE_UPLOAD_FORMATS = ['JPEG', 'PNG', 'WEBP']
+# uploads above this spool to a temporary file instead of memory
+FILE_UPLOAD_MAX_MEMORY_SIZE = 512 * 1024
+# widths (px) of the resized copies written for each uploaded image
+RENDITION_WIDTHS = [160, 320, 640, 1024, 1600]
+RENDITION_QUALITY = 80
+# write renditions while saving an upload; turn off to leave it to a batch job
+RENDITIONS_ON_UPLOAD = True
+# revenue and cohort columns saved by `manage.py export_analytics`
+ANALYTICS_PATH = os.path.join(BASE_DIR, 'analytics.npz')
+# seconds a checkout holds its items before release_reservations hands them back
+STOCK_RESERVATION_TTL = 15 * 60
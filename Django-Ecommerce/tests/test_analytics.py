@@ -0,0 +1,90 @@
+import pytest
+from datetime import datetime
+from io import StringIO
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.utils import timezone
+from core.analytics import build, load
+from core.models import Category, Coupon, Item, Order, OrderItem, Payment
+
+
+@pytest.fixture
+def items(db):
+    category = Category.objects.create(title="Shoes", slug="shoes")
+    return [
+        Item.objects.create(
+            title=title, price=price, discount_price=discount, category=category,
+            label="S", slug=title.lower(), stock_no="1", description_short="Test",
+            description_long="Test", image="test.jpg")
+        for title, price, discount in [("Boot", 100.0, 80.0), ("Sock", 5.0, None)]
+    ]
+
+
+def paid(user, when, lines, coupon=None, refunded=False, frozen=True):
+    order = Order.objects.create(
+        user=user, ordered=True, coupon=coupon,
+        ordered_date=timezone.make_aware(datetime(*when)))
+    for item, quantity in lines:
+        line = OrderItem.objects.create(item=item, user=user, quantity=quantity, ordered=True)
+        if frozen:
+            line.unit_price, line.unit_discount_price = item.price, item.discount_price
+            line.save()
+        order.items.add(line)
+    order.payment = Payment.objects.create(
+        stripe_charge_id="ch_{}".format(order.pk), user=user,
+        amount=order.get_total(), refunded=refunded,
+        amount_refunded=order.get_total() if refunded else 0)
+    order.save()
+    return order
+
+
+@pytest.mark.django_db
+def test_metrics_match_orm(items, tmp_path):
+    """Chỉ số theo khách hàng và theo cohort khớp với get_total() của ORM"""
+    boot, sock = items
+    ann, bob, cid = [User.objects.create_user(username=name) for name in ("ann", "bob", "cid")]
+    coupon = Coupon.objects.create(code="HALF", percent_off=50)
+    orders = [
+        paid(ann, (2024, 1, 5), [(boot, 1), (sock, 2)]),
+        paid(ann, (2024, 3, 1), [(sock, 1)], coupon=coupon, frozen=False),
+        paid(bob, (2024, 1, 20), [(boot, 2)], refunded=True),
+        paid(cid, (2024, 2, 2), [(sock, 4)]),
+    ]
+    # carts are not counted
+    Order.objects.create(user=cid, ordered=False, ordered_date=timezone.now())
+
+    tables = build(str(tmp_path / "analytics.npz"))
+
+    revenue = dict(zip(tables['orders']['order_id'].tolist(), tables['orders']['revenue']))
+    assert revenue == pytest.approx({order.pk: order.get_total() for order in orders})
+
+    users = {user_id: i for i, user_id in enumerate(tables['users']['user_id'].tolist())}
+    assert tables['users']['orders'][users[ann.pk]] == 2
+    assert tables['users']['ltv'][users[ann.pk]] == pytest.approx(90 + 2.5)
+    assert tables['users']['ltv'][users[bob.pk]] == 0
+
+    cohorts = tables['cohorts']
+    assert cohorts['users'].tolist() == [2, 1]
+    assert cohorts['repeat_rate'].tolist() == [0.5, 0]
+    assert cohorts['aov'][0] == pytest.approx((90 + 2.5 + 160) / 3)
+
+    saved = load(str(tmp_path / "analytics.npz"))
+    assert saved['cohorts']['revenue'].tolist() == cohorts['revenue'].tolist()
+
+
+@pytest.mark.django_db
+def test_export_analytics_command(items, tmp_path):
+    """Lệnh export_analytics ghi CSV và đọc lại file cột đã lưu"""
+    ann = User.objects.create_user(username="ann")
+    paid(ann, (2024, 1, 5), [(items[1], 2)])
+    path = str(tmp_path / "analytics.npz")
+
+    out = StringIO()
+    call_command("export_analytics", path=path, stdout=out, stderr=StringIO())
+    assert out.getvalue().splitlines()[1].startswith("2024-01,1,0,0.0,1,10.0")
+
+    Order.objects.all().delete()
+    out = StringIO()
+    call_command("export_analytics", path=path, cached=True, table="users",
+                 stdout=out, stderr=StringIO())
+    assert out.getvalue().splitlines()[1] == "{},2024-01,1,10.0,0.0,10.0,10.0".format(ann.pk)
@@ -0,0 +1,171 @@
+import json
+import pytest
+from io import StringIO
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import Client
+from django.urls import reverse
+from core.catalog import clone_items, export_rows
+from core.inventory import reshard
+from core.models import Category, Item
+
+
+@pytest.fixture
+def items(db):
+    category = Category.objects.create(title="Test Category", slug="test-category")
+    return [
+        Item.objects.create(
+            title="Item {}".format(i),
+            price=10.0 + i,
+            category=category,
+            label="S",
+            slug="item-{}".format(i),
+            stock_no="12345",
+            stock=5,
+            description_short="Test",
+            description_long="Test Item Description",
+            image="test.jpg"
+        )
+        for i in range(3)
+    ]
+
+
+@pytest.mark.django_db
+def test_clone_items_unique_slugs(items, django_assert_num_queries):
+    """Nhân bản sản phẩm với slug không trùng và số truy vấn cố định"""
+    reshard(items[0], 4)
+
+    # selection, slot totals, slugs, INSERT and its savepoint pair
+    with django_assert_num_queries(6):
+        assert clone_items(Item.objects.all()) == 3
+    clone_items(Item.objects.filter(slug="item-1"))
+
+    slugs = list(Item.objects.order_by('pk').values_list('slug', flat=True))
+    assert len(slugs) == len(set(slugs)) == 7
+    assert slugs[3:] == ["item-0-copy", "item-1-copy", "item-2-copy", "item-1-copy-2"]
+    copy = Item.objects.get(slug="item-0-copy")
+    assert copy.stock == 5 and not copy.is_sharded
+
+
+@pytest.mark.django_db
+def test_copy_items_admin_action(items):
+    """Action Copy Items trong admin báo số sản phẩm đã nhân bản"""
+    User.objects.create_superuser("admin", "admin@example.com", "password")
+    client = Client()
+    client.login(username="admin", password="password")
+
+    response = client.post(reverse('admin:core_item_changelist'), {
+        'action': 'copy_items',
+        '_selected_action': [item.pk for item in items],
+    }, follow=True)
+
+    assert "Copied 3 items" in response.content.decode()
+    assert Item.objects.count() == 6
+
+
+@pytest.mark.django_db
+def test_item_changelist_sums_slots_in_one_query(items, django_assert_max_num_queries):
+    """Danh sách sản phẩm trong admin cộng tồn kho các slot ngay trong truy vấn"""
+    reshard(items[0], 4)
+    reshard(items[1], 2, 7)
+    User.objects.create_superuser("admin", "admin@example.com", "password")
+    client = Client()
+    client.login(username="admin", password="password")
+
+    with django_assert_max_num_queries(7):
+        response = client.get(reverse('admin:core_item_changelist'))
+    content = response.content.decode()
+    assert '<td class="field-available_stock">5</td>' in content
+    assert '<td class="field-available_stock">7</td>' in content
+
+
+@pytest.mark.django_db
+def test_export_sums_slots_per_chunk(items, django_assert_num_queries):
+    """Tồn kho chia slot được cộng theo item, mỗi chunk một truy vấn"""
+    reshard(items[0], 4)
+    reshard(items[1], 2)
+    Item.objects.filter(pk=items[1].pk).update(slug="item-0")
+
+    # the item rows, then one slot total for the only chunk with sharded items
+    with django_assert_num_queries(2):
+        rows = list(export_rows(Item.objects.all(), chunk_size=2))
+    assert [(row['slug'], row['stock']) for row in rows] == [
+        ("item-0", 5), ("item-0", 5), ("item-2", 5)]
+
+
+@pytest.mark.django_db
+def test_export_then_import_roundtrip(items, tmp_path):
+    """Xuất CSV rồi nhập lại: cập nhật, thêm mới và báo dòng lỗi"""
+    path = tmp_path / "items.csv"
+    call_command("export_catalog", output=str(path))
+    lines = path.read_text().splitlines()
+    assert lines[0].startswith("slug,stock_no,title,category")
+    assert len(lines) == 4
+
+    lines[1] = lines[1].replace("10.0", "9.5")
+    lines.append("new-item,N1,New Item,new-category,New Category,5,,N,3,,,,True")
+    lines.append("broken,,Broken,test-category,,,,S,,,,,True")
+    path.write_text("\n".join(lines) + "\n")
+
+    out = StringIO()
+    call_command("import_catalog", str(path), batch_size=2, stdout=out, stderr=StringIO())
+    assert "1 created, 1 updated, 2 unchanged, 1 rejected" in out.getvalue()
+
+    assert Item.objects.get(slug="item-0").price == 9.5
+    new = Item.objects.get(slug="new-item")
+    assert new.category.title == "New Category"
+    assert new.stock == 3 and new.discount_price is None
+
+
+@pytest.mark.django_db
+def test_import_matches_sku_and_dry_run(items, tmp_path):
+    """Khớp theo SKU khi slug đổi, chế độ chạy thử không ghi gì"""
+    Item.objects.filter(slug="item-1").update(stock_no="SKU-1")
+    path = tmp_path / "feed.ndjson"
+    path.write_text(json.dumps({
+        "slug": "renamed", "stock_no": "SKU-1", "title": "Renamed", "category": "test-category",
+        "price": 11.0, "label": "P", "stock": 7, "is_active": True,
+    }) + "\n")
+
+    out = StringIO()
+    call_command("import_catalog", str(path), dry_run=True, stdout=out)
+    assert "(dry run) 0 created, 1 updated" in out.getvalue()
+    assert not Item.objects.filter(slug="renamed").exists()
+
+    call_command("import_catalog", str(path), stdout=StringIO())
+    item = Item.objects.get(stock_no="SKU-1")
+    assert (item.slug, item.label, item.stock) == ("renamed", "P", 7)
+    assert Item.objects.count() == 3
+
+
+@pytest.mark.django_db
+def test_import_rejects_malformed_ndjson_lines(items, tmp_path):
+    """Dòng NDJSON hỏng bị bỏ qua và báo theo số dòng"""
+    row = {"slug": "new-item", "title": "New", "category": "test-category",
+           "price": 5.0, "label": "S", "stock": 3, "is_active": True}
+    path = tmp_path / "feed.ndjson"
+    path.write_text('{"slug": "broken"\n\n[1, 2]\n' + json.dumps(row) + "\n")
+
+    out, err = StringIO(), StringIO()
+    call_command("import_catalog", str(path), stdout=out, stderr=err)
+    assert "1 created, 0 updated, 0 unchanged, 2 rejected" in out.getvalue()
+    assert "Row 1: invalid JSON" in err.getvalue()
+    assert "Row 3: expected a JSON object" in err.getvalue()
+    assert Item.objects.filter(slug="new-item").exists()
+
+
+@pytest.mark.django_db
+def test_export_items_admin_action_streams(items):
+    """Action xuất NDJSON trong admin trả về response dạng stream"""
+    User.objects.create_superuser("admin", "admin@example.com", "password")
+    client = Client()
+    client.login(username="admin", password="password")
+
+    response = client.post(reverse('admin:core_item_changelist'), {
+        'action': 'export_items_ndjson',
+        '_selected_action': [item.pk for item in items[:2]],
+    })
+
+    assert response.streaming
+    rows = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+    assert [row["slug"] for row in rows] == ["item-0", "item-1"]
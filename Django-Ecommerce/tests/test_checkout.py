@@ -0,0 +1,89 @@
+import pytest
+from django.contrib.auth.models import User
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+from django_countries.fields import CountryField
+from django_countries.widgets import CountrySelectWidget
+from core.forms import CachedCountrySelectWidget, CachedSelect
+from core.models import BillingAddress, Order
+
+
+@pytest.fixture
+def user(db):
+    return User.objects.create_user(username="buyer", password="password")
+
+
+@pytest.fixture
+def client(user):
+    client = Client()
+    client.login(username="buyer", password="password")
+    Order.objects.create(user=user, ordered=False, ordered_date=timezone.now())
+    return client
+
+
+def checkout(client, **data):
+    payload = {
+        'street_address': '1234 Main St',
+        'apartment_address': 'Apt 5',
+        'country': 'US',
+        'zip': '10001',
+        'payment_option': 'S',
+    }
+    payload.update(data)
+    return client.post(reverse('core:checkout'), payload)
+
+
+@pytest.mark.django_db
+def test_checkout_reuses_identical_address(client, user):
+    """Gửi lại cùng địa chỉ không tạo thêm BillingAddress"""
+    checkout(client)
+    checkout(client, street_address='  1234   MAIN st ')
+
+    assert BillingAddress.objects.filter(user=user).count() == 1
+    order = Order.objects.get(user=user)
+    assert order.billing_address.street_address == '1234 Main St'
+
+
+@pytest.mark.django_db
+def test_checkout_new_address_creates_row(client, user):
+    """Địa chỉ khác thì tạo bản ghi mới"""
+    checkout(client)
+    checkout(client, zip='10002')
+
+    assert BillingAddress.objects.filter(user=user).count() == 2
+
+
+@pytest.mark.django_db
+def test_checkout_prefills_default_address(client, user):
+    """Form checkout điền sẵn địa chỉ mặc định của người dùng"""
+    checkout(client, save_info='on')
+    Order.objects.filter(user=user).update(billing_address=None)
+
+    assert BillingAddress.objects.get(user=user).default
+    response = client.get(reverse('core:checkout'))
+    assert response.context['form'].initial['street_address'] == '1234 Main St'
+
+
+@pytest.mark.parametrize('value', [None, '', 'US', 'VN'])
+def test_cached_country_select_matches_stock_widget(value):
+    """Select quốc gia được cache cho kết quả giống widget gốc"""
+    stock = CountryField(blank_label='(select country)').formfield(
+        widget=CountrySelectWidget(attrs={'class': 'custom-select'}))
+    cached = CountryField(blank_label='(select country)').formfield(
+        widget=CachedCountrySelectWidget(attrs={'class': 'custom-select'}))
+
+    for _ in range(2):
+        assert cached.widget.render('country', value, {'id': 'id_country'}) == \
+            stock.widget.render('country', value, {'id': 'id_country'})
+
+
+def test_cached_select_keyed_on_choices():
+    """Hai select cùng tên và attrs nhưng khác lựa chọn không dùng chung cache"""
+    sizes = CachedSelect(choices=[('s', 'Small'), ('m', 'Medium')])
+    colors = CachedSelect(choices=[('r', 'Red'), ('b', 'Blue')])
+
+    assert 'Small' in sizes.render('option', 's')
+    html = colors.render('option', 'b')
+    assert 'Red' in html and 'Small' not in html
+    assert '<option value="b" selected>' in html
@@ -0,0 +1,195 @@
+import pytest
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from django.contrib.auth.models import User
+from django.contrib.messages import get_messages
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+from core import coupons
+from core.models import Category, Coupon, Item, Order, OrderItem
+
+
+@pytest.fixture(autouse=True)
+def fresh_rules():
+    """Bộ nhớ đệm coupon không mang dữ liệu từ test khác"""
+    coupons.invalidate()
+    yield
+    coupons.invalidate()
+
+
+@pytest.fixture
+def user(db):
+    return User.objects.create_user(username="buyer", password="password")
+
+
+@pytest.fixture
+def order(user):
+    category = Category.objects.create(title="Test Category", slug="test-category")
+    item = Item.objects.create(
+        title="Test Item",
+        price=100.0,
+        category=category,
+        label="S",
+        slug="test-item",
+        stock_no="12345",
+        description_short="Test",
+        description_long="Test Item Description",
+        image="test.jpg"
+    )
+    order = Order.objects.create(user=user, ordered=False, ordered_date=timezone.now())
+    order.items.add(OrderItem.objects.create(item=item, user=user, quantity=2))
+    return order
+
+
+@pytest.mark.django_db
+def test_find_uses_cached_rules(django_assert_num_queries):
+    """Kiểm tra coupon không truy vấn CSDL khi đã có trong bộ nhớ đệm"""
+    Coupon.objects.create(code="SAVE10", percent_off=10)
+    assert coupons.find("save10 ", 200)[0].code == "SAVE10"
+
+    with django_assert_num_queries(0):
+        coupon, error = coupons.find("SAVE10", 200)
+    assert coupon.get_discount(200) == 20
+
+    # saving a coupon drops the snapshot
+    coupon.active = False
+    coupon.save()
+    assert coupons.find("SAVE10", 200) == (None, "This coupon does not exist")
+
+
+@pytest.mark.django_db
+def test_coupon_rules():
+    """Hết hạn, chưa đủ giá trị tối thiểu và giảm không quá tổng tiền"""
+    now = timezone.now()
+    Coupon.objects.create(code="OLD", amount=5, valid_until=now - timedelta(days=1))
+    Coupon.objects.create(code="BIG", amount=50, min_spend=100)
+
+    assert coupons.find("OLD", 200) == (None, "This coupon has expired")
+    assert coupons.find("BIG", 99) == (None, "This coupon needs a minimum spend of $100.00")
+    coupon, _ = coupons.find("BIG", 100)
+    assert coupon.get_discount(40) == 40
+
+
+@pytest.mark.django_db
+def test_codes_are_stored_upper_case():
+    """Mã coupon được lưu chữ hoa nên 'abc' và 'ABC' không thể cùng tồn tại"""
+    Coupon.objects.create(code=" save5 ", amount=5)
+
+    assert Coupon.objects.get().code == "SAVE5"
+    assert coupons.find("Save5", 200)[0] is not None
+    with pytest.raises(IntegrityError), transaction.atomic():
+        Coupon.objects.create(code="SAVE5", amount=10)
+
+
+@pytest.mark.django_db
+def test_add_coupon_applies_discount(user, order):
+    """Thêm coupon vào giỏ hàng và tổng tiền được giảm"""
+    Coupon.objects.create(code="HALF", percent_off=50, amount=10)
+    client = Client()
+    client.login(username="buyer", password="password")
+
+    response = client.post(reverse('core:add-coupon'), {'code': 'HALF'})
+
+    assert str(list(get_messages(response.wsgi_request))[0]) == "Successfully added coupon"
+    order.refresh_from_db()
+    assert order.get_total() == 200 - 110
+
+
+@pytest.mark.django_db
+def test_redeem_is_counted_once_and_released(user, order):
+    """Mỗi đơn hàng chỉ tính một lượt dùng và trả lại khi thanh toán thất bại"""
+    coupon = Coupon.objects.create(code="ONCE", amount=10, max_uses=1)
+    order.coupon = coupon
+    order.save()
+
+    assert coupons.redeem(order)
+    assert coupons.redeem(order)
+    coupon.refresh_from_db()
+    assert coupon.uses == 1
+
+    other = Order.objects.create(
+        user=user, ordered=False, ordered_date=timezone.now(), coupon=coupon)
+    assert not coupons.redeem(other)
+
+    coupons.release(order)
+    coupon.refresh_from_db()
+    assert coupon.uses == 0
+    assert coupons.redeem(other)
+
+
+@pytest.mark.django_db
+def test_redeem_rechecks_expiry_and_min_spend(order):
+    """Coupon hết hạn hoặc chưa đủ chi tiêu tối thiểu không được tính khi thanh toán"""
+    coupon = Coupon.objects.create(code="LATE", amount=500)
+    order.coupon = coupon
+    order.save()
+
+    Coupon.objects.filter(pk=coupon.pk).update(valid_until=timezone.now() - timedelta(days=1))
+    order.refresh_from_db()
+    assert not coupons.redeem(order)
+
+    Coupon.objects.filter(pk=coupon.pk).update(valid_until=None, min_spend=500)
+    order.refresh_from_db()
+    assert not coupons.redeem(order)
+
+    # moved out of its window after the order loaded it: the UPDATE refuses
+    Coupon.objects.filter(pk=coupon.pk).update(min_spend=0)
+    order.refresh_from_db()
+    assert order.coupon.valid_from is None
+    Coupon.objects.filter(pk=coupon.pk).update(valid_from=timezone.now() + timedelta(days=1))
+    assert not coupons.redeem(order)
+
+    coupon.refresh_from_db()
+    order.refresh_from_db()
+    assert coupon.uses == 0 and not order.coupon_redeemed
+
+
+@pytest.mark.django_db(transaction=True)
+def test_parallel_redemptions_respect_max_uses(user):
+    """Nhiều đơn hàng dùng coupon cùng lúc không vượt quá giới hạn"""
+    coupon = Coupon.objects.create(code="FIRST5", amount=10, max_uses=5)
+    orders = [
+        Order.objects.create(
+            user=user, ordered=False, ordered_date=timezone.now(), coupon=coupon)
+        for _ in range(30)
+    ]
+
+    def redeem(order):
+        try:
+            return coupons.redeem(order)
+        finally:
+            connection.close()
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        results = list(pool.map(redeem, orders))
+
+    coupon.refresh_from_db()
+    assert results.count(True) == 5
+    assert coupon.uses == 5
+    assert Order.objects.filter(coupon_redeemed=True).count() == 5
+
+
+@pytest.mark.django_db
+def test_generate_coupons_and_filter(settings, tmp_path, django_assert_num_queries,
+                                     django_assert_max_num_queries):
+    """Sinh hàng loạt mã coupon và loại mã đoán bừa mà không cần truy vấn"""
+    settings.COUPON_FILTER_PATH = str(tmp_path / "codes.bloom")
+    output = tmp_path / "codes.csv"
+    call_command("generate_coupons", "spring", count=2500, batch_size=1000,
+                 prefix="SP", amount=5, output=str(output))
+
+    codes = output.read_text().split()
+    assert len(set(codes)) == 2500
+    assert Coupon.objects.filter(campaign="spring", max_uses=1).count() == 2500
+
+    coupons.find("SPNOTACODE", 100)
+    # the filter's false positive rate is 0.1%
+    with django_assert_max_num_queries(3):
+        for i in range(200):
+            assert coupons.find("SPGUESS{}".format(i), 100)[0] is None
+    with django_assert_num_queries(1):
+        coupon, error = coupons.find(codes[0].lower(), 100)
+    assert coupon.code == codes[0]
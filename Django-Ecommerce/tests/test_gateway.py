@@ -0,0 +1,100 @@
+import pytest
+import stripe
+import time
+from concurrent.futures import ThreadPoolExecutor
+from core.fake_stripe import FakeStripeServer
+from core.gateway import RETRYABLE_ERRORS, CircuitBreaker, GatewayUnavailable, RequestInProgress, StripeGateway
+
+
+@pytest.fixture
+def fake_stripe():
+    """Chạy Stripe giả lập cục bộ"""
+    server = FakeStripeServer().start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_gateway(server, **kwargs):
+    return StripeGateway(api_key='sk_test', api_base=server.url, backoff=0, **kwargs)
+
+
+def test_gateway_retries_transient_errors(fake_stripe):
+    """Lỗi tạm thời được thử lại với cùng idempotency key"""
+    fake_stripe.fail_next = 2
+    gateway = make_gateway(fake_stripe, max_retries=2)
+
+    charge = gateway.create_charge(1000, 'usd', 'tok_visa', 'order-1-1000-0')
+
+    assert charge.amount == 1000
+    assert fake_stripe.charge_count == 1
+    metrics = gateway.metrics.snapshot()
+    assert metrics['requests']['charge'] == 3
+    assert metrics['errors']['charge.APIError'] == 2
+
+
+def test_gateway_replays_idempotent_request(fake_stripe):
+    """Cùng idempotency key trả về cùng một charge"""
+    gateway = make_gateway(fake_stripe)
+
+    first = gateway.create_charge(1000, 'usd', 'tok_visa', 'order-1-1000-0')
+    second = gateway.create_charge(1000, 'usd', 'tok_visa', 'order-1-1000-0')
+
+    assert first.id == second.id
+    assert fake_stripe.charge_count == 1
+
+
+def test_gateway_key_in_progress_is_retryable(fake_stripe):
+    """Stripe trả 409 khi khóa đang được xử lý: coi là chưa rõ kết quả, không phải thất bại"""
+    fake_stripe.latency = 0.5
+    gateway = make_gateway(fake_stripe, max_retries=0)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        first = pool.submit(gateway.create_charge, 1000, 'usd', 'tok_visa', 'order-1-1000-0')
+        time.sleep(0.2)
+        with pytest.raises(RequestInProgress) as excinfo:
+            gateway.create_charge(1000, 'usd', 'tok_visa', 'order-1-1000-0')
+        assert isinstance(excinfo.value, RETRYABLE_ERRORS)
+        assert first.result().amount == 1000
+
+    assert gateway.create_charge(1000, 'usd', 'tok_visa', 'order-1-1000-0').id == first.result().id
+    assert fake_stripe.charge_count == 1
+    assert gateway.breaker.failures == 0
+
+
+def test_gateway_breaker_fails_fast(fake_stripe):
+    """Cầu dao mở thì không gọi tới Stripe nữa"""
+    fake_stripe.fail_next = 100
+    breaker = CircuitBreaker(threshold=2, reset_timeout=60)
+    gateway = make_gateway(fake_stripe, max_retries=5, breaker=breaker)
+
+    with pytest.raises(GatewayUnavailable):
+        gateway.create_charge(1000, 'usd', 'tok_visa', 'order-1-1000-0')
+
+    assert breaker.state == CircuitBreaker.OPEN
+    assert gateway.metrics.snapshot()['requests']['charge'] == 3
+    assert fake_stripe.fail_next == 98
+
+
+def test_breaker_half_open_after_timeout():
+    """Sau thời gian chờ, cầu dao cho một yêu cầu thử đi qua"""
+    now = [0]
+    breaker = CircuitBreaker(threshold=1, reset_timeout=30, clock=lambda: now[0])
+    breaker.record_failure()
+    assert not breaker.allow()
+
+    now[0] = 31
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_gateway_card_error_does_not_trip_breaker(fake_stripe):
+    """Thẻ bị từ chối không làm mở cầu dao"""
+    breaker = CircuitBreaker(threshold=1)
+    gateway = make_gateway(fake_stripe, breaker=breaker)
+
+    with pytest.raises(stripe.error.CardError):
+        gateway.create_charge(1000, 'usd', 'tok_chargeDeclined', 'order-1-1000-0')
+
+    assert breaker.state == CircuitBreaker.CLOSED
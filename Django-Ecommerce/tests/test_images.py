@@ -0,0 +1,161 @@
+import re
+import pytest
+from io import BytesIO, StringIO
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.template import Context, Template
+from PIL import Image
+from core import images
+from core.models import Category, ImageRendition, Item, Slide
+
+
+@pytest.fixture
+def media(settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path)
+    settings.RENDITION_WIDTHS = [160, 640, 1600]
+    return tmp_path
+
+
+def upload(name, size=(2000, 1000), mode='RGB', color='red'):
+    buffer = BytesIO()
+    Image.new(mode, size, color).save(buffer, 'PNG' if mode == 'RGBA' else 'JPEG')
+    return SimpleUploadedFile(name, buffer.getvalue())
+
+
+def make_item(category, image):
+    return Item.objects.create(
+        title="Boot", price=10.0, category=category, label="S", slug="boot",
+        stock_no="1", description_short="Test", description_long="Test", image=image)
+
+
+@pytest.mark.django_db
+def test_upload_writes_renditions(media):
+    """Ảnh tải lên được thu nhỏ thành nhiều độ rộng, định dạng WebP và JPEG"""
+    category = Category.objects.create(
+        title="Shoes", slug="shoes", image=upload("banner.png", (120, 80), 'RGBA'))
+    item = make_item(category, upload("boot.jpg"))
+
+    rows = ImageRendition.objects.filter(source=item.image.name).order_by('width', 'format')
+    assert [(r.width, r.height, r.format) for r in rows] == [
+        (160, 80, 'jpeg'), (160, 80, 'webp'), (640, 320, 'jpeg'), (640, 320, 'webp'),
+        (1600, 800, 'jpeg'), (1600, 800, 'webp')]
+    for row in rows:
+        with Image.open(str(media / row.name)) as image:
+            assert image.width == row.width
+    # smaller than every width: one copy at its own size
+    assert list(ImageRendition.objects.filter(source=category.image.name).values_list(
+        'width', flat=True)) == [120, 120]
+
+    # saving without a new upload leaves the renditions alone
+    ImageRendition.objects.all().delete()
+    item.title = "Boots"
+    item.save()
+    assert not ImageRendition.objects.exists()
+
+
+@pytest.mark.django_db
+def test_responsive_image_tag(media):
+    """Template tag sinh <picture> với srcset/sizes, ảnh cũ giữ nguyên <img>"""
+    category = Category.objects.create(title="Shoes", slug="shoes", image="shoes.jpg")
+    item = make_item(category, upload("boot.jpg"))
+    template = Template(
+        '{% load image_template_tags %}{% responsive_image image sizes="130px" alt="Boot" %}')
+
+    html = template.render(Context({'image': item.image}))
+    assert re.match(r'<picture><source type="image/webp" srcset="/media/renditions/\w{32}\.webp 160w,', html)
+    assert 'sizes="130px"' in html and 'src="/media/{}"'.format(item.image.name) in html
+
+    html = template.render(Context({'image': category.image}))
+    assert html == '<img src="/media/shoes.jpg" alt="Boot" style="">'
+
+
+@pytest.mark.django_db
+def test_renditions_read_once_per_page(media, django_assert_num_queries):
+    """Cả trang sản phẩm và slide chỉ đọc rendition bằng một truy vấn"""
+    category = Category.objects.create(title="Shoes", slug="shoes", image="shoes.jpg")
+    items = [make_item(category, upload("boot.jpg", color=color)) for color in ['red', 'blue', 'green']]
+    Slide.objects.create(caption1="Sale", caption2="Boots", link="/shop/",
+                         image=items[0].image.name, is_active=True)
+    Slide.objects.create(caption1="New", caption2="Hats", link="/shop/",
+                         image="hats.jpg", is_active=True)
+    template = Template(
+        '{% load image_template_tags %}{% for item in object_list %}'
+        '{% responsive_image item.image %}{% endfor %}')
+
+    with django_assert_num_queries(1):
+        html = template.render(Context({'object_list': items}))
+    assert html.count('<picture>') == 3
+
+    # the slides themselves, then their renditions
+    with django_assert_num_queries(2):
+        html = Template('{% load slide_template_tags %}{% slides %}').render(Context())
+    assert html.count('renditions/') == 1 and 'url(/media/hats.jpg)' in html
+
+
+@pytest.mark.django_db
+def test_regenerate_renditions_command(media, settings):
+    """Lệnh tạo lại rendition bỏ qua ảnh không đổi và dọn kích thước cũ"""
+    category = Category.objects.create(title="Shoes", slug="shoes", image=upload("shoes.jpg", color='blue'))
+    make_item(category, upload("boot.jpg"))
+    make_item(category, "gone.jpg")
+    ImageRendition.objects.filter(source=category.image.name).delete()
+
+    out = StringIO()
+    call_command("regenerate_renditions", workers=2, stdout=out, stderr=StringIO())
+    assert "3 images" in out.getvalue()
+    assert "1 rendered, 1 unchanged, 1 missing, 0 failed" in out.getvalue()
+    assert ImageRendition.objects.filter(source=category.image.name).count() == 6
+
+    settings.RENDITION_WIDTHS = [320]
+    out = StringIO()
+    call_command("regenerate_renditions", workers=2, stdout=out, stderr=StringIO())
+    assert "2 rendered, 0 unchanged" in out.getvalue()
+    assert set(ImageRendition.objects.values_list('width', flat=True)) == {320}
+    assert len(list((media / "renditions").iterdir())) == 4
+
+
+@pytest.mark.django_db
+def test_placeholder_and_lazy_loading(media, settings):
+    """Ảnh xem trước nhỏ được lưu khi tải lên và ảnh dưới màn hình tải lười"""
+    settings.RENDITIONS_ON_UPLOAD = False
+    category = Category.objects.create(title="Shoes", slug="shoes", image="shoes.jpg")
+    item = make_item(category, upload("boot.jpg"))
+    item.refresh_from_db()
+    assert item.image_placeholder.startswith("data:image/jpeg;base64,")
+    assert len(item.image_placeholder) < 1000
+    assert not ImageRendition.objects.exists()
+
+    template = Template(
+        '{% load image_template_tags %}{% for item in items %}'
+        '{% responsive_image item.image placeholder=item.image_placeholder '
+        'lazy=forloop.counter|below_fold %}{% endfor %}')
+    images = template.render(Context({'items': [item] * 5})).split('<img')[1:]
+    assert all("background: url(data:image/jpeg;base64," in html for html in images)
+    assert ['loading="lazy"' in html for html in images] == [False] * 4 + [True]
+
+    # regenerate fills in placeholders missing from older uploads
+    Item.objects.update(image_placeholder="")
+    call_command("regenerate_renditions", workers=1, stdout=StringIO(), stderr=StringIO())
+    item.refresh_from_db()
+    assert item.image_placeholder.startswith("data:image/jpeg;base64,")
+
+
+@pytest.mark.django_db
+def test_unchanged_image_skips_placeholder(media, monkeypatch):
+    """Ảnh không đổi được bỏ qua trước khi giải mã, trừ khi còn thiếu ảnh xem trước"""
+    category = Category.objects.create(title="Shoes", slug="shoes")
+    item = make_item(category, upload("boot.jpg"))
+    known = images.current_hashes()[item.image.name]
+
+    def fail(data):
+        raise AssertionError("placeholder built for an unchanged image")
+
+    monkeypatch.setattr(images, 'placeholder', fail)
+    assert images.regenerate(item.image.name, known, False) == (
+        'skipped', item.image.size, [], '')
+
+    monkeypatch.undo()
+    Item.objects.update(image_placeholder="")
+    assert images.unplaced_images() == {item.image.name}
+    status, _, _, preview = images.regenerate(item.image.name, known, True)
+    assert status == 'skipped' and preview.startswith("data:image/jpeg;base64,")
@@ -0,0 +1,140 @@
+import pytest
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from django.contrib.auth.models import User
+from django.db import connection
+from django.utils import timezone
+from core.inventory import OutOfStock, commit_order, release_expired, release_order, reserve_order, reshard, take
+from core.models import Item, Order, OrderItem, Category, StockReservation, StockSlot
+
+
+@pytest.fixture
+def item(db):
+    category = Category.objects.create(title="Test Category", slug="test-category")
+    return Item.objects.create(
+        title="Hot Item",
+        price=100.0,
+        category=category,
+        label="S",
+        slug="hot-item",
+        stock_no="12345",
+        stock=10,
+        description_short="Test",
+        description_long="Test Item Description",
+        image="test.jpg"
+    )
+
+
+def make_order(username, item, quantity):
+    user = User.objects.create_user(username=username, password="password")
+    order = Order.objects.create(user=user, ordered=False, ordered_date=timezone.now())
+    order.items.add(OrderItem.objects.create(item=item, user=user, quantity=quantity))
+    return order
+
+
+@pytest.mark.django_db
+def test_reserve_and_commit(item):
+    """Giữ hàng khi checkout và xác nhận khi thanh toán"""
+    order = make_order("buyer", item, 3)
+
+    reserve_order(order)
+    item.refresh_from_db()
+    assert item.stock == 7
+
+    # checkout lại không giữ thêm hàng
+    reserve_order(order)
+    item.refresh_from_db()
+    assert item.stock == 7
+
+    commit_order(order)
+    item.refresh_from_db()
+    assert item.stock == 7
+    assert StockReservation.objects.get(order=order).committed
+
+
+@pytest.mark.django_db
+def test_reserve_out_of_stock(item):
+    """Không đủ hàng thì không giữ gì cả"""
+    order = make_order("buyer", item, 11)
+
+    with pytest.raises(OutOfStock):
+        reserve_order(order)
+
+    item.refresh_from_db()
+    assert item.stock == 10
+    assert not StockReservation.objects.exists()
+
+
+@pytest.mark.django_db
+def test_release_expired_reservations(item):
+    """Hết hạn giữ hàng thì trả lại kho"""
+    order = make_order("buyer", item, 4)
+    reserve_order(order)
+    StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+    assert release_expired() == 1
+    item.refresh_from_db()
+    assert item.stock == 10
+
+
+@pytest.mark.django_db
+def test_reshard_skips_untracked_item(item):
+    """Sản phẩm không theo dõi tồn kho không bị chia slot"""
+    Item.objects.filter(pk=item.pk).update(stock=None, stock_shards=4)
+    item = reshard(item, 4)
+    assert item.stock is None and not item.is_sharded
+    assert not StockSlot.objects.filter(item=item).exists()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_parallel_buyers_never_oversell(item):
+    """Nhiều người mua song song một sản phẩm không bị bán quá số lượng"""
+    def buy(_):
+        try:
+            return take(item, 1)
+        finally:
+            connection.close()
+
+    with ThreadPoolExecutor(max_workers=24) as pool:
+        results = list(pool.map(buy, range(60)))
+
+    item.refresh_from_db()
+    assert results.count(True) == 10
+    assert item.stock == 0
+
+
+@pytest.mark.django_db
+def test_sharded_stock_reserve_and_total(item):
+    """Chế độ chia nhỏ kho: tổng được cộng từ các slot"""
+    item = reshard(item, 4)
+    assert StockSlot.objects.filter(item=item).count() == 4
+    assert item.get_stock() == 10
+
+    order = make_order("buyer", item, 4)
+    reserve_order(order)
+    assert item.get_stock() == 6
+
+    release_order(order)
+    assert item.get_stock() == 10
+
+    item = reshard(item, 0)
+    assert item.stock == 10
+    assert not StockSlot.objects.filter(item=item).exists()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_parallel_buyers_sharded(item):
+    """Nhiều người mua song song trên kho chia nhỏ vẫn đúng số lượng"""
+    sharded = reshard(item, 4)
+
+    def buy(_):
+        try:
+            return take(sharded, 1)
+        finally:
+            connection.close()
+
+    with ThreadPoolExecutor(max_workers=24) as pool:
+        results = list(pool.map(buy, range(60)))
+
+    assert results.count(True) == 10
+    assert sharded.get_stock() == 0
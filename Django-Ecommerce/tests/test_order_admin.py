@@ -0,0 +1,79 @@
+import pytest
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from core.models import BillingAddress, Order, Payment, create_ref_code
+from core.pagination import estimate_rows
+
+
+@pytest.fixture
+def client(db):
+    User.objects.create_superuser("admin", "admin@example.com", "password")
+    client = Client()
+    client.login(username="admin", password="password")
+    return client
+
+
+def make_orders(count):
+    for i in range(count):
+        user = User.objects.create_user(username="buyer{}".format(Order.objects.count()))
+        address = BillingAddress.objects.create(
+            user=user, street_address="1 Main St", apartment_address="",
+            country="US", zip="10001", address_type="B")
+        payment = Payment.objects.create(stripe_charge_id="ch_{}".format(i), user=user, amount=10)
+        Order.objects.create(
+            user=user, ordered=True, ordered_date=timezone.now(), ref_code=create_ref_code(),
+            billing_address=address, shipping_address=address, payment=payment)
+
+
+def changelist_queries(client, **params):
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(reverse('admin:core_order_changelist'), params)
+    assert response.status_code == 200
+    return response, len(queries)
+
+
+@pytest.mark.django_db
+def test_changelist_query_count_is_flat(client):
+    """Số truy vấn của danh sách đơn hàng không tăng theo số dòng"""
+    make_orders(3)
+    _, few = changelist_queries(client)
+    make_orders(20)
+    response, many = changelist_queries(client)
+
+    assert few == many
+    # the user filter is a text box, not one link per user
+    assert 'name="username"' in response.content.decode()
+    assert '?username=buyer1' not in response.content.decode()
+
+
+@pytest.mark.django_db
+def test_changelist_filter_and_search(client):
+    """Lọc theo username và tìm theo mã đơn hàng"""
+    make_orders(3)
+    order = Order.objects.get(user__username="buyer1")
+
+    response, _ = changelist_queries(client, username="buyer1")
+    assert response.context['cl'].result_count == 1
+
+    response, _ = changelist_queries(client, q=order.ref_code.upper())
+    assert list(response.context['cl'].result_list) == [order]
+
+
+@pytest.mark.django_db
+def test_changelist_uses_estimated_count(client, settings):
+    """Bảng lớn dùng số dòng ước lượng thay cho COUNT(*)"""
+    settings.ADMIN_ESTIMATED_COUNT_ABOVE = 2
+    make_orders(5)
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE")
+    assert estimate_rows(Order) == 5
+
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(reverse('admin:core_order_changelist'))
+    assert response.context['cl'].result_count == 5
+    assert not any('COUNT(*)' in q['sql'] and 'core_order' in q['sql']
+                   for q in queries.captured_queries)
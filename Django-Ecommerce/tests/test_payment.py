@@ -0,0 +1,255 @@
+import pytest
+import stripe
+from django.contrib.auth.models import User
+from django.contrib.messages import get_messages
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+from core import gateway
+from core.fake_stripe import FakeStripeServer, DECLINED_TOKEN
+from core.gateway import StripeGateway
+from core.payments import finalize_order, perform_charge, process_queued
+from core.models import Item, Order, OrderItem, Category, Payment, PaymentAttempt, StockReservation, create_ref_code
+
+
+@pytest.fixture
+def fake_stripe(monkeypatch):
+    """Chạy Stripe giả lập cục bộ"""
+    server = FakeStripeServer().start()
+    monkeypatch.setattr(gateway, '_gateway', StripeGateway(
+        api_key='sk_test', api_base=server.url, backoff=0))
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def user(db):
+    return User.objects.create_user(username="buyer", password="password")
+
+
+@pytest.fixture
+def order(user):
+    category = Category.objects.create(title="Test Category", slug="test-category")
+    item = Item.objects.create(
+        title="Test Item",
+        price=100.0,
+        category=category,
+        label="S",
+        slug="test-item",
+        stock_no="12345",
+        description_short="Test",
+        description_long="Test Item Description",
+        image="test.jpg"
+    )
+    order = Order.objects.create(user=user, ordered=False, ordered_date=timezone.now())
+    order.items.add(OrderItem.objects.create(item=item, user=user, quantity=2))
+    return order
+
+
+def pay(user, token='tok_visa'):
+    client = Client()
+    client.login(username=user.username, password="password")
+    url = reverse('core:payment', kwargs={'payment_option': 'stripe'})
+    response = client.post(url, {'stripeToken': token})
+    return response, [str(m) for m in get_messages(response.wsgi_request)]
+
+
+@pytest.mark.django_db
+def test_payment_success(fake_stripe, user, order):
+    """Thanh toán thành công tạo đúng một Payment"""
+    response, messages = pay(user)
+
+    assert response.status_code == 302
+    assert messages == ["Order was successful"]
+    order.refresh_from_db()
+    assert order.ordered
+    assert order.payment.amount == 200.0
+    assert fake_stripe.charge_count == 1
+
+
+@pytest.mark.django_db
+def test_payment_retry_reuses_stored_attempt(fake_stripe, user, order):
+    """Gửi lại cùng một đơn hàng không bị trừ tiền hai lần"""
+    attempt = PaymentAttempt.objects.create(
+        order=order, user=user, idempotency_key='order-{}-20000-0'.format(order.pk),
+        amount=20000, status='E', token='tok_visa')
+
+    pay(user)
+    pay(user)
+
+    attempt.refresh_from_db()
+    assert attempt.status == 'S'
+    assert Payment.objects.count() == 1
+    assert fake_stripe.charge_count == 1
+
+
+@pytest.mark.django_db
+def test_payment_retry_while_in_flight(fake_stripe, user, order):
+    """Yêu cầu trùng lặp khi đang xử lý chỉ nhận trạng thái chờ"""
+    PaymentAttempt.objects.create(
+        order=order, user=user, idempotency_key='order-{}-20000-0'.format(order.pk),
+        amount=20000, status='P')
+
+    response, messages = pay(user)
+
+    assert messages == ["Your payment is being processed"]
+    assert fake_stripe.charge_count == 0
+
+
+@pytest.mark.django_db
+def test_payment_declined_then_new_key(fake_stripe, user, order):
+    """Thẻ bị từ chối thì lần thử tiếp theo dùng khóa mới"""
+    response, messages = pay(user, token=DECLINED_TOKEN)
+    assert messages == ["Your card was declined."]
+
+    response, messages = pay(user)
+    assert messages == ["Order was successful"]
+    keys = set(PaymentAttempt.objects.values_list('idempotency_key', flat=True))
+    assert keys == {'order-{}-20000-0'.format(order.pk), 'order-{}-20000-1'.format(order.pk)}
+
+
+@pytest.mark.django_db
+def test_cart_edited_while_attempt_open(fake_stripe, settings, user, order):
+    """Sửa giỏ khi còn lần thanh toán đang mở không tạo lần thanh toán thứ hai"""
+    settings.PAYMENT_ASYNC = True
+    pay(user)
+    attempt = PaymentAttempt.objects.get()
+    OrderItem.objects.update(quantity=3)
+
+    response, _ = pay(user)
+    assert response.url == reverse('core:payment-status', kwargs={'key': attempt.idempotency_key})
+    assert PaymentAttempt.objects.count() == 1
+
+    assert process_queued() == 1
+    order.refresh_from_db()
+    assert order.payment.amount == 200.0
+    assert fake_stripe.charge_count == 1
+
+
+@pytest.mark.django_db
+def test_paid_order_is_not_charged_again(fake_stripe, user, order):
+    """Đơn đã thanh toán thì lần thanh toán còn lại không trừ tiền nữa"""
+    attempt = PaymentAttempt.objects.create(
+        order=order, user=user, idempotency_key='order-{}-20000-0'.format(order.pk),
+        amount=20000, status='P', token='tok_visa')
+    payment = Payment.objects.create(stripe_charge_id='ch_other', user=user, amount=200)
+    assert finalize_order(order, payment)
+    assert not finalize_order(order, Payment.objects.create(
+        stripe_charge_id='ch_late', user=user, amount=200))
+
+    attempt = perform_charge(attempt)
+    assert (attempt.status, attempt.error) == ('F', 'This order has already been paid')
+    order.refresh_from_db()
+    assert order.payment == payment
+    assert fake_stripe.charge_count == 0
+
+
+@pytest.mark.django_db
+def test_async_payment_is_queued_then_processed(fake_stripe, settings, user, order):
+    """Chế độ bất đồng bộ: yêu cầu chỉ xếp hàng, worker thực hiện thanh toán"""
+    settings.PAYMENT_ASYNC = True
+    response, messages = pay(user)
+
+    attempt = PaymentAttempt.objects.get(order=order)
+    assert response.url == reverse('core:payment-status', kwargs={'key': attempt.idempotency_key})
+    assert attempt.status == 'Q'
+    assert fake_stripe.charge_count == 0
+
+    assert process_queued() == 1
+
+    attempt.refresh_from_db()
+    order.refresh_from_db()
+    assert attempt.status == 'S'
+    assert attempt.token == ''
+    assert order.ordered
+    assert fake_stripe.charge_count == 1
+
+    client = Client()
+    client.login(username=user.username, password="password")
+    response = client.get(response.url, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+    assert response.json() == {'status': 'succeeded', 'message': ''}
+
+
+@pytest.mark.django_db
+def test_async_payment_unconfirmed_after_max_tries(fake_stripe, settings, monkeypatch, user, order):
+    """Hết số lần thử mà chưa rõ kết quả thì giữ khóa và hàng, gửi lại sau với cùng khóa"""
+    settings.PAYMENT_ASYNC = True
+    settings.PAYMENT_MAX_TRIES = 2
+    Item.objects.update(stock=5)
+    pay(user)
+    attempt = PaymentAttempt.objects.get(order=order)
+    assert StockReservation.objects.filter(order=order).exists()
+
+    def unreachable(**kwargs):
+        raise stripe.error.APIConnectionError("Stripe is unreachable")
+    with monkeypatch.context() as m:
+        m.setattr(gateway.get_gateway(), 'create_charge', unreachable)
+        assert process_queued() == 1
+        attempt.refresh_from_db()
+        assert attempt.status == 'Q'
+
+        assert process_queued() == 1
+        attempt.refresh_from_db()
+        assert attempt.status == 'U' and attempt.token == 'tok_visa'
+        assert StockReservation.objects.filter(order=order).exists()
+        assert process_queued() == 0
+
+    # a resubmit gets the same attempt back instead of a new key
+    response, _ = pay(user)
+    assert response.url == reverse('core:payment-status', kwargs={'key': attempt.idempotency_key})
+    client = Client()
+    client.login(username=user.username, password="password")
+    response = client.get(response.url, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+    assert response.json()['status'] == 'pending'
+
+    settings.PAYMENT_RECONCILE_INTERVAL = 0
+    assert process_queued() == 1
+    attempt.refresh_from_db()
+    order.refresh_from_db()
+    assert attempt.status == 'S' and order.ordered
+    assert PaymentAttempt.objects.count() == 1
+    assert fake_stripe.charge_count == 1
+
+
+@pytest.mark.django_db
+def test_payment_finalizes_order_lines(fake_stripe, user, order):
+    """Sau khi thanh toán, dòng đơn hàng được đóng và giữ nguyên giá"""
+    pay(user)
+
+    line = order.items.get()
+    assert line.ordered
+    assert line.unit_price == 100.0
+    assert line.unit_discount_price is None
+
+    Item.objects.update(price=150.0, discount_price=120.0)
+    order.refresh_from_db()
+    assert order.get_total() == 200.0
+    assert not OrderItem.objects.filter(user=user, ordered=False).exists()
+
+
+def test_ref_codes_are_unique_and_time_sortable():
+    """Mã tham chiếu không trùng và sắp xếp được theo thời gian"""
+    codes = [create_ref_code(now=1700000000 + i) for i in range(100)]
+
+    assert codes == sorted(codes)
+    assert len(set(create_ref_code() for _ in range(10000))) == 10000
+    assert all(len(code) == 20 for code in codes)
+
+
+@pytest.mark.django_db
+def test_refund_request_finds_order_by_code(fake_stripe, user, order):
+    """Yêu cầu hoàn tiền tìm đơn hàng theo mã tham chiếu"""
+    pay(user)
+    order.refresh_from_db()
+
+    client = Client()
+    response = client.post(reverse('core:request-refund'), {
+        'ref_code': ' {} '.format(order.ref_code.upper()),
+        'message': 'broken',
+        'email': 'buyer@example.com',
+    })
+
+    assert response.status_code == 302
+    order.refresh_from_db()
+    assert order.refund_requested
@@ -0,0 +1,78 @@
+import pytest
+from django.contrib.auth.models import User
+from django.test import Client
+from django.urls import reverse
+from core import ratelimit
+from core.ratelimit import CacheBackend, LocalBackend
+
+
+@pytest.fixture
+def backend(monkeypatch, settings):
+    """Giới hạn 3 lần mỗi phút, bộ đếm mới cho mỗi test"""
+    settings.RATELIMIT_POLICIES = {'cart': (3, 60), 'coupon': (3, 60), 'refund': (3, 60)}
+    backend = LocalBackend()
+    monkeypatch.setattr(ratelimit, '_backend', backend)
+    return backend
+
+
+@pytest.fixture
+def client(db):
+    User.objects.create_user(username="buyer", password="password")
+    client = Client()
+    client.login(username="buyer", password="password")
+    return client
+
+
+def test_token_bucket_refills():
+    """Hết token thì bị chặn, chờ đủ thời gian thì được tiếp"""
+    now = [0]
+    backend = LocalBackend(clock=lambda: now[0])
+
+    assert [backend.hit('k', 2, 10) for _ in range(3)] == [0, 0, 5]
+    now[0] = 5
+    assert backend.hit('k', 2, 10) == 0
+    assert backend.hit('other', 2, 10) == 0
+
+
+def test_cache_backend_shares_window(settings):
+    """Backend dùng cache chung đếm theo cửa sổ thời gian"""
+    settings.CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+    first, second = CacheBackend('default'), CacheBackend('default')
+    first.reset()
+
+    assert first.hit('k', 2, 60) == 0
+    assert second.hit('k', 2, 60) == 0
+    assert first.hit('k', 2, 60) > 0
+
+
+@pytest.mark.django_db
+def test_coupon_guessing_gets_429(backend, client, django_assert_num_queries):
+    """Đoán mã coupon liên tục bị trả về 429 mà không truy vấn đơn hàng"""
+    url = reverse('core:add-coupon')
+    for _ in range(3):
+        assert client.post(url, {'code': 'GUESS'}).status_code == 302
+
+    # keyed on the session cookie, without reading the session
+    with django_assert_num_queries(0):
+        response = client.post(url, {'code': 'GUESS'})
+    assert response.status_code == 429
+    assert int(response['Retry-After']) == 20
+
+    # other endpoints have their own bucket
+    assert client.get(reverse('core:request-refund')).status_code == 200
+
+
+def test_client_key_without_session(rf):
+    """Không có session thì phân biệt client theo địa chỉ IP"""
+    request = rf.get('/', REMOTE_ADDR='10.0.0.1')
+    assert ratelimit.client_key(request) == 'ip:10.0.0.1'
+    request.COOKIES['sessionid'] = 'abc'
+    assert ratelimit.client_key(request) == 'session:abc'
+
+
+@pytest.mark.django_db
+def test_ratelimit_can_be_disabled(backend, client, settings):
+    """Tắt giới hạn bằng RATELIMIT_ENABLE"""
+    settings.RATELIMIT_ENABLE = False
+    url = reverse('core:add-coupon')
+    assert all(client.post(url, {'code': 'GUESS'}).status_code == 302 for _ in range(5))
@@ -0,0 +1,81 @@
+import pytest
+from datetime import timedelta
+from io import StringIO
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.utils import timezone
+from core.inventory import reserve_order
+from core.models import Item, Order, OrderItem, Category, StockReservation
+
+
+@pytest.fixture
+def item(db):
+    category = Category.objects.create(title="Test Category", slug="test-category")
+    return Item.objects.create(
+        title="Test Item",
+        price=100.0,
+        category=category,
+        label="S",
+        slug="test-item",
+        stock_no="12345",
+        description_short="Test",
+        description_long="Test Item Description",
+        image="test.jpg"
+    )
+
+
+def make_cart(user, item, idle_days):
+    order = Order.objects.create(user=user, ordered=False, ordered_date=timezone.now())
+    order_item = OrderItem.objects.create(item=item, user=user, ordered=False)
+    order.items.add(order_item)
+    Order.objects.filter(pk=order.pk).update(
+        updated=timezone.now() - timedelta(days=idle_days))
+    return order
+
+
+@pytest.mark.django_db
+def test_reap_carts_removes_only_stale_carts(item):
+    """Chỉ xóa giỏ hàng chưa thanh toán và không hoạt động quá N ngày"""
+    stale_user = User.objects.create_user(username="stale", password="password")
+    fresh_user = User.objects.create_user(username="fresh", password="password")
+    stale = make_cart(stale_user, item, idle_days=45)
+    fresh = make_cart(fresh_user, item, idle_days=1)
+    paid = make_cart(stale_user, item, idle_days=90)
+    Order.objects.filter(pk=paid.pk).update(ordered=True)
+
+    out = StringIO()
+    call_command('reap_carts', days=30, batch_size=1, stdout=out)
+
+    assert not Order.objects.filter(pk=stale.pk).exists()
+    assert Order.objects.filter(pk=fresh.pk).exists()
+    assert Order.objects.filter(pk=paid.pk).exists()
+    assert OrderItem.objects.filter(user=fresh_user).count() == 1
+    assert "Batch 1: 1 carts, 1 cart lines removed" in out.getvalue()
+
+
+@pytest.mark.django_db
+def test_reap_carts_gives_back_reserved_stock(item):
+    """Xóa giỏ hàng trả lại số hàng đang giữ chỗ vào kho"""
+    Item.objects.filter(pk=item.pk).update(stock=5)
+    user = User.objects.create_user(username="stale", password="password")
+    stale = make_cart(user, item, idle_days=45)
+    reserve_order(stale)
+    assert Item.objects.get().stock == 4
+
+    call_command('reap_carts', days=30, stdout=StringIO())
+
+    assert not StockReservation.objects.exists()
+    assert Item.objects.get().stock == 5
+
+
+@pytest.mark.django_db
+def test_reap_carts_dry_run_keeps_rows(item):
+    """Chế độ dry-run chỉ đếm, không xóa"""
+    user = User.objects.create_user(username="stale", password="password")
+    stale = make_cart(user, item, idle_days=45)
+
+    out = StringIO()
+    call_command('reap_carts', days=30, dry_run=True, stdout=out)
+
+    assert Order.objects.filter(pk=stale.pk).exists()
+    assert "1 stale carts" in out.getvalue()
@@ -0,0 +1,143 @@
+import pytest
+from django.contrib.auth.models import User
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+from core import gateway
+from core.fake_stripe import FakeStripeServer
+from core.gateway import StripeGateway
+from core.models import Order, Payment, Refund
+from core.refunds import enqueue_refunds, execute_refunds, process_refund
+
+
+@pytest.fixture
+def fake_stripe(monkeypatch, settings):
+    """Chạy Stripe giả lập cục bộ, không tự thử lại trong gateway"""
+    settings.REFUND_RETRY_DELAY = 0
+    server = FakeStripeServer().start()
+    monkeypatch.setattr(gateway, '_gateway', StripeGateway(
+        api_key='sk_test', api_base=server.url, max_retries=0, backoff=0))
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def paid_orders(count):
+    user = User.objects.create_user(
+        username="buyer", email="buyer@example.com", password="password")
+    orders = []
+    for i in range(count):
+        charge = gateway.get_gateway().create_charge(
+            amount=1000, currency="usd", source="tok_visa",
+            idempotency_key="charge-{}".format(i))
+        payment = Payment.objects.create(
+            stripe_charge_id=charge['id'], user=user, amount=10)
+        orders.append(Order.objects.create(
+            user=user, ordered=True, ordered_date=timezone.now(), payment=payment))
+    return orders
+
+
+@pytest.mark.django_db(transaction=True)
+def test_admin_action_refunds_orders(fake_stripe):
+    """Action trong admin hoàn tiền song song cho tất cả đơn đã chọn"""
+    orders = paid_orders(20)
+    User.objects.create_superuser("admin", "admin@example.com", "password")
+    client = Client()
+    client.login(username="admin", password="password")
+
+    response = client.post(reverse('admin:core_order_changelist'), {
+        'action': 'make_refund_accepted',
+        '_selected_action': [order.pk for order in orders],
+    }, follow=True)
+
+    assert "20 refunds issued while this page waited, 8 at a time" in response.content.decode()
+    assert fake_stripe.refund_count == 20
+    assert Refund.objects.filter(status='S', accepted=True).count() == 20
+    assert Order.objects.filter(refund_granted=True, refund_requested=False).count() == 20
+    assert Payment.objects.filter(refunded=True).count() == 20
+
+
+@pytest.mark.django_db(transaction=True)
+def test_admin_action_leaves_rest_of_queue(fake_stripe):
+    """Action chỉ hoàn tiền các đơn đã chọn, lỗi tạm thời để lại cho process_refunds"""
+    orders = paid_orders(3)
+    enqueue_refunds(Order.objects.filter(pk=orders[0].pk))
+    User.objects.create_superuser("admin", "admin@example.com", "password")
+    client = Client()
+    client.login(username="admin", password="password")
+    fake_stripe.fail_next = 1
+
+    client.post(reverse('admin:core_order_changelist'), {
+        'action': 'make_refund_accepted',
+        '_selected_action': [order.pk for order in orders[1:]],
+    })
+
+    assert fake_stripe.refund_count == 1
+    assert Refund.objects.get(order=orders[0]).status == 'Q'
+    assert sorted(Refund.objects.filter(order__in=orders[1:]).values_list(
+        'status', flat=True)) == ['Q', 'S']
+
+
+@pytest.mark.django_db(transaction=True)
+def test_refund_retried_after_gateway_error(fake_stripe):
+    """Lỗi tạm thời của Stripe được thử lại"""
+    paid_orders(3)
+    enqueue_refunds(Order.objects.all())
+    fake_stripe.fail_next = 2
+
+    results = execute_refunds(max_workers=1)
+
+    assert results == {'Q': 2, 'S': 3}
+    assert fake_stripe.refund_count == 3
+    assert not Refund.objects.exclude(status='S').exists()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_failed_refund_requeued_under_new_key(fake_stripe):
+    """Hoàn tiền thất bại được xếp lại với khóa mới nên có thể thành công"""
+    order, = paid_orders(1)
+    charge = order.payment.stripe_charge_id
+    Payment.objects.update(stripe_charge_id="ch_missing")
+    enqueue_refunds(Order.objects.all())
+    assert execute_refunds() == {'F': 1}
+
+    Payment.objects.update(stripe_charge_id=charge)
+    assert enqueue_refunds(Order.objects.all()) == 1
+    assert execute_refunds() == {'S': 1}
+    refund = Refund.objects.get()
+    assert (refund.status, refund.generation) == ('S', 1)
+    assert fake_stripe.refund_count == 1
+
+
+@pytest.mark.django_db
+def test_refund_is_idempotent(fake_stripe):
+    """Gửi lại cùng một yêu cầu hoàn tiền không hoàn tiền hai lần"""
+    order, = paid_orders(1)
+    Refund.objects.create(order=order, reason="Broken", email="buyer@example.com")
+    enqueue_refunds(Order.objects.all())
+    refund = Refund.objects.select_related('order__payment').get()
+    assert refund.reason == "Broken"
+
+    assert process_refund(refund) == 'S'
+    # a worker that crashed before recording the result sends it again
+    Refund.objects.update(status='Q')
+    assert process_refund(refund) == 'S'
+    assert fake_stripe.refund_count == 1
+
+    # refunded orders are not queued again
+    assert enqueue_refunds(Order.objects.all()) == 0
+
+
+@pytest.mark.django_db(transaction=True)
+def test_refund_unknown_charge_fails(fake_stripe):
+    """Charge không tồn tại thì đánh dấu thất bại"""
+    order, = paid_orders(1)
+    Payment.objects.update(stripe_charge_id="ch_missing")
+    enqueue_refunds(Order.objects.all())
+
+    assert execute_refunds() == {'F': 1}
+    refund = Refund.objects.get()
+    assert refund.status == 'F'
+    assert "No such charge" in refund.error
+    order.refresh_from_db()
+    assert not order.refund_granted
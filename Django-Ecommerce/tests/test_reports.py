@@ -0,0 +1,102 @@
+import pytest
+from io import StringIO
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+from core.models import Category, Coupon, DailyCategorySales, DailySales, Item, Order, OrderItem, Payment
+from core.payments import finalize_order
+from core.reports import dashboard, record_refund
+
+
+@pytest.fixture
+def user(db):
+    return User.objects.create_user(username="buyer", password="password")
+
+
+@pytest.fixture
+def items(db):
+    shoes = Category.objects.create(title="Shoes", slug="shoes")
+    hats = Category.objects.create(title="Hats", slug="hats")
+    return [
+        Item.objects.create(
+            title=title, price=price, discount_price=discount, category=category,
+            label=label, slug=title.lower(), stock_no="1", description_short="Test",
+            description_long="Test", image="test.jpg")
+        for title, price, discount, category, label in [
+            ("Boot", 100.0, 80.0, shoes, "S"),
+            ("Cap", 20.0, None, hats, "N"),
+        ]
+    ]
+
+
+def pay(user, lines, coupon=None):
+    order = Order.objects.create(
+        user=user, ordered=False, ordered_date=timezone.now(), coupon=coupon)
+    for item, quantity in lines:
+        order.items.add(OrderItem.objects.create(item=item, user=user, quantity=quantity))
+    payment = Payment.objects.create(
+        stripe_charge_id="ch_{}".format(order.pk), user=user, amount=order.get_total())
+    finalize_order(order, payment)
+    return order
+
+
+def rollups():
+    return (
+        list(DailySales.objects.values('date', 'orders', 'units', 'revenue', 'discount',
+                                       'refunds', 'refunded')),
+        sorted(DailyCategorySales.objects.values_list(
+            'date', 'category__title', 'label', 'orders', 'units', 'revenue')),
+    )
+
+
+@pytest.mark.django_db(transaction=True)
+def test_paid_orders_update_rollups(user, items):
+    """Đơn hàng đã thanh toán được cộng vào bảng tổng hợp theo ngày"""
+    boot, cap = items
+    coupon = Coupon.objects.create(code="TEN", amount=10)
+    pay(user, [(boot, 2), (cap, 1)], coupon)
+    order = pay(user, [(cap, 3)])
+    record_refund(order, order.payment.amount)
+
+    today = timezone.localdate()
+    totals, by_category = rollups()
+    assert totals == [{'date': today, 'orders': 2, 'units': 6, 'revenue': 230.0,
+                       'discount': 10.0, 'refunds': 1, 'refunded': 60.0}]
+    assert by_category == [
+        (today, "Hats", "N", 2, 4, 80.0),
+        (today, "Shoes", "S", 1, 2, 160.0),
+    ]
+
+    # the backfill arrives at the same numbers
+    Payment.objects.filter(pk=order.payment_id).update(refunded=True, amount_refunded=60)
+    DailySales.objects.update(revenue=0)
+    call_command("rebuild_sales", workers=2, stdout=StringIO())
+    assert rollups() == (totals, by_category)
+
+
+@pytest.mark.django_db
+def test_sales_dashboard(user, items, django_assert_max_num_queries):
+    """Dashboard doanh thu trong admin chỉ đọc bảng tổng hợp"""
+    pay(user, [(items[0], 1)])
+    assert dashboard(timezone.localdate(), timezone.localdate())['totals']['revenue'] == 80.0
+
+    User.objects.create_superuser("admin", "admin@example.com", "password")
+    client = Client()
+    client.login(username="admin", password="password")
+    with django_assert_max_num_queries(8):
+        response = client.get(reverse('admin:core_dailysales_changelist'))
+    assert response.status_code == 200
+    content = response.content.decode()
+    assert "$80.00" in content and "sale" in content
+
+
+@pytest.mark.django_db
+def test_sales_dashboard_requires_view_permission(user):
+    """Nhân viên không có quyền xem doanh thu thì bị chặn"""
+    User.objects.create_user("clerk", password="password", is_staff=True)
+    client = Client()
+    client.login(username="clerk", password="password")
+    response = client.get(reverse('admin:core_dailysales_changelist'))
+    assert response.status_code == 403
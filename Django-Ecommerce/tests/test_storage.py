@@ -0,0 +1,57 @@
+import pytest
+from io import StringIO
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.test import RequestFactory
+from core.models import Category, Item
+from core.storage import is_hashed, serve_media
+
+
+@pytest.fixture
+def media(settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path)
+    settings.RENDITIONS_ON_UPLOAD = False
+    return tmp_path
+
+
+def test_identical_content_stored_once(media):
+    """Nội dung giống nhau chỉ lưu một lần, đặt tên theo hash"""
+    first = default_storage.save("photos/a.JPG", ContentFile(b"same bytes"))
+    second = default_storage.save("photos/b.jpg", ContentFile(b"same bytes"))
+    other = default_storage.save("photos/a.JPG", ContentFile(b"other bytes"))
+
+    assert first == second != other
+    assert first.startswith("photos/") and first.endswith(".jpg") and is_hashed(first)
+    assert len(list((media / "photos").iterdir())) == 2
+
+
+def test_hashed_media_is_immutable(media):
+    """URL của file theo hash được cache vĩnh viễn, file cũ thì không"""
+    name = default_storage.save("a.jpg", ContentFile(b"bytes"))
+    (media / "legacy.jpg").write_bytes(b"bytes")
+    request = RequestFactory().get("/")
+
+    response = serve_media(request, name, document_root=str(media))
+    assert response["Cache-Control"] == "public, max-age=31536000, immutable"
+    assert "Cache-Control" not in serve_media(request, "legacy.jpg", document_root=str(media))
+
+
+@pytest.mark.django_db
+def test_dedupe_media_command(media):
+    """Lệnh dedupe_media chuyển ảnh cũ sang tên theo hash và xoá bản trùng"""
+    (media / "boot.jpg").write_bytes(b"boot")
+    (media / "boot_07d6IFV.jpg").write_bytes(b"boot")
+    category = Category.objects.create(title="Shoes", slug="shoes", image="boot_07d6IFV.jpg")
+    Item.objects.create(
+        title="Boot", price=10.0, category=category, label="S", slug="boot",
+        stock_no="1", description_short="Test", description_long="Test", image="boot.jpg")
+
+    out = StringIO()
+    call_command("dedupe_media", delete=True, stdout=out)
+    assert "2 files moved into 1 content-addressed files, 0 missing, 2 old files deleted" in out.getvalue()
+
+    category.refresh_from_db()
+    assert is_hashed(category.image.name)
+    assert Item.objects.get().image.name == category.image.name
+    assert [p.name for p in media.iterdir()] == [category.image.name]
@@ -0,0 +1,77 @@
+import pytest
+from io import BytesIO
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import Client
+from django.urls import reverse
+from PIL import Image
+from core.models import Category, Slide
+
+
+@pytest.fixture
+def media(settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path)
+    settings.RENDITIONS_ON_UPLOAD = False
+    return tmp_path
+
+
+def image_bytes(size, fmt='JPEG'):
+    buffer = BytesIO()
+    Image.new('RGB', size, 'red').save(buffer, fmt)
+    return buffer.getvalue()
+
+
+def slide(image):
+    return Slide(caption1="New", caption2="Collection", link="/shop/", image=image)
+
+
+def test_slide_size_is_enforced():
+    """Slide phải đủ kích thước 1920x570 ghi trong help_text"""
+    with pytest.raises(ValidationError) as excinfo:
+        slide(SimpleUploadedFile("small.jpg", image_bytes((800, 600)))).full_clean()
+    assert excinfo.value.messages == ["The image is 800x600; it must be at least 1920x570."]
+
+    # only the header is read: a truncated file of the right size passes
+    header = image_bytes((1920, 570))[:2048]
+    slide(SimpleUploadedFile("slide.jpg", header)).full_clean()
+    # files already in storage are not re-read
+    slide("missing.jpg").full_clean()
+
+
+@pytest.mark.django_db
+def test_upload_bytes_and_format(settings):
+    """Giới hạn dung lượng và định dạng ảnh tải lên"""
+    category = Category(title="Shoes", slug="shoes", description="Test")
+
+    category.image = SimpleUploadedFile("shoes.gif", image_bytes((100, 100), 'GIF'))
+    with pytest.raises(ValidationError) as excinfo:
+        category.full_clean()
+    assert "GIF images are not accepted; use JPEG, PNG, WEBP." in excinfo.value.messages
+
+    settings.IMAGE_UPLOAD_MAX_BYTES = 100
+    category.image = SimpleUploadedFile("shoes.jpg", image_bytes((100, 100)))
+    with pytest.raises(ValidationError) as excinfo:
+        category.full_clean()
+    assert "the limit is 0.0 MB" in excinfo.value.messages[0]
+
+
+@pytest.mark.django_db
+def test_admin_slide_upload(media):
+    """Trang admin nhận slide đúng kích thước và báo lỗi slide quá nhỏ"""
+    User.objects.create_superuser("admin", "admin@example.com", "password")
+    client = Client()
+    client.login(username="admin", password="password")
+    data = {'caption1': "New", 'caption2': "Collection", 'link': "/shop/", 'is_active': "on"}
+
+    response = client.post(reverse('admin:core_slide_add'), dict(
+        data, image=SimpleUploadedFile("small.jpg", image_bytes((800, 600)))))
+    assert "it must be at least 1920x570" in response.content.decode()
+    assert not Slide.objects.exists()
+
+    response = client.post(reverse('admin:core_slide_add'), dict(
+        data, image=SimpleUploadedFile("slide.jpg", image_bytes((1920, 570)))))
+    assert response.status_code == 302
+    saved = Slide.objects.get()
+    assert (media / saved.image.name).exists()
+    assert saved.image_placeholder.startswith("data:image/jpeg")
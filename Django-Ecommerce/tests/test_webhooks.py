@@ -0,0 +1,122 @@
+import json
+import time
+import pytest
+import stripe
+from django.contrib.auth.models import User
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from core.models import DailySales, Order, Payment, Refund, StripeEvent
+from core.reports import rebuild
+from core.webhooks import apply_pending
+
+
+@pytest.fixture(autouse=True)
+def webhook_secret():
+    with override_settings(STRIPE_WEBHOOK_SECRET='whsec_test'):
+        yield
+
+
+def post_event(event, secret='whsec_test'):
+    payload = json.dumps(event)
+    timestamp = int(time.time())
+    signature = stripe.WebhookSignature._compute_signature(
+        '%d.%s' % (timestamp, payload), secret)
+    return Client().post(
+        reverse('core:stripe-webhook'), payload, content_type='application/json',
+        HTTP_STRIPE_SIGNATURE='t=%d,v1=%s' % (timestamp, signature))
+
+
+def refund_event(event_id='evt_1', charge='ch_1', amount_refunded=1000, refunded=True):
+    return {'id': event_id, 'type': 'charge.refunded', 'data': {'object': {
+        'id': charge, 'amount': 1000, 'amount_refunded': amount_refunded, 'refunded': refunded}}}
+
+
+@pytest.fixture
+def paid_order(db):
+    user = User.objects.create_user(username="buyer", password="password")
+    payment = Payment.objects.create(stripe_charge_id='ch_1', user=user, amount=10)
+    order = Order.objects.create(
+        user=user, ordered=True, ordered_date=timezone.now(), payment=payment,
+        refund_requested=True)
+    Refund.objects.create(order=order, reason="broken", email="buyer@example.com")
+    return order
+
+
+@pytest.mark.django_db
+def test_webhook_rejects_bad_signature():
+    """Chữ ký sai thì trả về 400 và không lưu sự kiện"""
+    response = post_event(refund_event(), secret='whsec_wrong')
+
+    assert response.status_code == 400
+    assert not StripeEvent.objects.exists()
+
+
+@pytest.mark.django_db
+def test_webhook_refused_without_secret():
+    """Chưa cấu hình secret thì từ chối mọi sự kiện"""
+    with override_settings(STRIPE_WEBHOOK_SECRET=None):
+        response = post_event(refund_event(), secret='whsec_test')
+
+    assert response.status_code == 503
+    assert not StripeEvent.objects.exists()
+
+
+@pytest.mark.django_db
+def test_webhook_deduplicates_events():
+    """Stripe gửi lại cùng sự kiện thì chỉ lưu một lần"""
+    assert post_event(refund_event()).status_code == 200
+    assert post_event(refund_event()).status_code == 200
+
+    assert StripeEvent.objects.count() == 1
+
+
+@pytest.mark.django_db
+def test_refund_event_applied_in_batch(paid_order):
+    """Sự kiện hoàn tiền cập nhật Order, Payment và Refund"""
+    post_event(refund_event())
+    post_event({'id': 'evt_2', 'type': 'charge.dispute.created',
+                'data': {'object': {'id': 'dp_1', 'charge': 'ch_1'}}})
+
+    assert apply_pending() == 2
+    assert apply_pending() == 0
+
+    paid_order.refresh_from_db()
+    assert paid_order.refund_granted
+    assert not paid_order.refund_requested
+    assert paid_order.payment.refunded
+    assert paid_order.payment.disputed
+    assert Refund.objects.get(order=paid_order).accepted
+
+
+@pytest.mark.django_db
+def test_partial_refund_leaves_order_paid(paid_order):
+    """Hoàn tiền một phần không đánh dấu cả đơn hàng là đã hoàn tiền"""
+    post_event(refund_event('evt_1', amount_refunded=500, refunded=False))
+    apply_pending()
+
+    paid_order.refresh_from_db()
+    assert not paid_order.refund_granted
+    assert not paid_order.payment.refunded
+    assert not Refund.objects.get(order=paid_order).accepted
+
+    # the rest refunded later: the order is refunded for the full charge
+    post_event(refund_event('evt_2', amount_refunded=1000))
+    apply_pending()
+    paid_order.refresh_from_db()
+    assert paid_order.refund_granted and paid_order.payment.refunded
+    assert DailySales.objects.get().refunded == 10
+
+
+@pytest.mark.django_db
+def test_rebuild_counts_refund_like_webhook(paid_order):
+    """Tính lại bảng tổng hợp dùng cùng số tiền hoàn như webhook"""
+    post_event(refund_event(amount_refunded=950))
+    apply_pending()
+    paid_order.refresh_from_db()
+    assert paid_order.payment.amount_refunded == 9.5
+    assert DailySales.objects.get().refunded == 9.5
+
+    today = timezone.localdate()
+    rebuild(today, today)
+    assert DailySales.objects.get().refunded == 9.5